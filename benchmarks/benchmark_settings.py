@@ -0,0 +1,21 @@
+# Settings used by benchmarks/run.py, set DJANGO_SETTINGS_MODULE to run the
+# benchmarks against another database
+import os
+
+from representatives_votes.tests.settings import *  # noqa
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCHMARK_DATABASE', 'benchmark.db'),
+    }
+}
+
+# Do not keep every query in memory, that would be measured as well
+DEBUG = False
+
+LOGGING['loggers']['representatives_votes']['level'] = 'WARNING'  # noqa
+LOGGING['loggers']['representatives']['level'] = 'WARNING'  # noqa
+
+# Host of the requests made up by serializers.py
+ALLOWED_HOSTS = ['testserver']
@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+Compare reading a compressed parltrack dump with open_dump() against the
+decompress-then-pipe workflow:
+
+    xz -dk ep_votes.json.xz && cat ep_votes.json | parltrack_import_votes
+
+Only the reading and JSON parsing are measured, nothing is imported. Each
+mode runs in its own process so that peak RSS are not mixed up.
+
+Usage: python benchmarks/dump_reading.py ep_votes.json.xz [buffer sizes...]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import ijson
+
+from representatives_votes.contrib.utils import open_dump
+
+
+def _peak_rss():
+    # Kilobytes on Linux, for this process and its waited for children
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def _count(stream):
+    return sum(1 for item in ijson.items(stream, 'item'))
+
+
+def run_streamed(path, buffer_size):
+    start = time.time()
+    with open_dump(path, buffer_size) as f:
+        count = _count(f)
+    return dict(items=count, seconds=time.time() - start, disk_bytes=0)
+
+
+def run_piped(path, buffer_size):
+    start = time.time()
+    fd, decompressed = tempfile.mkstemp(suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            subprocess.check_call(['xz', '--decompress', '--stdout', path],
+                                  stdout=f)
+
+        cat = subprocess.Popen(['cat', decompressed], stdout=subprocess.PIPE)
+        count = _count(cat.stdout)
+        cat.wait()
+        disk = os.path.getsize(decompressed)
+    finally:
+        os.unlink(decompressed)
+
+    return dict(items=count, seconds=time.time() - start, disk_bytes=disk)
+
+
+def child(mode, path, buffer_size):
+    runner = run_streamed if mode == 'streamed' else run_piped
+    result = runner(path, buffer_size)
+    result['peak_rss_kb'] = _peak_rss()
+    print json.dumps(result)
+
+
+def main():
+    if sys.argv[1] == '--child':
+        return child(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+
+    path = sys.argv[1]
+    buffer_sizes = [int(s) for s in sys.argv[2:]] or [64 * 1024, 1024 * 1024]
+
+    runs = [('piped', buffer_sizes[0])]
+    runs += [('streamed', b) for b in buffer_sizes]
+
+    print '%-10s %10s %10s %10s %12s %12s' % (
+        'mode', 'buffer', 'seconds', 'items/s', 'peak RSS MB', 'disk MB')
+    for mode, buffer_size in runs:
+        output = subprocess.check_output([
+            sys.executable, __file__, '--child', mode, path,
+            str(buffer_size)])
+        result = json.loads(output)
+        print '%-10s %10s %10.2f %10.0f %12.1f %12.1f' % (
+            mode, buffer_size if mode == 'streamed' else '-',
+            result['seconds'], result['items'] / result['seconds'],
+            result['peak_rss_kb'] / 1024., result['disk_bytes'] / 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+# coding: utf-8
+"""
+Generate synthetic parltrack and francedata dumps of any size, along with a
+fixture of the representatives they refer to.
+
+Usage: python benchmarks/generate.py OUTPUT_DIR [--proposals 20000]
+           [--meps 750] [--scrutins 2000] [--deputes 577] ...
+
+OUTPUT_DIR receives representatives.json, to load with loaddata first, and
+one dump per importer:
+
+    parltrack_dossiers.json   parltrack_import_dossiers
+    parltrack_votes.json      parltrack_import_votes
+    francedata_dossiers.json  francedata_import_dossiers
+    francedata_scrutins.json  francedata_import_scrutins
+    francedata_votes.json     francedata_import_votes
+
+Dumps are written one record at a time, so generating millions of votes
+does not need much memory.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+
+EP_URL = 'http://www.europarl.europa.eu/meps/en/%s/_home.html'
+EP_DOSSIER_URL = ('http://www.europarl.europa.eu/oeil/popups/'
+                  'ficheprocedure.do?reference=%s&l=en')
+AN_REP_URL = 'http://www.assemblee-nationale.fr/14/tribun/fiches_id/%s.asp'
+AN_DOSSIER_URL = 'http://www.assemblee-nationale.fr/14/dossiers/dossier_%s.asp'
+AN_SCRUTIN_URL = ('http://www.assemblee-nationale.fr/scrutins/detail/'
+                  '(legislature)/14/(num)/%s')
+
+EP_GROUPS = ['PPE', 'S&D', 'ECR', 'ALDE', 'GUE/NGL', 'Verts/ALE', 'EFDD',
+             'ENF', 'NI']
+AN_GROUPS = ['SRC', 'UMP', 'UDI', 'RRDP', 'ECOLO', 'GDR', 'NI']
+
+# Scrutin subjects are very often the same, which is what makes unique
+# proposal titles expensive
+SCRUTIN_SUBJECTS = [
+    u"l'ensemble du projet de loi",
+    u"l'amendement n° %s",
+    u"l'article premier",
+    u"la motion de rejet préalable",
+]
+
+FIRST_NAMES = [u'Anne', u'Benoît', u'Céline', u'Jean-Marc', u'Éric',
+               u'Marie-Hélène', u'Olivier', u'Zoé']
+LAST_NAMES = [u'Dupont', u'Le Roux', u'de La Verpillière', u'Müller',
+              u'García', u"D'Alembert", u'Nguyen', u'Van der Berg']
+
+
+def _start_date():
+    return datetime.datetime(2014, 7, 1, 9)
+
+
+def mep_ids(meps):
+    return [100000 + i for i in range(meps)]
+
+
+def depute_name(i):
+    return (FIRST_NAMES[i % len(FIRST_NAMES)],
+            u'%s %s' % (LAST_NAMES[i % len(LAST_NAMES)], i))
+
+
+def representatives(meps, deputes):
+    """
+    Yield fixture objects for meps MEPs and deputes French deputies
+    """
+    pk = 0
+    for ep_id in mep_ids(meps):
+        pk += 1
+        yield _representative(pk, u'Mep %s' % ep_id)
+        yield _website(pk, EP_URL % ep_id, 'EP')
+
+    for i in range(deputes):
+        pk += 1
+        first, last = depute_name(i)
+        yield _representative(pk, u'%s %s' % (first, last))
+        yield _website(pk, AN_REP_URL % i, 'AN')
+
+
+def _representative(pk, full_name):
+    return {
+        'model': 'representatives.representative',
+        'pk': pk,
+        'fields': {
+            'slug': 'rep-%s' % pk,
+            'full_name': full_name,
+            'created': '2016-01-01T00:00:00Z',
+            'updated': '2016-01-01T00:00:00Z',
+        },
+    }
+
+
+def _website(pk, url, kind):
+    return {
+        'model': 'representatives.website',
+        'pk': pk,
+        'fields': {
+            'representative': pk,
+            'url': url,
+            'kind': kind,
+            'created': '2016-01-01T00:00:00Z',
+            'updated': '2016-01-01T00:00:00Z',
+        },
+    }
+
+
+def parltrack_reference(i):
+    return '2015/%04d(COD)' % i
+
+
+def parltrack_dossiers(dossiers):
+    for i in range(dossiers):
+        reference = parltrack_reference(i)
+        yield {
+            'meta': {'source': EP_DOSSIER_URL % reference},
+            'procedure': {
+                'reference': reference,
+                'title': u'Synthetic dossier %s' % i,
+            },
+        }
+
+
+def parltrack_votes(proposals, meps, dossiers, seed=0):
+    rand = random.Random(seed)
+    ids = mep_ids(meps)
+    groups = dict((ep_id, EP_GROUPS[ep_id % len(EP_GROUPS)]) for ep_id in ids)
+
+    for i in range(proposals):
+        data = {
+            '_id': '%024x' % i,
+            'epref': parltrack_reference(i % dossiers),
+            'title': u'A8-%04d/2015 - Rapporteur - Am %s' % (i // 10, i),
+            'report': u'A8-%04d/2015' % (i // 10),
+            'issue_type': u'Am %s' % i,
+            'ts': (_start_date() + datetime.timedelta(minutes=i)).isoformat(),
+        }
+
+        positions = dict((p, {}) for p in ('For', 'Against', 'Abstain'))
+        for ep_id in ids:
+            # About 10% of MEPs do not take part in each vote
+            if rand.random() < .1:
+                continue
+            position = rand.choice(['For', 'For', 'Against', 'Abstain'])
+            positions[position].setdefault(groups[ep_id], []).append({
+                'ep_id': ep_id,
+                'name': u'Mep %s' % ep_id,
+                'orig': u'Mep %s' % ep_id,
+            })
+
+        for position, by_group in positions.items():
+            data[position] = {
+                'total': str(sum(len(v) for v in by_group.values())),
+                'groups': [{'group': g, 'votes': v}
+                           for g, v in sorted(by_group.items())],
+            }
+
+        yield data
+
+
+def francedata_dossiers(dossiers):
+    for i in range(dossiers):
+        yield {
+            'chambre': 'AN',
+            'url_an': AN_DOSSIER_URL % i,
+            'titre': u'Dossier synthétique %s' % i,
+        }
+
+
+def francedata_scrutins(scrutins, dossiers):
+    for i in range(scrutins):
+        subject = SCRUTIN_SUBJECTS[i % len(SCRUTIN_SUBJECTS)]
+        if '%s' in subject:
+            subject = subject % i
+        yield {
+            'chambre': 'AN',
+            'numero': str(i),
+            'url': AN_SCRUTIN_URL % i,
+            'dossier_url': AN_DOSSIER_URL % (i % dossiers),
+            'objet': subject,
+            'date': (_start_date() + datetime.timedelta(days=i // 20))
+            .strftime('%Y-%m-%d'),
+        }
+
+
+def francedata_votes(scrutins, deputes, seed=0):
+    rand = random.Random(seed)
+    for i in range(scrutins):
+        for depute in range(deputes):
+            if rand.random() < .5:
+                continue
+
+            data = {
+                'chambre': 'AN',
+                'scrutin_url': AN_SCRUTIN_URL % i,
+                'groupe': AN_GROUPS[depute % len(AN_GROUPS)],
+                'division': rand.choice(['Pour', 'Contre', 'Abstention']),
+            }
+
+            # Deputies are identified by url or by name in francedata dumps
+            if depute % 2:
+                data['parl_url'] = AN_REP_URL % depute
+            else:
+                data['prenom'], data['nom'] = depute_name(depute)
+
+            yield data
+
+
+def write_dump(path, items):
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for i, item in enumerate(items):
+            if i:
+                f.write(',\n')
+            f.write(json.dumps(item))
+        f.write('\n]\n')
+
+
+def generate(output, proposals=20000, meps=750, dossiers=None,
+             scrutins=2000, deputes=577, france_dossiers=None, seed=0):
+    """
+    Write the representatives fixture and all dumps to the output directory
+    """
+    dossiers = dossiers or max(proposals // 20, 1)
+    france_dossiers = france_dossiers or max(scrutins // 20, 1)
+
+    if not os.path.exists(output):
+        os.makedirs(output)
+
+    def path(name):
+        return os.path.join(output, '%s.json' % name)
+
+    write_dump(path('representatives'), representatives(meps, deputes))
+    write_dump(path('parltrack_dossiers'), parltrack_dossiers(dossiers))
+    write_dump(path('parltrack_votes'),
+               parltrack_votes(proposals, meps, dossiers, seed))
+    write_dump(path('francedata_dossiers'),
+               francedata_dossiers(france_dossiers))
+    write_dump(path('francedata_scrutins'),
+               francedata_scrutins(scrutins, france_dossiers))
+    write_dump(path('francedata_votes'),
+               francedata_votes(scrutins, deputes, seed))
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('output', help='Directory receiving the dumps')
+    parser.add_argument('--proposals', type=int, default=20000,
+        help='Number of parltrack proposals')
+    parser.add_argument('--meps', type=int, default=750,
+        help='Number of MEPs voting on each proposal')
+    parser.add_argument('--dossiers', type=int, default=None,
+        help='Number of parltrack dossiers, defaults to proposals / 20')
+    parser.add_argument('--scrutins', type=int, default=2000,
+        help='Number of francedata scrutins')
+    parser.add_argument('--deputes', type=int, default=577,
+        help='Number of French deputies')
+    parser.add_argument('--france-dossiers', type=int, default=None,
+        help='Number of francedata dossiers, defaults to scrutins / 20')
+    parser.add_argument('--seed', type=int, default=0,
+        help='Seed of the random positions')
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    generate(args.output, args.proposals, args.meps, args.dossiers,
+             args.scrutins, args.deputes, args.france_dossiers, args.seed)
+
+
+if __name__ == '__main__':
+    main()
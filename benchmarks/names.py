@@ -0,0 +1,49 @@
+# coding: utf-8
+"""
+Time fuzzy NameIndex lookups of random names with a typo, which the test
+suite only checks by the number of names they score.
+
+Usage: python benchmarks/names.py [names] [lookups]
+"""
+import random
+import sys
+import time
+
+from representatives_votes.contrib.names import NameIndex
+
+LETTERS = u'abcdefghijklmnopqrstuvwxyzéè'
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 12000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    rand = random.Random(0)
+
+    def word():
+        return u''.join(rand.choice(LETTERS) for i in range(rand.randint(
+            4, 10))).capitalize()
+
+    names = [u'%s %s' % (word(), word()) for i in range(count)]
+    start = time.time()
+    index = NameIndex((name, pk) for pk, name in enumerate(names))
+    indexing = time.time() - start
+
+    start = time.time()
+    for i in range(lookups):
+        name = rand.choice(names)
+        # Drop a letter
+        index.get(name[:3] + name[4:])
+    elapsed = time.time() - start
+
+    stats = index.stats()
+    print 'indexed %s names in %.2fs' % (count, indexing)
+    print '%s lookups in %.2fs, %.3f ms each, %.3f ms at most' % (
+        lookups, elapsed, elapsed * 1000 / lookups, stats['fuzzy_max_ms'])
+    print '%.1f names scored per lookup' % (
+        float(stats['fuzzy_scored']) / lookups)
+    print 'lookups: %s' % stats['lookups']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+# coding: utf-8
+"""
+Run every importer on synthetic dumps and compare their wall time, queries
+per record and peak memory with a saved baseline.
+
+Usage: python benchmarks/run.py [--proposals 200] [--meps 750] ...
+           [--save-baseline] [--baseline benchmarks/baseline.json]
+
+Dumps are made by generate.py in a temporary directory, then each importer
+runs twice in its own process against a fresh database: an initial import
+and a re-import of the same dump, which is what nightly imports mostly do,
+with a dry run of that re-import in between.
+
+With --workers N, parltrack_import_votes also imports its dump with N
+processes into a fresh database, to be compared with its serial initial
+import. SQLite does not support concurrent writers: this needs another
+database engine, see benchmark_settings.py.
+
+The run fails when a figure is worse than the baseline by more than
+--threshold. Baselines only compare with runs of the same scale on the same
+database engine: save one with --save-baseline before changing either.
+"""
+import argparse
+import importlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import generate
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+IMPORTERS = [
+    ('parltrack_import_dossiers',
+     'representatives_votes.contrib.parltrack.import_dossiers',
+     'parltrack_dossiers'),
+    ('parltrack_import_votes',
+     'representatives_votes.contrib.parltrack.import_votes',
+     'parltrack_votes'),
+    ('francedata_import_dossiers',
+     'representatives_votes.contrib.francedata.import_dossiers',
+     'francedata_dossiers'),
+    ('francedata_import_scrutins',
+     'representatives_votes.contrib.francedata.import_scrutins',
+     'francedata_scrutins'),
+    ('francedata_import_votes',
+     'representatives_votes.contrib.francedata.import_votes',
+     'francedata_votes'),
+]
+
+# Importer timed with --workers against its serial initial import
+SHARDED = 'representatives_votes.contrib.parltrack.import_votes'
+
+# Phases of each importer run and their extra arguments
+PHASES = [
+    ('initial', []),
+    ('dry-run', ['--dry-run']),
+    ('reimport', []),
+]
+
+# Figures compared with the baseline, lower is better for all of them
+FIGURES = ['seconds', 'queries_per_record', 'peak_rss_mb']
+
+# Differences below these are noise, whatever the threshold
+TOLERANCES = {'seconds': 1, 'queries_per_record': 0, 'peak_rss_mb': 5}
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmark_settings')
+    import django
+    django.setup()
+
+
+def setup_database(fixture):
+    """
+    Create a fresh database with the representatives of the dumps
+    """
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connections
+
+    database = settings.DATABASES['default']
+    if database['ENGINE'].endswith('sqlite3') and os.path.exists(
+            database['NAME']):
+        os.unlink(database['NAME'])
+    else:
+        call_command('flush', interactive=False, verbosity=0)
+
+    call_command('migrate', interactive=False, verbosity=0)
+    call_command('loaddata', fixture, verbosity=0)
+
+    # Importers run in child processes, do not keep the database locked
+    connections.close_all()
+    return database['ENGINE'].split('.')[-1]
+
+
+def child(module, dump, report, batch_size, *args):
+    """
+    Run an importer, then print its peak RSS for the parent to read
+    """
+    sys.argv = [module, dump, '--metrics', report] + list(args)
+    if batch_size:
+        sys.argv += ['--batch-size', str(batch_size)]
+    importlib.import_module(module).main()
+
+    # Kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print json.dumps({'peak_rss_kb': rss})
+
+
+def run_importer(module, dump, batch_size, workdir, args):
+    report_path = os.path.join(workdir, 'report.json')
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--child', module, dump,
+        report_path, str(batch_size or 0)] + args)
+
+    with open(report_path) as f:
+        report = json.load(f)
+    rss = json.loads(output.strip().split('\n')[-1])['peak_rss_kb']
+
+    records = report['records']
+    return {
+        'records': records,
+        'seconds': report['seconds'],
+        'queries': report['queries']['count'],
+        'queries_per_record': round(
+            float(report['queries']['count']) / records, 2) if records else 0,
+        'peak_rss_mb': round(rss / 1024., 1),
+    }
+
+
+def run(args, workdir):
+    scale = {
+        'proposals': args.proposals,
+        'meps': args.meps,
+        'scrutins': args.scrutins,
+        'deputes': args.deputes,
+        'france_dossiers': args.france_dossiers,
+        'batch_size': args.batch_size,
+        'workers': args.workers,
+    }
+
+    os.environ.setdefault('BENCHMARK_DATABASE',
+                          os.path.join(workdir, 'benchmark.db'))
+    setup_django()
+
+    from django.db import connection
+    if args.workers > 1 and connection.vendor == 'sqlite':
+        sys.exit('SQLite does not support concurrent writers, --workers '
+                 'needs another database')
+
+    print >>sys.stderr, 'Generating dumps in %s' % workdir
+    generate.generate(workdir, args.proposals, args.meps,
+                      scrutins=args.scrutins, deputes=args.deputes,
+                      france_dossiers=args.france_dossiers)
+
+    fixture = os.path.join(workdir, 'representatives.json')
+    scale['engine'] = setup_database(fixture)
+
+    results = {}
+    for name, module, dump in IMPORTERS:
+        for phase, importer_args in PHASES:
+            print >>sys.stderr, 'Running %s (%s)' % (name, phase)
+            results['%s %s' % (name, phase)] = run_importer(
+                module, os.path.join(workdir, '%s.json' % dump),
+                args.batch_size, workdir, importer_args)
+
+    if args.workers > 1:
+        # Into a fresh database, after the dossiers the proposals belong to
+        setup_database(fixture)
+        for name, module, dump in IMPORTERS[:2]:
+            importer_args = []
+            if module == SHARDED:
+                importer_args = ['--workers', str(args.workers)]
+                print >>sys.stderr, 'Running %s (%s workers)' % (
+                    name, args.workers)
+            result = run_importer(
+                module, os.path.join(workdir, '%s.json' % dump),
+                args.batch_size, workdir, importer_args)
+
+        serial = results['%s initial' % name]['seconds']
+        results['%s workers' % name] = result
+        print >>sys.stderr, '%s: %ss serial, %ss with %s workers, %.2fx ' \
+            'speedup' % (name, serial, result['seconds'], args.workers,
+                         serial / result['seconds'] if result['seconds']
+                         else 1)
+
+    return {'scale': scale, 'results': results}
+
+
+def compare(current, baseline, threshold):
+    """
+    Print current figures next to the baseline ones, return the number of
+    regressions
+    """
+    if current['scale'] != baseline['scale']:
+        print >>sys.stderr, ('Baseline was made at another scale: %s'
+                             % baseline['scale'])
+        return None
+
+    regressions = 0
+    print '%-36s %-18s %10s %10s %8s' % ('importer', 'figure', 'baseline',
+                                         'current', 'change')
+    for key in sorted(current['results']):
+        result = current['results'][key]
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+
+        for figure in FIGURES:
+            before, after = reference[figure], result[figure]
+            change = (after - before) / before if before else 0
+            regressed = (change > threshold and
+                         after - before > TOLERANCES[figure])
+            regressions += regressed
+            print '%-36s %-18s %10s %10s %+7.0f%%%s' % (
+                key, figure, before, after, change * 100,
+                ' REGRESSION' if regressed else '')
+
+    return regressions
+
+
+def print_results(current):
+    print '%-36s %8s %10s %10s %10s' % ('importer', 'records', 'seconds',
+                                        'queries/r', 'RSS MB')
+    for key in sorted(current['results']):
+        result = current['results'][key]
+        print '%-36s %8s %10s %10s %10s' % (
+            key, result['records'], result['seconds'],
+            result['queries_per_record'], result['peak_rss_mb'])
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--proposals', type=int, default=200,
+        help='Number of parltrack proposals')
+    parser.add_argument('--meps', type=int, default=750,
+        help='Number of MEPs voting on each proposal')
+    parser.add_argument('--scrutins', type=int, default=50,
+        help='Number of francedata scrutins')
+    parser.add_argument('--deputes', type=int, default=577,
+        help='Number of French deputies')
+    parser.add_argument('--france-dossiers', type=int, default=50,
+        help='Number of francedata dossiers')
+    parser.add_argument('--batch-size', type=int, default=None,
+        help='Number of records imported in each transaction, defaults to '
+             'the default of each importer')
+    parser.add_argument('--workers', type=int, default=1,
+        help='Also time parltrack_import_votes with that many processes')
+    parser.add_argument('--baseline', default=BASELINE,
+        help='Path to the baseline, defaults to benchmarks/baseline.json')
+    parser.add_argument('--save-baseline', action='store_true',
+        help='Save the figures of this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=.2,
+        help='Relative increase reported as a regression')
+    parser.add_argument('--workdir',
+        help='Keep dumps and database there instead of a temporary dir')
+    return parser
+
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        setup_django()
+        return child(sys.argv[2], sys.argv[3], sys.argv[4],
+                     int(sys.argv[5]), *sys.argv[6:])
+
+    args = argument_parser().parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='benchmark')
+    try:
+        current = run(args, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=4, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+        print_results(current)
+        return
+
+    if not os.path.exists(args.baseline):
+        print_results(current)
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(current, baseline, args.threshold)
+    if regressions is None:
+        print_results(current)
+        sys.exit(2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
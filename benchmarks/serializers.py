@@ -0,0 +1,123 @@
+# coding: utf-8
+"""
+Compare the throughput of the hyperlinked API serializers with the values()
+serializers of ?flat=1 on synthetic votes and proposals.
+
+Usage: python benchmarks/serializers.py [--objects 10000] [--repeat 3]
+
+A fresh database is made in a temporary directory, set DJANGO_SETTINGS_MODULE
+to use another one. Each mode is timed from the query to the serialized
+data, the best of --repeat runs is kept.
+"""
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+def setup(workdir, objects):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmark_settings')
+    os.environ.setdefault('BENCHMARK_DATABASE',
+                          os.path.join(workdir, 'benchmark.db'))
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    from django.utils import timezone
+    from representatives.models import Representative
+    from representatives_votes.models import Dossier, Proposal, Vote
+
+    call_command('migrate', interactive=False, verbosity=0)
+
+    dossier = Dossier.objects.create(title='Benchmark', reference='bench')
+    reps = 100
+    Representative.objects.bulk_create([
+        Representative(slug='rep-%s' % i, full_name='Rep %s' % i)
+        for i in range(reps)])
+    rep_ids = list(Representative.objects.values_list('pk', flat=True))
+
+    start = timezone.now()
+    Proposal.objects.bulk_create([
+        Proposal(dossier=dossier, title='Proposal %s' % i,
+                 datetime=start + datetime.timedelta(minutes=i),
+                 total_for=0, total_against=0, total_abstain=0)
+        for i in range(objects)], batch_size=100)
+    proposal_ids = list(Proposal.objects.values_list('pk', flat=True)
+                        [:objects // reps + 1])
+
+    Vote.objects.bulk_create([
+        Vote(proposal_id=proposal_ids[i // reps],
+             representative_id=rep_ids[i % reps], position='for')
+        for i in range(objects)], batch_size=100)
+
+
+def best(function, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        count = len(function())
+        timings.append(time.time() - start)
+    return count, min(timings)
+
+
+def modes():
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from representatives_votes import serializers
+    from representatives_votes.models import Proposal, Vote
+
+    context = {'request': Request(APIRequestFactory().get('/'))}
+
+    def hyperlinked(serializer, queryset):
+        return lambda: serializer(queryset.all(), many=True,
+                                  context=context).data
+
+    def flat(serializer, queryset):
+        return lambda: serializer(
+            queryset.values(*serializer.lookups()), many=True).data
+
+    votes = Vote.objects.select_related('representative', 'proposal')
+    return [
+        ('votes hyperlinked',
+         hyperlinked(serializers.VoteSerializer, votes)),
+        ('votes flat', flat(serializers.VoteValuesSerializer, votes)),
+        ('proposals hyperlinked',
+         hyperlinked(serializers.ProposalSerializer, Proposal.objects)),
+        ('proposals flat',
+         flat(serializers.ProposalValuesSerializer, Proposal.objects)),
+    ]
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--objects', type=int, default=10000,
+        help='Number of votes and of proposals')
+    parser.add_argument('--repeat', type=int, default=3,
+        help='Number of runs of each mode')
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='benchmark')
+    try:
+        print >>sys.stderr, 'Creating %s votes and proposals' % args.objects
+        setup(workdir, args.objects)
+
+        print '%-24s %8s %10s %12s' % ('mode', 'objects', 'seconds',
+                                       'objects/s')
+        for name, function in modes():
+            count, seconds = best(function, args.repeat)
+            print '%-24s %8s %10.3f %12.0f' % (name, count, seconds,
+                                               count / seconds)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
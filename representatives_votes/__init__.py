@@ -0,0 +1 @@
+default_app_config = 'representatives_votes.apps.RepresentativesVotesConfig'
@@ -0,0 +1,156 @@
+# coding: utf-8
+import threading
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    # Install the agreement extra to compute agreements
+    numpy = None
+
+from representatives_votes import export
+from representatives_votes.models import ImportGeneration, Vote
+
+# Codes of positions in the matrix, 0 is no vote
+CODES = {'for': 1, 'against': 2, 'abstain': 3}
+
+# Generations an agreement depends on
+SCOPES = ('document', 'dossier', 'proposal', 'vote')
+
+# Number of agreements kept in memory, one per filter set
+CACHE_SIZE = 8
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class Agreement(object):
+    """
+    How often each pair of representatives voted the same way, out of the
+    proposals they both voted on, from a dense representatives x proposals
+    matrix of position codes.
+
+    Pairs are compared all at once: for each position, a product of the
+    one-hot matrix of that position by its transpose counts the proposals
+    where two representatives took it.
+    """
+
+    def __init__(self, representatives, proposals, positions):
+        self.representatives = representatives
+        self.proposals = proposals
+        self.index = {pk: i for i, pk in enumerate(representatives)}
+        self.ids = numpy.array(representatives, dtype=numpy.int64)
+
+        same = numpy.zeros((len(representatives),) * 2, dtype=numpy.int32)
+        voted = numpy.zeros(positions.shape, dtype=numpy.float32)
+        for code in CODES.values():
+            matrix = (positions == code).astype(numpy.float32)
+            same += numpy.rint(matrix.dot(matrix.T)).astype(numpy.int32)
+            voted += matrix
+
+        # Number of proposals both representatives voted on
+        self.common = numpy.rint(voted.dot(voted.T)).astype(numpy.int32)
+        self.same = same
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self.ratios = numpy.where(self.common > 0,
+                                      same / self.common.astype(float),
+                                      numpy.nan)
+
+    @classmethod
+    def from_votes(cls, votes):
+        """
+        Build the matrix of votes streamed by one query
+        """
+        representatives = {}
+        proposals = {}
+        rows = array('l')
+        columns = array('l')
+        codes = array('b')
+
+        rows_iterator = votes.filter(representative_id__isnull=False) \
+            .order_by().values_list('representative_id', 'proposal_id',
+                                    'position').iterator()
+        for representative_id, proposal_id, position in rows_iterator:
+            code = CODES.get(position)
+            if code is None:
+                continue
+            rows.append(representatives.setdefault(
+                representative_id, len(representatives)))
+            columns.append(proposals.setdefault(proposal_id, len(proposals)))
+            codes.append(code)
+
+        positions = numpy.zeros((len(representatives), len(proposals)),
+                                dtype=numpy.int8)
+        positions[numpy.asarray(rows, dtype=numpy.intp),
+                  numpy.asarray(columns, dtype=numpy.intp)] = \
+            numpy.asarray(codes, dtype=numpy.int8)
+
+        return cls(_keys(representatives), _keys(proposals), positions)
+
+    def top(self, representative_id, k=10, min_common=1):
+        """
+        Return the k representatives most and least in agreement with a
+        representative, among those who voted on at least min_common
+        proposals with them, as lists of dicts
+        """
+        if representative_id not in self.index:
+            raise KeyError(representative_id)
+
+        i = self.index[representative_id]
+        candidates = numpy.flatnonzero(self.common[i] >= max(min_common, 1))
+        candidates = candidates[candidates != i]
+        candidates = candidates[numpy.argsort(self.ids[candidates],
+                                              kind='mergesort')]
+
+        # Stable sorts on the ratio, by representative id on ties
+        ratios = self.ratios[i, candidates]
+        ascending = candidates[numpy.argsort(ratios, kind='mergesort')]
+        descending = candidates[numpy.argsort(-ratios, kind='mergesort')]
+
+        return {
+            'most': [self.pair(i, j) for j in descending[:k]],
+            'least': [self.pair(i, j) for j in ascending[:k]],
+        }
+
+    def pair(self, i, j):
+        return OrderedDict([
+            ('representative', self.representatives[j]),
+            ('agreement', round(float(self.ratios[i, j]), 4)),
+            ('same', int(self.same[i, j])),
+            ('common', int(self.common[i, j])),
+        ])
+
+
+def _keys(index):
+    keys = [None] * len(index)
+    for key, i in index.items():
+        keys[i] = key
+    return keys
+
+
+def get_agreement(dossier=None, since=None, until=None, chamber=None):
+    """
+    Return the Agreement of votes filtered like export.filter_votes(),
+    cached until the next import changes the generation of SCOPES.
+    Raise ValueError for invalid filters.
+    """
+    votes = export.filter_votes(Vote.objects.all(), dossier=dossier,
+                                since=since, until=until, chamber=chamber)
+    generations = ImportGeneration.current(SCOPES)
+    key = (tuple(generations.get(s, (0, None))[0] for s in SCOPES),
+           dossier, since, until, chamber)
+
+    with _lock:
+        if key in _cache:
+            agreement = _cache.pop(key)
+            _cache[key] = agreement
+            return agreement
+
+    agreement = Agreement.from_votes(votes)
+
+    with _lock:
+        _cache[key] = agreement
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return agreement
@@ -1,26 +1,360 @@
+import calendar
+from collections import OrderedDict, defaultdict
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import (
+    http_date,
+    parse_etags,
+    parse_http_date_safe,
+    quote_etag,
+)
+
 from .models import (
     Dossier,
+    GroupVote,
+    ImportGeneration,
     Proposal,
+    RepresentativeVoteStats,
     Vote
 )
 
 from rest_framework import (
     filters,
+    status,
     viewsets,
 )
+from rest_framework.exceptions import APIException, NotFound, ParseError
+from rest_framework.relations import RelatedField
+from rest_framework.response import Response
 
 from representatives.api import DefaultWebPagination
 
+from representatives_votes import agreement, export, search
+from representatives_votes.cache import get_response_cache
+from representatives_votes.pagination import (
+    KeysetPagination,
+    KeysetPaginationMixin,
+    VoteKeysetPagination,
+)
+
 from representatives_votes.serializers import (
     DossierDetailSerializer,
     DossierSerializer,
+    DossierValuesSerializer,
+    GroupVoteSerializer,
     ProposalDetailSerializer,
     ProposalSerializer,
+    ProposalValuesSerializer,
+    RepresentativeVoteStatsSerializer,
+    ValuesSerializer,
     VoteSerializer,
+    VoteValuesSerializer,
 )
 
 
-class DossierViewSet(viewsets.ReadOnlyModelViewSet):
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+
+class MissingDependency(APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = 'A package this endpoint needs is not installed.'
+
+
+class ConditionalGetMixin(object):
+    """
+    Give responses an ETag and a Last-Modified header made from the
+    generations of the models they are computed from, and answer requests
+    which already have them with 304 Not Modified after a single query.
+    """
+
+    generation_scopes = ()
+
+    def initial(self, request, *args, **kwargs):
+        super(ConditionalGetMixin, self).initial(request, *args, **kwargs)
+        self.etag = self.last_modified = self.generations = None
+
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        generations = self.generations = ImportGeneration.current(
+            self.generation_scopes)
+        self.etag = self.get_etag(request, generations)
+        updated = [u for g, u in generations.values()]
+        if updated:
+            self.last_modified = calendar.timegm(max(updated).utctimetuple())
+
+        if self.not_modified(request):
+            raise NotModified()
+
+    def get_etag(self, request, generations):
+        return '%s-%s' % (request.accepted_renderer.format, '.'.join(
+            str(generations.get(scope, (0, None))[0])
+            for scope in self.generation_scopes))
+
+    def not_modified(self, request):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return self.etag in etags or '*' in etags
+
+        since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE'))
+        return (since is not None and self.last_modified is not None and
+                self.last_modified <= since)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=exc.status_code)
+        return super(ConditionalGetMixin, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ConditionalGetMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+
+        if response.status_code in (200, 304) and self.etag is not None:
+            response['ETag'] = quote_etag(self.etag)
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+
+class CacheHit(Exception):
+    def __init__(self, content, headers):
+        self.content = content
+        self.headers = headers
+
+
+class ResponseCacheMixin(object):
+    """
+    Serve GET requests from the responses to the same requests made since
+    the generation_scopes of ConditionalGetMixin last changed, see
+    cache.ResponseCache. Responses tell whether they came from the cache
+    with an X-Cache header.
+
+    Comes before ConditionalGetMixin, which answers 304 before the cache
+    is looked at. The ETag the cache is keyed on also has the versions of
+    the scopes, so that a save makes clients revalidate as it makes the
+    cache miss.
+    """
+
+    # Headers set by ConditionalGetMixin for each response
+    uncached_headers = ('etag', 'last-modified')
+
+    def initial(self, request, *args, **kwargs):
+        self.cache_key = None
+        super(ResponseCacheMixin, self).initial(request, *args, **kwargs)
+
+        response_cache = get_response_cache()
+        if response_cache is None or self.etag is None:
+            return
+
+        self.cache_key = response_cache.key(request, self.etag)
+        if self.cache_key is None:
+            return
+
+        cached = response_cache.get(self.cache_key)
+        if cached is not None:
+            raise CacheHit(*cached)
+
+    def get_etag(self, request, generations):
+        etag = super(ResponseCacheMixin, self).get_etag(request, generations)
+        response_cache = get_response_cache()
+        if response_cache is None:
+            return etag
+        return '%s-%s' % (etag, '.'.join(
+            str(v) for v in response_cache.versions(self.generation_scopes)))
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CacheHit):
+            self.cache_key = None
+            response = HttpResponse(exc.content)
+            for name, value in exc.headers:
+                response[name] = value
+            response['X-Cache'] = 'HIT'
+            return response
+        return super(ResponseCacheMixin, self).handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ResponseCacheMixin, self).finalize_response(
+            request, response, *args, **kwargs)
+
+        if self.cache_key is not None and response.status_code == 200 \
+                and not response.streaming:
+            response.render()
+            get_response_cache().set(self.cache_key, (
+                response.content,
+                [(name, value) for name, value in response.items()
+                 if name.lower() not in self.uncached_headers],
+            ))
+            response['X-Cache'] = 'MISS'
+        return response
+
+
+class ValuesSerializerMixin(object):
+    """
+    Serialize lists with values_serializer_class from QuerySet.values()
+    when requested with ?flat=1, giving primary keys instead of hyperlinks
+    of related objects, without making model instances nor reversing urls.
+    """
+
+    values_serializer_class = None
+    values_query_param = 'flat'
+
+    def use_values(self):
+        return (self.action == 'list' and
+                self.values_serializer_class is not None and
+                self.request.query_params.get(self.values_query_param)
+                in ('1', 'true'))
+
+    def get_queryset(self):
+        queryset = super(ValuesSerializerMixin, self).get_queryset()
+        if not self.use_values():
+            return queryset
+
+        lookups = self.get_values_lookups()
+        # Keyset pagination needs the values of its ordering
+        lookups += [f for f in getattr(self.paginator, 'ordering', ())
+                    if f not in lookups]
+        return queryset.values(*lookups)
+
+    def get_values_lookups(self):
+        return self.values_serializer_class.lookups()
+
+    def get_serializer_class(self):
+        if self.use_values():
+            return self.values_serializer_class
+        return super(ValuesSerializerMixin, self).get_serializer_class()
+
+
+class SparseFieldsMixin(object):
+    """
+    Only serialize the fields listed in ?fields=a,b, or all but the ones in
+    ?omit=a,b, and only read the columns they need from the database, so
+    that large text columns nobody asked for are never read.
+    """
+
+    def get_field_names(self):
+        """
+        Return the names of the fields to serialize, None for all of them
+        """
+        if not hasattr(self, '_field_names'):
+            self._field_names = self.parse_field_names()
+        return self._field_names
+
+    def parse_field_names(self):
+        params = self.request.query_params
+        fields, omit = [
+            [n for n in params.get(param, '').split(',') if n]
+            for param in ('fields', 'omit')]
+        if not fields and not omit:
+            return None
+
+        names = self.get_all_field_names()
+        unknown = set(fields + omit) - set(names)
+        if unknown:
+            raise ParseError('Unknown fields: %s' % ', '.join(sorted(unknown)))
+
+        return [n for n in names
+                if (not fields or n in fields) and n not in omit]
+
+    def get_all_field_names(self):
+        serializer_class = self.get_serializer_class()
+        if issubclass(serializer_class, ValuesSerializer):
+            return [name for name, lookup in serializer_class.fields]
+        return list(serializer_class(
+            context=self.get_serializer_context()).fields)
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(SparseFieldsMixin, self).get_serializer(
+            *args, **kwargs)
+        names = self.get_field_names()
+        if names is None:
+            return serializer
+
+        if isinstance(serializer, ValuesSerializer):
+            serializer.fields = [(name, lookup) for name, lookup
+                                 in serializer.fields if name in names]
+        else:
+            fields = getattr(serializer, 'child', serializer).fields
+            for name in list(fields):
+                if name not in names:
+                    fields.pop(name)
+        return serializer
+
+    def get_values_lookups(self):
+        names = self.get_field_names()
+        if names is None:
+            return super(SparseFieldsMixin, self).get_values_lookups()
+        return [lookup for name, lookup in self.values_serializer_class.fields
+                if name in names]
+
+    def get_queryset(self):
+        queryset = super(SparseFieldsMixin, self).get_queryset()
+        names = self.get_field_names()
+        if names is None or issubclass(self.get_serializer_class(),
+                                       ValuesSerializer):
+            return queryset
+
+        serializer = self.get_serializer()
+        fields = getattr(serializer, 'child', serializer).fields
+        sources = set(fields[name].source for name in names)
+        # Keyset pagination needs the values of its ordering
+        sources.update(getattr(self.paginator, 'ordering', ()))
+
+        # Hyperlinks to related rows only need their foreign key: only join
+        # the rows of the other fields
+        joined = queryset.query.select_related
+        if isinstance(joined, dict):
+            needed = set(
+                fields[name].source.split('.')[0] for name in names
+                if not isinstance(fields[name], RelatedField) or
+                not fields[name].use_pk_only_optimization())
+            queryset = queryset.select_related(None)
+            if needed & set(joined):
+                queryset = queryset.select_related(*needed & set(joined))
+
+        # Foreign keys are cheap, and may be traversed by select_related()
+        return queryset.defer(*[
+            f.name for f in queryset.model._meta.concrete_fields
+            if not f.primary_key and not f.is_relation and
+            f.name not in sources
+        ])
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    Search the full-text index of the search documents of dossiers and
+    proposals instead of search_fields, and order results by relevance
+    unless ?ordering= is given.
+
+    Until search documents are first computed, by an import or by
+    rebuild_search_index, search_fields are searched instead.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or queryset.model not in search.DOCUMENTS or \
+                not self.documents_computed(view):
+            return super(FullTextSearchFilter, self).filter_queryset(
+                request, queryset, view)
+
+        queryset = search.search(queryset, terms)
+        if 'search_rank' in queryset.query.extra:
+            queryset = queryset.order_by('-search_rank', 'pk')
+        return queryset
+
+    def documents_computed(self, view):
+        # Already looked up by ConditionalGetMixin
+        generations = getattr(view, 'generations', None)
+        if generations is None:
+            generations = ImportGeneration.current(['search'])
+        return generations.get('search', (0, None))[0] > 0
+
+
+class DossierViewSet(ResponseCacheMixin, ConditionalGetMixin,
+                     SparseFieldsMixin, ValuesSerializerMixin,
+                     viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows dossiers to be viewed.
     """
@@ -28,10 +362,12 @@ class DossierViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = DefaultWebPagination
     queryset = Dossier.objects.all()
     serializer_class = DossierSerializer
+    values_serializer_class = DossierValuesSerializer
+    generation_scopes = ('dossier', 'document', 'proposal', 'search')
 
     filter_backends = (
         filters.DjangoFilterBackend,
-        filters.SearchFilter,
+        FullTextSearchFilter,
         filters.OrderingFilter
     )
 
@@ -40,6 +376,7 @@ class DossierViewSet(viewsets.ReadOnlyModelViewSet):
         'reference': ['exact', 'icontains'],
     }
 
+    # What search documents are made of, see search.dossier_texts()
     search_fields = (
         'title',
         'reference',
@@ -51,23 +388,30 @@ class DossierViewSet(viewsets.ReadOnlyModelViewSet):
 
     def retrieve(self, request, pk=None):
         self.serializer_class = DossierDetailSerializer
-        self.queryset = self.queryset.prefetch_related('proposals',
-                                                       'documents')
+        names = self.get_field_names()
+        self.queryset = self.queryset.prefetch_related(*[
+            name for name in ('proposals', 'documents')
+            if names is None or name in names])
         return super(DossierViewSet, self).retrieve(request, pk)
 
 
-class ProposalViewSet(viewsets.ReadOnlyModelViewSet):
+class ProposalViewSet(ResponseCacheMixin, ConditionalGetMixin,
+                      KeysetPaginationMixin, SparseFieldsMixin,
+                      ValuesSerializerMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows proposals to be viewed.
     """
 
     pagination_class = DefaultWebPagination
+    keyset_pagination_class = KeysetPagination
     queryset = Proposal.objects.all()
     serializer_class = ProposalSerializer
+    values_serializer_class = ProposalValuesSerializer
+    generation_scopes = ('dossier', 'proposal', 'vote', 'search')
 
     filter_backends = (
         filters.DjangoFilterBackend,
-        filters.SearchFilter,
+        FullTextSearchFilter,
         filters.OrderingFilter
     )
 
@@ -79,6 +423,7 @@ class ProposalViewSet(viewsets.ReadOnlyModelViewSet):
         'kind': ['exact'],
     }
 
+    # What search documents are made of, see search.proposal_texts()
     search_fields = (
         'title',
         'reference',
@@ -93,14 +438,19 @@ class ProposalViewSet(viewsets.ReadOnlyModelViewSet):
         return super(ProposalViewSet, self).retrieve(request, pk)
 
 
-class VoteViewSet(viewsets.ReadOnlyModelViewSet):
+class VoteViewSet(ResponseCacheMixin, ConditionalGetMixin,
+                  KeysetPaginationMixin, SparseFieldsMixin,
+                  ValuesSerializerMixin, viewsets.ReadOnlyModelViewSet):
     """
     API endpoint that allows proposals to be viewed.
     """
 
     pagination_class = DefaultWebPagination
+    keyset_pagination_class = VoteKeysetPagination
     queryset = Vote.objects.select_related('representative', 'proposal')
     serializer_class = VoteSerializer
+    values_serializer_class = VoteValuesSerializer
+    generation_scopes = ('proposal', 'vote')
 
     filter_backends = (
         filters.DjangoFilterBackend,
@@ -113,3 +463,242 @@ class VoteViewSet(viewsets.ReadOnlyModelViewSet):
         'representative_name': ['exact', 'icontains'],
         'representative': ['exact']
     }
+
+
+class VoteMatrixViewSet(ConditionalGetMixin, viewsets.ViewSet):
+    """
+    API endpoint returning the votes of proposals as a matrix: the ids of
+    the representatives who voted on any of them and, for each proposal,
+    the position code of each of these representatives or null.
+
+    Proposals are selected with ?proposal=1,2,3 in that order, or with
+    ?dossier=1,2 in id order.
+    """
+
+    codes = {'for': 1, 'against': -1, 'abstain': 0}
+    generation_scopes = ('proposal', 'vote')
+
+    # Beyond that, ids would not fit in one query on some databases
+    max_ids = 500
+
+    def get_ids(self, request, name):
+        value = request.query_params.get(name, '')
+        try:
+            ids = [int(i) for i in value.split(',') if i]
+        except ValueError:
+            raise ParseError('%s must be comma separated ids' % name)
+
+        if len(ids) > self.max_ids:
+            raise ParseError('No more than %s %s ids' % (self.max_ids, name))
+        return ids
+
+    def list(self, request):
+        proposals = self.get_ids(request, 'proposal')
+        dossiers = self.get_ids(request, 'dossier')
+
+        votes = Vote.objects.filter(representative_id__isnull=False) \
+            .order_by()
+        if proposals:
+            votes = votes.filter(proposal_id__in=proposals)
+        elif dossiers:
+            votes = votes.filter(proposal__dossier_id__in=dossiers)
+        else:
+            raise ParseError('proposal or dossier ids are required')
+
+        positions = defaultdict(dict)
+        for proposal_id, representative_id, position in votes.values_list(
+                'proposal_id', 'representative_id', 'position'):
+            positions[proposal_id][representative_id] = self.codes[position]
+
+        proposals = proposals or sorted(positions)
+        representatives = sorted(set(
+            pk for votes in positions.values() for pk in votes))
+
+        return Response({
+            'codes': self.codes,
+            'proposals': proposals,
+            'representatives': representatives,
+            'positions': [
+                [positions[proposal].get(pk) for pk in representatives]
+                for proposal in proposals
+            ],
+        })
+
+
+class VoteExportViewSet(ConditionalGetMixin, viewsets.ViewSet):
+    """
+    API endpoint streaming all votes with the keys of their proposal and
+    representative, as NDJSON or with ?output=csv.
+
+    Filter them with ?dossier=<id>, ?chamber=<abbreviation>, and
+    ?since=YYYY-MM-DD or ?until=YYYY-MM-DD on the proposal date.
+    """
+
+    generation_scopes = ('document', 'dossier', 'proposal', 'vote')
+
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv; charset=utf-8',
+    }
+
+    def list(self, request):
+        params = request.query_params
+        output = params.get('output', 'ndjson')
+        if output not in export.FORMATS:
+            raise ParseError('output must be one of %s' %
+                             ', '.join(export.FORMATS))
+
+        try:
+            votes = export.filter_votes(
+                Vote.objects.all(), dossier=self.get_dossier(params),
+                since=params.get('since'), until=params.get('until'),
+                chamber=params.get('chamber'))
+        except ValueError as e:
+            raise ParseError(str(e))
+
+        response = StreamingHttpResponse(
+            export.export_lines(export.iter_votes(votes), output),
+            content_type=self.content_types[output])
+        response['Content-Disposition'] = (
+            'attachment; filename="votes.%s"' % output)
+        return response
+
+    def get_dossier(self, params):
+        dossier = params.get('dossier')
+        if dossier and not dossier.isdigit():
+            raise ValueError('dossier must be an id')
+        return dossier
+
+
+class AgreementViewSet(ConditionalGetMixin, viewsets.ViewSet):
+    """
+    API endpoint returning the representatives who most and least often
+    voted like ?representative=<id>, out of the proposals they both voted
+    on, the ?k=10 (at most 100) of each.
+
+    Votes are filtered like the vote export, and only representatives who
+    voted on at least ?min_common=1 proposals with the given one count.
+    """
+
+    generation_scopes = agreement.SCOPES
+
+    max_k = 100
+
+    def list(self, request):
+        if agreement.numpy is None:
+            raise MissingDependency('numpy is required')
+
+        params = request.query_params
+        representative = self.get_int(params, 'representative', None)
+        if representative is None:
+            raise ParseError('representative id is required')
+        k = self.get_int(params, 'k', 10)
+        if not 1 <= k <= self.max_k:
+            raise ParseError('k must be between 1 and %s' % self.max_k)
+        min_common = self.get_int(params, 'min_common', 1)
+
+        dossier = params.get('dossier')
+        if dossier and not dossier.isdigit():
+            raise ParseError('dossier must be an id')
+        try:
+            matrix = agreement.get_agreement(
+                dossier=dossier, since=params.get('since'),
+                until=params.get('until'), chamber=params.get('chamber'))
+        except ValueError as e:
+            raise ParseError(str(e))
+
+        try:
+            top = matrix.top(representative, k, min_common)
+        except KeyError:
+            raise NotFound('No votes of representative %s' % representative)
+
+        return Response(OrderedDict([
+            ('representative', representative),
+            ('most', top['most']),
+            ('least', top['least']),
+        ]))
+
+    def get_int(self, params, name, default):
+        value = params.get(name)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ParseError('%s must be an integer' % name)
+
+
+class RepresentativeVoteStatsViewSet(ConditionalGetMixin,
+                                     viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows vote statistics of representatives to be
+    viewed, by representative id.
+    """
+
+    pagination_class = DefaultWebPagination
+    queryset = RepresentativeVoteStats.objects.order_by('representative_id')
+    serializer_class = RepresentativeVoteStatsSerializer
+    lookup_field = 'representative'
+    generation_scopes = ('vote_stats',)
+
+    filter_backends = (
+        filters.DjangoFilterBackend,
+        filters.OrderingFilter
+    )
+
+    filter_fields = {
+        'representative': ['exact'],
+        'participation': ['gte', 'lte'],
+        'votes': ['gte', 'lte'],
+    }
+
+    ordering_fields = ['participation', 'votes', 'proposals']
+
+
+class GroupVoteViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows the votes of political groups on proposals to
+    be viewed, with the cohesion of each group.
+
+    Get those of many proposals at once with ?proposal__id__in=1,2,3,
+    filtered on the proposal ids without looking proposals up.
+    """
+
+    pagination_class = DefaultWebPagination
+    queryset = GroupVote.objects.order_by('proposal_id', 'group')
+    serializer_class = GroupVoteSerializer
+    generation_scopes = ('proposal', 'vote')
+
+    filter_backends = (
+        filters.DjangoFilterBackend,
+        filters.OrderingFilter
+    )
+
+    filter_fields = {
+        'proposal__id': ['exact', 'in'],
+        'proposal__dossier': ['exact'],
+        'group': ['exact'],
+        'cohesion': ['gte', 'lte'],
+    }
+
+    ordering_fields = ['cohesion']
+
+
+class ResponseCacheViewSet(viewsets.ViewSet):
+    """
+    API endpoint returning the number of hits and misses of the response
+    cache of the dossier, proposal and vote endpoints, counted by this
+    process unless the cache is a shared Django cache.
+    """
+
+    def list(self, request):
+        response_cache = get_response_cache()
+        if response_cache is None:
+            return Response({'enabled': False})
+
+        stats = response_cache.stats()
+        return Response(OrderedDict([
+            ('enabled', True),
+            ('hits', stats['hits']),
+            ('misses', stats['misses']),
+        ]))
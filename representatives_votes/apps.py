@@ -0,0 +1,18 @@
+# coding: utf-8
+from django.apps import AppConfig
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+
+
+class RepresentativesVotesConfig(AppConfig):
+    name = 'representatives_votes'
+
+    def ready(self):
+        # Connected whether the API is imported or not, so that saves made
+        # by management commands invalidate cached responses too
+        from representatives_votes import cache
+
+        setting_changed.connect(cache.reset_response_cache)
+        for model in cache.SCOPES:
+            post_save.connect(cache.invalidate_responses, sender=model)
+            post_delete.connect(cache.invalidate_responses, sender=model)
@@ -0,0 +1,212 @@
+# coding: utf-8
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from representatives_votes.models import Document, Dossier, Proposal, Vote
+
+# Scope of the rows of each model, see ImportGeneration
+SCOPES = {
+    Dossier: 'dossier',
+    Document: 'document',
+    Proposal: 'proposal',
+    Vote: 'vote',
+}
+
+# Number of responses kept by the default in-process cache
+DEFAULT_SIZE = 256
+
+KEY_PREFIX = 'representatives_votes:'
+
+_response_cache = None
+_lock = threading.Lock()
+
+
+class LocalCache(object):
+    """
+    In-process cache with the methods of Django caches that ResponseCache
+    uses, keeping the max_entries last used keys if not None
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            value = self.data[key] = self.data.pop(key)
+            return value
+
+    def get_many(self, keys):
+        return {key: value for key, value in
+                ((key, self.get(key)) for key in keys) if value is not None}
+
+    def set(self, key, value, timeout=None):
+        with self.lock:
+            self._set(key, value)
+
+    def add(self, key, value, timeout=None):
+        with self.lock:
+            if key in self.data:
+                return False
+            self._set(key, value)
+            return True
+
+    def _set(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        while self.max_entries is not None and \
+                len(self.data) > self.max_entries:
+            self.data.popitem(last=False)
+
+    def incr(self, key, delta=1):
+        with self.lock:
+            if key not in self.data:
+                raise ValueError("Key '%s' not found" % key)
+            self.data[key] += delta
+            return self.data[key]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class ResponseCache(object):
+    """
+    Rendered API responses, by a key made of the request and of the state
+    of the scopes of the view: their generations, bumped by importers when
+    they are done, and their versions, bumped when a row of the scope is
+    saved or deleted, so that only responses computed from a changed scope
+    stop being used.
+
+    Versions and hit and miss counts are kept in the counters cache, which
+    unlike the responses cache is not meant to drop keys.
+    """
+
+    def __init__(self, responses, counters):
+        self.responses = responses
+        self.counters = counters
+
+    def key(self, request, etag):
+        """
+        Return the key of the response to request, given its ETag made of
+        the generations and versions of its scopes, or None if it may not
+        be cached
+        """
+        # The browsable API shows the user and a CSRF token
+        if request.accepted_renderer.format == 'api':
+            return None
+
+        # Hyperlinks are absolute urls, made with the scheme and host of
+        # the request
+        query = sorted(request.query_params.lists())
+        return KEY_PREFIX + 'response:' + hashlib.sha1(repr((
+            request.scheme, request.get_host(), request.path, query,
+            request.accepted_media_type, etag,
+        ))).hexdigest()
+
+    def get(self, key):
+        response = self.responses.get(key)
+        self.count('hits' if response is not None else 'misses')
+        return response
+
+    def set(self, key, response):
+        self.responses.set(key, response, None)
+
+    def versions(self, scopes):
+        keys = [KEY_PREFIX + 'scope:' + scope for scope in scopes]
+        versions = self.counters.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # Not 0: if the counters cache lost a version, it must not
+                # come back to a value it had
+                self.counters.add(key, int(time.time() * 1000), None)
+                versions[key] = self.counters.get(key)
+        return tuple(versions[key] for key in keys)
+
+    def invalidate(self, scope):
+        key = KEY_PREFIX + 'scope:' + scope
+        try:
+            self.counters.incr(key)
+        except ValueError:
+            self.versions([scope])
+
+    def count(self, name):
+        key = KEY_PREFIX + 'count:' + name
+        try:
+            self.counters.incr(key)
+        except ValueError:
+            if not self.counters.add(key, 1, None):
+                self.counters.incr(key)
+
+    def clear(self):
+        """
+        Forget responses and counts, and whatever else the caches hold
+        """
+        self.responses.clear()
+        self.counters.clear()
+
+    def stats(self):
+        """
+        Return the number of cache hits and misses
+        """
+        keys = {KEY_PREFIX + 'count:' + n: n for n in ('hits', 'misses')}
+        counts = self.counters.get_many(keys.keys())
+        return {name: counts.get(key, 0) for key, name in keys.items()}
+
+
+def get_response_cache():
+    """
+    Return the ResponseCache configured by settings, None if disabled.
+
+    REPRESENTATIVES_VOTES_RESPONSE_CACHE is the alias of the Django cache
+    to use, or 'local' for an in-process cache of the
+    REPRESENTATIVES_VOTES_RESPONSE_CACHE_SIZE last used responses, which
+    only sees the saves of its own process. Unset, nothing is cached.
+    """
+    global _response_cache
+
+    with _lock:
+        if _response_cache is None:
+            alias = getattr(settings, 'REPRESENTATIVES_VOTES_RESPONSE_CACHE',
+                            None)
+            if not alias:
+                _response_cache = False
+            elif alias == 'local':
+                _response_cache = ResponseCache(
+                    LocalCache(getattr(
+                        settings, 'REPRESENTATIVES_VOTES_RESPONSE_CACHE_SIZE',
+                        DEFAULT_SIZE)),
+                    LocalCache())
+            else:
+                _response_cache = ResponseCache(caches[alias], caches[alias])
+
+    return _response_cache or None
+
+
+def reset_response_cache(setting, **kwargs):
+    """
+    Forget the ResponseCache when its settings change
+    """
+    global _response_cache
+
+    if setting.startswith('REPRESENTATIVES_VOTES_RESPONSE_CACHE'):
+        with _lock:
+            _response_cache = None
+
+
+def invalidate_responses(sender, **kwargs):
+    """
+    Invalidate responses computed from the scope of a saved or deleted row,
+    connected by RepresentativesVotesConfig
+    """
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response_cache.invalidate(SCOPES[sender])
@@ -0,0 +1,103 @@
+# coding: utf-8
+import logging
+import time
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionBatch(object):
+    """
+    Import records with handler, grouping them in transactions of up to
+    size records or interval seconds, whichever comes first.
+
+    If a transaction fails, its records are retried one transaction each,
+    so that a bad record is logged and skipped without losing the others.
+    on_rollback is called before retrying, to let importers forget what
+    they cached about rolled back rows. before_commit is called at the end
+    of each transaction, to let importers write what they buffered in it.
+    Transactions are the context managers returned by atomic, such as
+    Database.atomic which opens none for dry runs.
+
+    Use it as a context manager so that the last batch is flushed:
+
+        with TransactionBatch(importer.parse, size=100) as batch:
+            for data in items:
+                batch.add(data)
+    """
+
+    def __init__(self, handler, size=1, interval=None, on_rollback=None,
+                 before_commit=None, atomic=transaction.atomic):
+        self.handler = handler
+        self.atomic = atomic
+        self.size = max(size, 1)
+        self.interval = interval
+        self.on_rollback = on_rollback
+        self.before_commit = before_commit
+        self.records = []
+        self.started = None
+        self.imported = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+        if self.failed:
+            logger.error('Could not import %s records', self.failed)
+
+    def add(self, record):
+        if not self.records:
+            self.started = time.time()
+        self.records.append(record)
+
+        if len(self.records) >= self.size or (
+                self.interval is not None and
+                time.time() - self.started >= self.interval):
+            self.flush()
+
+    def flush(self):
+        records, self.records = self.records, []
+        if not records:
+            return
+
+        try:
+            with self.atomic():
+                for record in records:
+                    self.handler(record)
+                self.commit()
+        except Exception:
+            if self.on_rollback is not None:
+                self.on_rollback()
+
+            if len(records) == 1:
+                logger.exception('Could not import record')
+                self.failed += 1
+                return
+
+            logger.warning('Could not import batch of %s records, retrying '
+                           'one by one', len(records), exc_info=True)
+        else:
+            self.imported += len(records)
+            return
+
+        for record in records:
+            try:
+                with self.atomic():
+                    self.handler(record)
+                    self.commit()
+            except Exception:
+                logger.exception('Could not import record')
+                self.failed += 1
+                if self.on_rollback is not None:
+                    self.on_rollback()
+            else:
+                self.imported += 1
+
+    def commit(self):
+        if self.before_commit is not None:
+            self.before_commit()
@@ -0,0 +1,388 @@
+# coding: utf-8
+import contextlib
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, Value, When
+from django.utils import timezone
+
+from representatives_votes.models import Document, Dossier, Proposal, Vote
+
+# Number of rows per INSERT or UPDATE query, and of pks per IN lookup
+BATCH_SIZE = 100
+
+
+def _chunks(items):
+    for i in range(0, len(items), BATCH_SIZE):
+        yield items[i:i + BATCH_SIZE]
+
+
+@contextlib.contextmanager
+def _no_transaction():
+    yield
+
+
+def _query_votes(proposal_ids):
+    # Votes by representative pk by proposal pk, one query per BATCH_SIZE
+    votes = {pk: {} for pk in proposal_ids}
+    for chunk in _chunks(sorted(votes)):
+        for vote in Vote.objects.filter(proposal_id__in=chunk).order_by():
+            votes[vote.proposal_id][vote.representative_id] = vote
+    return votes
+
+
+class Database(object):
+    """
+    Where importers look rows up and save them: the database, unless this
+    is a DryRun
+    """
+    dry = False
+
+    def __init__(self):
+        # Votes loaded by load_votes() until they are looked at
+        self.loaded_votes = {}
+
+    def atomic(self):
+        """
+        Return the context manager of a transaction, which dry runs do not
+        open since they write nothing
+        """
+        if self.dry:
+            return _no_transaction()
+        return transaction.atomic()
+
+    def get(self, model, **lookup):
+        return model.objects.get(**lookup)
+
+    def pks(self, model, field, values):
+        """
+        Return the pks of the rows whose field has one of values, by value
+        """
+        pks = {}
+        for chunk in _chunks(sorted(set(values))):
+            pks.update(model.objects.filter(**{field + '__in': chunk})
+                       .order_by().values_list(field, 'pk'))
+        return pks
+
+    def in_bulk(self, model, pks):
+        instances = {}
+        for chunk in _chunks(list(pks)):
+            instances.update(model.objects.in_bulk(chunk))
+        return instances
+
+    def save(self, instance):
+        instance.save()
+
+    def flush(self):
+        pass
+
+    def bulk_create(self, instances):
+        if instances:
+            type(instances[0]).objects.bulk_create(instances,
+                                                   batch_size=BATCH_SIZE)
+
+    def bulk_update(self, instances, fields):
+        """
+        Save fields of instances with one UPDATE query per BATCH_SIZE rows
+        """
+        if not instances:
+            return
+
+        model = type(instances[0])
+        fields = [model._meta.get_field(name) for name in fields]
+        for chunk in _chunks(instances):
+            model.objects.filter(pk__in=[i.pk for i in chunk]).update(**{
+                field.name: Case(*[
+                    When(pk=i.pk, then=Value(getattr(i, field.attname)))
+                    for i in chunk
+                ], output_field=field)
+                for field in fields
+            })
+
+    def load_votes(self, proposal_ids):
+        """
+        Load the votes of proposals with one query per BATCH_SIZE of them,
+        for the next votes() of each, instead of a query per proposal
+        """
+        self.loaded_votes = _query_votes(
+            [pk for pk in proposal_ids if pk is not None])
+
+    def votes(self, proposal_id):
+        """
+        Return the votes of a proposal by representative pk
+        """
+        # Only once: the importer may change them after that
+        if proposal_id in self.loaded_votes:
+            return self.loaded_votes.pop(proposal_id)
+        return _query_votes([proposal_id])[proposal_id]
+
+    def count_votes(self, proposal_ids):
+        """
+        Return the number of votes of each proposal by position
+        """
+        counts = defaultdict(dict)
+        for chunk in _chunks(list(proposal_ids)):
+            for row in Vote.objects.filter(proposal_id__in=chunk).order_by() \
+                    .values('proposal_id', 'position') \
+                    .annotate(count=Count('pk')):
+                counts[row['proposal_id']][row['position']] = row['count']
+        return counts
+
+
+class DryRun(Database):
+    """
+    In-memory copy of the dossiers, documents and proposals of the
+    database, loaded with one query per model, and of the votes of the
+    proposals that are looked at, loaded in bulk by load_votes() or with
+    one query per proposal otherwise.
+
+    Importers given a DryRun compare a dump with it instead of the
+    database and save nothing but in memory, where new rows get negative
+    primary keys, so that later records of the dump see the rows earlier
+    ones would have created or changed.
+
+    Lookups work like QuerySet.get() for the fields listed in indexes.
+    """
+    dry = True
+
+    indexes = {
+        Dossier: [('pk',), ('reference',)],
+        Document: [('pk',), ('link',), ('dossier_id', 'kind'),
+                   ('chamber_id', 'dossier_id', 'kind')],
+        Proposal: [('pk',), ('reference',), ('title',)],
+    }
+
+    def __init__(self, models=(Dossier, Document, Proposal)):
+        super(DryRun, self).__init__()
+        self.models = models
+        self.load()
+
+    def load(self):
+        """
+        Copy the rows of models from the database, forgetting what was
+        saved in memory
+        """
+        self.rows = {(model, fields): {}
+                     for model in self.models
+                     for fields in self.indexes[model]}
+        # Keys of each instance, to drop them when it is saved again
+        self.keys = {}
+        # Votes of each proposal by representative pk
+        self.proposal_votes = {}
+        self.last_pk = 0
+
+        for model in self.models:
+            for instance in model.objects.order_by():
+                self.index(instance)
+
+    def get(self, model, **lookup):
+        if model is Vote:
+            votes = self.votes(lookup['proposal_id'])
+            if lookup['representative_id'] in votes:
+                return votes[lookup['representative_id']]
+            raise Vote.DoesNotExist('Vote matching %s does not exist'
+                                    % lookup)
+
+        fields = tuple(sorted(lookup.keys()))
+        if (model, fields) not in self.rows:
+            raise ValueError('Cannot look %s up by %s' % (
+                model.__name__, ', '.join(fields)))
+
+        key = tuple(lookup[f] for f in fields)
+        if key in self.rows[model, fields]:
+            return self.rows[model, fields][key]
+        raise model.DoesNotExist('%s matching %s does not exist' % (
+            model.__name__, lookup))
+
+    def pks(self, model, field, values):
+        if (model, (field,)) not in self.rows:
+            raise ValueError('Cannot look %s up by %s' % (
+                model.__name__, field))
+
+        rows = self.rows[model, (field,)]
+        return {value: rows[value, ].pk for value in values
+                if (value,) in rows}
+
+    def save(self, instance):
+        if instance.pk is None:
+            self.last_pk -= 1
+            instance.pk = self.last_pk
+
+        if isinstance(instance, Vote):
+            self.votes(instance.proposal_id)[
+                instance.representative_id] = instance
+        else:
+            self.index(instance)
+
+    def in_bulk(self, model, pks):
+        return {pk: self.get(model, pk=pk) for pk in pks}
+
+    def bulk_create(self, instances):
+        for instance in instances:
+            self.save(instance)
+
+    def bulk_update(self, instances, fields):
+        for instance in instances:
+            self.save(instance)
+
+    def count_votes(self, proposal_ids):
+        counts = defaultdict(dict)
+        for proposal_id in proposal_ids:
+            for vote in self.votes(proposal_id).values():
+                counts[proposal_id][vote.position] = counts[proposal_id].get(
+                    vote.position, 0) + 1
+        return counts
+
+    def index(self, instance):
+        self.unindex(instance)
+        model = type(instance)
+
+        keys = [(self.rows[model, fields],
+                 tuple(getattr(instance, f) for f in fields))
+                for fields in self.indexes.get(model, [])]
+
+        for rows, key in keys:
+            rows[key] = instance
+        self.keys[model, instance.pk] = keys
+
+    def unindex(self, instance):
+        # Forget the keys the instance had, unless another row took them
+        for rows, key in self.keys.pop((type(instance), instance.pk), []):
+            if rows.get(key) is instance:
+                del rows[key]
+
+    def load_votes(self, proposal_ids):
+        # Proposals made up by this dry run have no votes yet
+        self.proposal_votes.update(_query_votes([
+            pk for pk in proposal_ids
+            if pk > 0 and pk not in self.proposal_votes]))
+
+    def votes(self, proposal_id):
+        if proposal_id not in self.proposal_votes:
+            self.load_votes([proposal_id])
+            self.proposal_votes.setdefault(proposal_id, {})
+
+        return self.proposal_votes[proposal_id]
+
+
+class BufferedDatabase(DryRun):
+    """
+    In-memory copy of some models like DryRun, whose saves are written to
+    the database by flush() with bulk queries, so that importers look rows
+    up and save them without making a query per record.
+
+    Rows changed in memory are updated before new rows are inserted, so
+    that a unique field moving from a row to a new one does not clash.
+    Inserted rows get their primary key back by natural_keys, for the rows
+    pointing to them through foreign_keys and for later lookups.
+
+    Flush in the transaction the saves were made in, and load() again when
+    it rolls back, so that memory does not keep rows the database lost.
+    """
+    dry = False
+
+    # Fields to find the primary key of inserted rows with, the first one
+    # being looked up in bulk, the newest row wins if several match
+    natural_keys = {
+        Dossier: ('reference',),
+        Document: ('dossier_id', 'chamber_id', 'kind'),
+        Proposal: ('title',),
+    }
+    # Foreign keys to rows that may be inserted by the same flush
+    foreign_keys = {
+        Document: [('dossier_id', Dossier)],
+        Proposal: [('dossier_id', Dossier)],
+    }
+
+    def __init__(self, models=(Dossier, Document)):
+        # Models referenced by others come first, to be flushed first
+        super(BufferedDatabase, self).__init__(models)
+
+    def load(self):
+        self.created = defaultdict(list)
+        self.updated = defaultdict(dict)
+        # Field values of saved rows, to update changed fields only
+        self.values = {}
+        super(BufferedDatabase, self).load()
+
+        for (model, fields), rows in self.rows.items():
+            if fields == ('pk',):
+                for instance in rows.values():
+                    self.values[model, instance.pk] = _values(instance)
+
+    def save(self, instance):
+        model = type(instance)
+        if model not in self.models:
+            raise ValueError('Cannot save %s' % model.__name__)
+
+        if instance.pk is None:
+            self.created[model].append(instance)
+        elif instance.pk > 0:
+            self.updated[model][instance.pk] = instance
+        super(BufferedDatabase, self).save(instance)
+
+    def flush(self):
+        pks = {}
+        for model in self.models:
+            self.flush_model(model, pks)
+
+        self.created.clear()
+        self.updated.clear()
+
+    def flush_model(self, model, pks):
+        created = self.created[model]
+        updated = self.updated[model].values()
+
+        for instance in created + updated:
+            for attname, target in self.foreign_keys.get(model, []):
+                pk = getattr(instance, attname)
+                if pk is not None and pk < 0:
+                    setattr(instance, attname, pks[target, pk])
+
+        changed = set()
+        for instance in updated:
+            values = self.values[model, instance.pk]
+            changed.update(attname for attname, value
+                           in _values(instance).items()
+                           if values[attname] != value)
+
+        if changed:
+            fields = [f for f in model._meta.concrete_fields
+                      if f.attname in changed]
+            fields += [f for f in model._meta.concrete_fields
+                       if getattr(f, 'auto_now', False) and f not in fields]
+            now = timezone.now()
+            for instance in updated:
+                for field in fields:
+                    if getattr(field, 'auto_now', False):
+                        setattr(instance, field.attname, now)
+            Database.bulk_update(self, updated, [f.name for f in fields])
+
+        fake_pks = [instance.pk for instance in created]
+        for instance in created:
+            self.unindex(instance)
+            instance.pk = None
+        Database.bulk_create(self, created)
+
+        # bulk_create() does not set primary keys
+        key = self.natural_keys.get(model)
+        if created and key:
+            found = {}
+            values = sorted(set(getattr(i, key[0]) for i in created))
+            for chunk in _chunks(values):
+                for row in model.objects.filter(**{key[0] + '__in': chunk}) \
+                        .order_by('pk').values_list('pk', *key):
+                    found[row[1:]] = row[0]
+            for fake_pk, instance in zip(fake_pks, created):
+                instance.pk = found[tuple(getattr(instance, f) for f in key)]
+                pks[model, fake_pk] = instance.pk
+
+        for instance in created + updated:
+            if instance.pk is not None:
+                self.index(instance)
+                self.values[model, instance.pk] = _values(instance)
+
+
+def _values(instance):
+    return {f.attname: getattr(instance, f.attname)
+            for f in instance._meta.concrete_fields if not f.primary_key}
@@ -1,18 +1,24 @@
 # coding: utf-8
 
-import sys
 import ijson
 import logging
 import re
 
 import django
 from django.apps import apps
-from django.db import transaction
 
 from representatives.contrib.francedata.import_representatives import \
     ensure_chambers
+from representatives.contrib.francedata.variants import FranceDataVariants
 from representatives.models import Chamber
-from representatives_votes.models import Document, Dossier
+from representatives_votes.contrib.batch import TransactionBatch
+from representatives_votes.contrib.dryrun import (BATCH_SIZE, BufferedDatabase,
+                                                  Database, DryRun)
+from representatives_votes.contrib.metrics import ImportMetrics
+from representatives_votes.contrib.utils import (argument_parser,
+                                                 importer_input, parse_args)
+from representatives_votes.models import Document, Dossier, ImportGeneration
+from representatives_votes.search import update_search_documents
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +39,7 @@ def extract_reference(url):
     return None
 
 
-def find_dossier(data):
+def find_dossier(data, db):
     '''
     Find dossier with reference matching either 'ref_an' or 'ref_sen',
     create it if not found.  Ensure its reference is 'ref_an' if both fields
@@ -46,7 +52,7 @@ def find_dossier(data):
 
     for field in [k for k in ('ref_an', 'ref_sen') if k in data]:
         try:
-            dossier = Dossier.objects.get(reference=data[field])
+            dossier = db.get(Dossier, reference=data[field])
             reffield = field
             break
         except Dossier.DoesNotExist:
@@ -66,11 +72,11 @@ def find_dossier(data):
     return dossier, changed
 
 
-def handle_document(dossier, chamber, url):
+def handle_document(dossier, chamber, url, metrics, db):
     doc_changed = False
     try:
-        doc = Document.objects.get(chamber=chamber, dossier=dossier,
-                                   kind='procedure-file')
+        doc = db.get(Document, chamber_id=chamber.pk, dossier_id=dossier.pk,
+                     kind='procedure-file')
     except Document.DoesNotExist:
         doc = Document(chamber=chamber, dossier=dossier, kind='procedure-file')
         logger.debug('Created %s document for dossier %s' %
@@ -83,15 +89,23 @@ def handle_document(dossier, chamber, url):
         doc.link = url
         doc_changed = True
 
+    metrics.incr('documents', 'created' if doc.pk is None else
+                 'updated' if doc_changed else 'unchanged')
+
     if doc_changed:
-        doc.save()
+        with metrics.stage('write'):
+            db.save(doc)
+
 
+def parse_dossier_data(data, an, sen, metrics=None, db=None):
+    metrics = metrics or ImportMetrics()
+    db = db or Database()
 
-def parse_dossier_data(data, an, sen):
     if 'url_an' in data:
         ref_an = extract_reference(data['url_an'])
         if ref_an is None:
             logger.warn('No reference for dossier %s' % data['url_an'])
+            metrics.incr('dossiers', 'skipped')
             return
         else:
             data['ref_an'] = ref_an
@@ -100,11 +114,12 @@ def parse_dossier_data(data, an, sen):
         ref_sen = extract_reference(data['url_sen'])
         if ref_sen is None:
             logger.warn('No reference for dossier %s' % data['url_sen'])
+            metrics.incr('dossiers', 'skipped')
             return
         else:
             data['ref_sen'] = ref_sen
 
-    dossier, changed = find_dossier(data)
+    dossier, changed = find_dossier(data, db)
 
     thisref = data['ref_an' if data['chambre'] == 'AN' else 'ref_sen']
 
@@ -114,24 +129,81 @@ def parse_dossier_data(data, an, sen):
         dossier.title = title
         changed = True
 
-    with transaction.atomic():
-        if changed:
-            logger.debug('Saved dossier %s' % dossier.reference)
-            dossier.save()
+    metrics.incr('dossiers', 'created' if dossier.pk is None else
+                 'updated' if changed else 'unchanged')
+
+    if changed:
+        logger.debug('Saved dossier %s' % dossier.reference)
+        with metrics.stage('write'):
+            db.save(dossier)
 
-        if 'url_an' in data:
-            handle_document(dossier, an, data['url_an'])
+    if 'url_an' in data:
+        handle_document(dossier, an, data['url_an'], metrics, db)
+
+    if 'url_sen' in data:
+        handle_document(dossier, sen, data['url_sen'], metrics, db)
 
-        if 'url_sen' in data:
-            handle_document(dossier, sen, data['url_sen'])
+
+def get_chambers(db):
+    """
+    Return the AN and SEN chambers, made up in memory if a dry run needs
+    them before ensure_chambers() ever ran
+    """
+    if not db.dry:
+        ensure_chambers()
+
+    chambers = []
+    for key in ('AN', 'SEN'):
+        variant = FranceDataVariants[key]
+        try:
+            chamber = Chamber.objects.get(abbreviation=variant['abbreviation'])
+        except Chamber.DoesNotExist:
+            chamber = Chamber(name=variant['chamber'],
+                              abbreviation=variant['abbreviation'])
+            db.save(chamber)
+        chambers.append(chamber)
+
+    return chambers
 
 
 def main(stream=None):
+    parser = argument_parser('Import francedata dossiers')
+    # Records are only written in bulk when their batch commits, which
+    # would mean one by one with the default batch size of 1
+    parser.set_defaults(batch_size=BATCH_SIZE)
+    args = parse_args(parser, stream)
+
     if not apps.ready:
         django.setup()
 
-    ensure_chambers()
-    an = Chamber.objects.get(abbreviation='AN')
-    sen = Chamber.objects.get(abbreviation='SEN')
-    for data in ijson.items(stream or sys.stdin, 'item'):
-        parse_dossier_data(data, an, sen)
+    metrics = ImportMetrics('francedata_import_dossiers', args.progress,
+                            args.metrics, args.dry_run)
+
+    def handler(data):
+        parse_dossier_data(data, an, sen, metrics, db)
+
+    def flush():
+        with metrics.stage('write'):
+            db.flush()
+
+    with metrics, importer_input(args, stream) as f:
+        # Dossiers and documents are all looked up in memory, and written
+        # in bulk when each batch commits unless this is a dry run
+        with metrics.stage('index'):
+            if args.dry_run:
+                db = DryRun([Dossier, Document])
+            else:
+                db = BufferedDatabase([Dossier, Document])
+        an, sen = get_chambers(db)
+
+        with TransactionBatch(handler, args.batch_size, args.batch_interval,
+                              on_rollback=None if args.dry_run else db.load,
+                              before_commit=flush,
+                              atomic=db.atomic) as batch:
+            for data in metrics.iterate(ijson.items(f, 'item')):
+                batch.add(data)
+
+        if not args.dry_run:
+            with metrics.stage('search'):
+                update_search_documents()
+            ImportGeneration.bump('dossier', 'document')
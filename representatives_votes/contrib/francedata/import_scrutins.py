@@ -3,14 +3,20 @@
 from datetime import datetime
 import ijson
 import logging
+import re
 from pytz import timezone as date_timezone
-import sys
 
 import django
 from django.apps import apps
 from django.utils.timezone import make_aware as date_make_aware
 
-from representatives_votes.models import Dossier, Proposal
+from representatives_votes.contrib.batch import TransactionBatch
+from representatives_votes.contrib.dryrun import Database, DryRun
+from representatives_votes.contrib.metrics import ImportMetrics
+from representatives_votes.contrib.utils import (argument_parser,
+                                                 importer_input, parse_args)
+from representatives_votes.models import Document, ImportGeneration, Proposal
+from representatives_votes.search import update_search_documents
 
 logger = logging.getLogger(__name__)
 
@@ -22,69 +28,109 @@ def _parse_date(date_str):
     )
 
 
-def _get_unique_title(proposal_pk, candidate):
-    title = candidate
+# Titles made unique by appending a number
+NUMBERED_TITLE = re.compile(r'^(.*) \((\d+)\)$', re.DOTALL)
 
-    try:
-        exists = Proposal.objects.get(title=title)
-    except Proposal.DoesNotExist:
-        exists = None
 
-    if exists and exists.pk != proposal_pk:
-        num = 1
-        while exists and exists.pk != proposal_pk:
+class ScrutinImporter:
+    def __init__(self, metrics=None, db=None):
+        self.metrics = metrics or ImportMetrics()
+        self.db = db or Database()
+        self.init_cache()
+
+    def init_cache(self):
+        # Dossier pks by document link, loaded on first use
+        self.dossiers = None
+        # Proposal pks by title, loaded on first use
+        self.titles = None
+        # Numbers below which all numbered variants of a title are taken
+        self.title_numbers = {}
+
+    def get_unique_title(self, proposal, candidate):
+        """
+        Return candidate, or its first numbered variant that is free or
+        already the title of proposal, without querying the database
+        """
+        if self.titles is None:
+            self.titles = dict(Proposal.objects.order_by()
+                               .values_list('title', 'pk'))
+
+        owner = self.titles.get(candidate)
+        if owner is None or owner == proposal.pk:
+            return candidate
+
+        num = self.title_numbers.get(candidate, 1)
+
+        match = NUMBERED_TITLE.match(proposal.title)
+        if match and match.group(1) == candidate and \
+                int(match.group(2)) < num:
+            return proposal.title
+
+        while True:
             title = '%s (%d)' % (candidate, num)
+            owner = self.titles.get(title)
+            if owner is None or owner == proposal.pk:
+                break
+            num += 1
 
-            try:
-                exists = Proposal.objects.get(title=title)
-            except Proposal.DoesNotExist:
-                exists = None
-
-            num = num + 1
-
+        self.title_numbers[candidate] = num
         logger.debug('Made unique title %s' % title)
+        return title
 
-    return title
+    def index_title(self, proposal, old_title):
+        """
+        Record the title of a saved proposal, and free its old one
+        """
+        if old_title and self.titles.get(old_title) == proposal.pk:
+            del self.titles[old_title]
 
+            match = NUMBERED_TITLE.match(old_title)
+            if match:
+                base, num = match.group(1), int(match.group(2))
+                self.title_numbers[base] = min(
+                    num, self.title_numbers.get(base, 1))
 
-class ScrutinImporter:
-    dossiers = {}
+        self.titles[proposal.title] = proposal.pk
 
     def get_dossier(self, url):
-        if url not in self.dossiers:
-            try:
-                self.dossiers[url] = Dossier.objects.get(documents__link=url)
-            except Dossier.DoesNotExist:
-                return None
+        """
+        Return the pk of the dossier with a document at url, or None
+        """
+        if self.dossiers is None:
+            self.dossiers = dict(Document.objects.order_by()
+                                 .values_list('link', 'dossier_id'))
 
-        return self.dossiers[url]
+        return self.dossiers.get(url, None)
 
     def parse_scrutin_data(self, data):
         ref = data['url']
 
         if 'dossier_url' not in data:
             logger.debug('Cannot create proposal without dossier')
+            self.metrics.incr('proposals', 'skipped')
             return
 
-        dossier = self.get_dossier(data['dossier_url'])
-        if dossier is None:
+        dossier_pk = self.get_dossier(data['dossier_url'])
+        if dossier_pk is None:
             logger.debug('Cannot create proposal for unknown dossier %s'
                          % data['dossier_url'])
+            self.metrics.incr('proposals', 'skipped')
             return
 
         changed = False
         try:
-            proposal = Proposal.objects.get(reference=ref)
+            proposal = self.db.get(Proposal, reference=ref)
         except Proposal.DoesNotExist:
             proposal = Proposal(reference=ref, total_for=0, total_against=0,
                                 total_abstain=0)
             logger.debug('Created proposal %s' % ref)
             changed = True
 
+        old_title = proposal.title
         values = dict(
-            title=_get_unique_title(proposal.pk, data["objet"]),
+            title=self.get_unique_title(proposal, data["objet"]),
             datetime=_parse_date(data["date"]),
-            dossier_id=dossier.pk,
+            dossier_id=dossier_pk,
             kind='dossier'
         )
 
@@ -94,16 +140,39 @@ class ScrutinImporter:
                 setattr(proposal, key, value)
                 changed = True
 
+        self.metrics.incr('proposals', 'created' if proposal.pk is None else
+                          'updated' if changed else 'unchanged')
+
         if changed:
             logger.debug('Updated proposal %s' % ref)
-            proposal.save()
+            with self.metrics.stage('write'):
+                self.db.save(proposal)
+            self.index_title(proposal, old_title)
 
 
 def main(stream=None):
+    args = parse_args(argument_parser('Import francedata scrutins'), stream)
+
     if not apps.ready:
         django.setup()
 
-    importer = ScrutinImporter()
-
-    for data in ijson.items(stream or sys.stdin, 'item'):
-        importer.parse_scrutin_data(data)
+    metrics = ImportMetrics('francedata_import_scrutins', args.progress,
+                            args.metrics, args.dry_run)
+    importer = ScrutinImporter(metrics)
+
+    with metrics, importer_input(args, stream) as f:
+        if args.dry_run:
+            with metrics.stage('index'):
+                importer.db = DryRun()
+
+        with TransactionBatch(importer.parse_scrutin_data, args.batch_size,
+                              args.batch_interval,
+                              on_rollback=importer.init_cache,
+                              atomic=importer.db.atomic) as batch:
+            for data in metrics.iterate(ijson.items(f, 'item')):
+                batch.add(data)
+
+        if not args.dry_run:
+            with metrics.stage('search'):
+                update_search_documents()
+            ImportGeneration.bump('proposal')
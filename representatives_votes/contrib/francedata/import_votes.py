@@ -1,23 +1,31 @@
 # coding: utf-8
 
 import ijson
+import itertools
 import logging
-import sys
 
 import django
 from django.apps import apps
-from django.utils.text import slugify
-
-from representatives_votes.models import Proposal, Representative, Vote
+from django.utils import timezone
+
+from representatives_votes.contrib.batch import TransactionBatch
+from representatives_votes.contrib.dryrun import BATCH_SIZE, Database, DryRun
+from representatives_votes.contrib.metrics import ImportMetrics
+from representatives_votes.contrib.stats import update_vote_stats
+from representatives_votes.contrib.names import NameIndex
+from representatives_votes.contrib.utils import (argument_parser,
+                                                 importer_input, parse_args,
+                                                 read_ahead)
+from representatives_votes.models import (ImportGeneration, Proposal,
+                                          Representative, Vote)
 
 logger = logging.getLogger(__name__)
 
 
 class VotesImporter:
-    deputes_slug = None
+    deputes_names = None
     deputes_rid = None
     scrutins = None
-    touched = []
 
     positions = dict(
         pour="for",
@@ -25,15 +33,24 @@ class VotesImporter:
         abstention="abstain"
     )
 
+    def __init__(self, metrics=None, db=None, match_names=False):
+        # Match deputies whose name is spelled otherwise by similarity
+        self.match_names = match_names
+        self.metrics = metrics or ImportMetrics()
+        self.db = db or Database()
+        # Proposals whose totals may have changed
+        self.touched = set()
+
     def get_depute_by_name(self, prenom, nom):
-        if self.deputes_slug is None:
-            self.deputes_slug = {
-                slugify(r[0]): r[1] for r in
-                Representative.objects.values_list('full_name', 'pk')
-            }
+        if self.deputes_names is None:
+            self.deputes_names = NameIndex(
+                Representative.objects.values_list('full_name', 'pk'),
+                fuzzy=self.match_names)
 
-        full = (u'%s %s' % (prenom, nom)).replace(u' ', ' ')
-        return self.deputes_slug.get(slugify(full), None)
+        depute, status, score = self.deputes_names.match(
+            u'%s %s' % (prenom, nom))
+        self.metrics.incr('names', status)
+        return depute
 
     def get_depute_by_url(self, url):
         if self.deputes_rid is None:
@@ -55,77 +72,168 @@ class VotesImporter:
 
         return self.scrutins.get(ref, None)
 
-    def parse_vote_data(self, data):
-        scrutin = self.get_scrutin(data['scrutin_url'])
-        if scrutin is None:
-            logger.debug('Cannot import vote for unknown scrutin %s'
-                         % data['scrutin_url'])
-            return
-
-        if 'parl_url' in data:
-            repdesc = data['parl_url']
-            depute = self.get_depute_by_url(data['parl_url'])
-        else:
-            repdesc = '%s %s' % (data['prenom'], data['nom'])
-            depute = self.get_depute_by_name(data['prenom'], data['nom'])
+    def match_vote(self, data):
+        """
+        Return the representative pk and position of a vote, or None
+        """
+        with self.metrics.stage('match'):
+            if 'parl_url' in data:
+                repdesc = data['parl_url']
+                depute = self.get_depute_by_url(data['parl_url'])
+            else:
+                repdesc = '%s %s' % (data['prenom'], data['nom'])
+                depute = self.get_depute_by_name(data['prenom'], data['nom'])
 
         if depute is None:
             logger.debug('Cannot import vote by unknown rep %s' % repdesc)
+            self.metrics.incr('votes', 'skipped')
             return
 
         if not data['division'].lower() in self.positions:
             logger.debug('Cannot import vote for invalid position %s'
                          % data['division'])
+            self.metrics.incr('votes', 'skipped')
             return
-        position = self.positions[data['division'].lower()]
-
-        changed = False
-        try:
-            vote = Vote.objects.get(representative_id=depute,
-                                    proposal_id=scrutin)
-        except Vote.DoesNotExist:
-            vote = Vote(representative_id=depute, proposal_id=scrutin)
-            logger.debug('Created vote for rep %s on %s' % (depute, scrutin))
-            changed = True
-
-        if vote.position != position:
-            logger.debug('Changed vote position to %s' % position)
-            changed = True
-            vote.position = position
-
-        if changed:
-            logger.debug('Updated vote for rep %s on %s' % (depute, scrutin))
-            self.touched.append(scrutin)
-            vote.save()
 
-    def update_totals(self):
-        proposals = [Proposal.objects.get(pk=pk) for pk in self.touched]
+        return depute, self.positions[data['division'].lower()]
+
+    def load_votes(self, groups):
+        """
+        Load the votes of the scrutins of groups of votes with bulk queries,
+        before groups are parsed one by one
+        """
+        with self.metrics.stage('diff'):
+            self.db.load_votes(set(
+                self.get_scrutin(data['scrutin_url'])
+                for group in groups for data in group))
 
-        for proposal in proposals:
-            changed = False
+    def parse_vote_data(self, data):
+        self.parse_votes([data])
+
+    def parse_votes(self, votes_data):
+        """
+        Import a group of votes, usually the consecutive votes of a scrutin
+        in the dump, with one bulk insert and one bulk update per scrutin
+        """
+        scrutins = {}
+        for data in votes_data:
+            scrutin = self.get_scrutin(data['scrutin_url'])
+            if scrutin is None:
+                logger.debug('Cannot import vote for unknown scrutin %s'
+                             % data['scrutin_url'])
+                self.metrics.incr('votes', 'skipped')
+                continue
+
+            vote = self.match_vote(data)
+            if vote is not None:
+                # Last vote of a representative wins
+                scrutins.setdefault(scrutin, {})[vote[0]] = vote[1]
+
+        for scrutin, positions in scrutins.items():
+            self.save_votes(scrutin, positions)
+
+    def save_votes(self, scrutin, positions):
+        with self.metrics.stage('diff'):
+            existing = self.db.votes(scrutin)
+
+            created = []
+            updated = []
+            for depute, position in positions.items():
+                vote = existing.get(depute, None)
+                if vote is None:
+                    created.append(Vote(representative_id=depute,
+                                        proposal_id=scrutin,
+                                        position=position))
+                elif vote.position != position:
+                    vote.position = position
+                    updated.append(vote)
+
+        self.metrics.incr('votes', 'created', len(created))
+        self.metrics.incr('votes', 'updated', len(updated))
+        self.metrics.incr('votes', 'unchanged',
+                          len(positions) - len(created) - len(updated))
+
+        if created or updated:
+            logger.debug('Created %s and updated %s votes on %s' % (
+                len(created), len(updated), scrutin))
+            self.touched.add(scrutin)
+            with self.metrics.stage('write'):
+                self.db.bulk_create(created)
+                self.db.bulk_update(updated, ['position'])
+
+    def update_totals(self):
+        """
+        Recount the votes of touched proposals with one grouped query and
+        write changed totals back in bulk
+        """
+        pks = sorted(self.touched)
+        counts = self.db.count_votes(pks)
+        proposals = self.db.in_bulk(Proposal, pks)
+
+        changed = []
+        for pk in pks:
+            proposal = proposals[pk]
+            totals = counts.get(pk, {})
+            proposal_changed = False
 
             for pos in self.positions.values():
-                count = Vote.objects.filter(proposal_id=proposal.pk,
-                                            position=pos).count()
+                count = totals.get(pos, 0)
 
                 if getattr(proposal, 'total_%s' % pos, None) != count:
                     logger.debug('Changed %s count for proposal %s to %s' % (
                         pos, proposal.pk, count))
                     setattr(proposal, 'total_%s' % pos, count)
-                    changed = True
+                    proposal_changed = True
+
+            self.metrics.incr('proposals', 'updated' if proposal_changed
+                              else 'unchanged')
 
-            if changed:
+            if proposal_changed:
                 logger.debug('Updated proposal %s' % proposal.pk)
-                proposal.save()
+                # Not set by bulk updates, unlike save()
+                proposal.updated = timezone.now()
+                changed.append(proposal)
+
+        self.db.bulk_update(changed, ['total_%s' % pos for pos in
+                                      self.positions.values()] + ['updated'])
 
 
 def main(stream=None):
+    parser = argument_parser('Import francedata votes')
+    parser.add_argument('--match-names', action='store_true', default=False,
+        help='Find deputies whose name is spelled otherwise by similarity, '
+             'which may mistake one for another')
+    args = parse_args(parser, stream)
+
     if not apps.ready:
         django.setup()
 
-    importer = VotesImporter()
-
-    for data in ijson.items(stream or sys.stdin, 'item'):
-        importer.parse_vote_data(data)
-
-    importer.update_totals()
+    metrics = ImportMetrics('francedata_import_votes', args.progress,
+                            args.metrics, args.dry_run)
+    importer = VotesImporter(metrics, match_names=args.match_names)
+
+    with metrics, importer_input(args, stream) as f:
+        if args.dry_run:
+            with metrics.stage('index'):
+                importer.db = DryRun()
+
+        with TransactionBatch(importer.parse_votes, args.batch_size,
+                              args.batch_interval,
+                              atomic=importer.db.atomic) as batch:
+            votes = metrics.iterate(ijson.items(f, 'item'))
+            groups = (list(group) for url, group in itertools.groupby(
+                votes, lambda data: data['scrutin_url']))
+            for group in read_ahead(groups, importer.load_votes, BATCH_SIZE):
+                batch.add(group)
+
+        with metrics.stage('totals'):
+            importer.update_totals()
+
+        if not args.dry_run:
+            with metrics.stage('stats'):
+                update_vote_stats(importer.touched)
+            ImportGeneration.bump('proposal', 'vote')
+
+    if importer.deputes_names is not None:
+        logger.info('Matched deputies by name: %s',
+                    importer.deputes_names.stats())
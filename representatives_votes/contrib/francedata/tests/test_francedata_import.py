@@ -1,14 +1,22 @@
+# coding: utf-8
 import copy
+import json
+import mock
 import os
 import pytest
+import sys
 
 from django.core.serializers.json import Deserializer
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from representatives.models import Representative
 from representatives_votes.contrib.francedata import import_dossiers
 from representatives_votes.contrib.francedata import import_scrutins
 from representatives_votes.contrib.francedata import import_votes
+from representatives_votes.contrib.metrics import ImportMetrics
 from representatives_votes.models import Dossier, Proposal, Vote
 
 
@@ -68,3 +76,220 @@ def test_francedata_import_votes():
     ]
 
     _test_import(fixtures, 'votes', import_votes.main)
+
+
+def _run(module, scenario, tmpdir, *args):
+    report = tmpdir.join('report.json')
+    argv = [module.__name__, _get_testdata('%s_input.json' % scenario),
+            '--metrics', report.strpath] + list(args)
+
+    with mock.patch.object(sys, 'argv', argv):
+        module.main()
+
+    return json.loads(report.read())
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('scenario,module,fixtures', [
+    ('dossiers', import_dossiers, []),
+    ('scrutins', import_scrutins, ['dossiers_expected.json']),
+    ('votes', import_votes, ['dossiers_expected.json',
+                             'scrutins_expected.json', 'rep_fixture.json']),
+])
+def test_francedata_import_dry_run(scenario, module, fixtures, tmpdir):
+    for fix in fixtures:
+        call_command('loaddata', _get_testdata(fix))
+
+    def rows():
+        return [m.objects.count() for m in (Dossier, Proposal, Vote)] + [
+            list(Proposal.objects.order_by('pk').values_list(
+                'total_for', 'total_against', 'total_abstain'))]
+
+    before = rows()
+    dry_run = _run(module, scenario, tmpdir, '--dry-run')
+    assert dry_run['dry_run']
+    assert rows() == before
+
+    # Counts are the same as the ones of an actual import, and of its
+    # re-import
+    assert dry_run['counts'] == _run(module, scenario, tmpdir)['counts']
+    assert (_run(module, scenario, tmpdir, '--dry-run')['counts'] ==
+            _run(module, scenario, tmpdir)['counts'])
+
+
+@pytest.mark.django_db
+def test_francedata_import_dossiers_queries(tmpdir):
+    dump = tmpdir.join('dossiers.json')
+    dump.write(json.dumps([{
+        'chambre': 'AN',
+        'url_an': 'http://www.assemblee-nationale.fr/14/dossiers/d%s.asp' % i,
+        'url_sen': 'http://www.senat.fr/dossier-legislatif/d%s.html' % i,
+        'titre': 'Dossier %s' % i,
+    } for i in range(150)]))
+
+    def run():
+        report = tmpdir.join('report.json')
+        argv = ['import_dossiers', dump.strpath, '--metrics', report.strpath,
+                '--batch-size', '1000']
+        with mock.patch.object(sys, 'argv', argv):
+            import_dossiers.main()
+        return json.loads(report.read())
+
+    # Dossiers and documents are looked up in memory and written in bulk,
+    # so are search documents
+    report = run()
+    assert report['counts']['documents'] == {'created': 300}
+    assert report['queries']['count'] < 45
+    assert Dossier.objects.get(reference='14/d3').documents.count() == 2
+
+    report = run()
+    assert report['counts']['documents'] == {'unchanged': 300}
+    assert report['queries']['count'] < 30
+
+
+@pytest.mark.django_db
+def test_francedata_import_dossiers_bad_record(tmpdir):
+    dump = tmpdir.join('dossiers.json')
+    dump.write(json.dumps([{
+        'chambre': 'AN',
+        'url_an': 'http://www.assemblee-nationale.fr/14/dossiers/d%s.asp' % i,
+        'titre': 'Dossier %s' % i,
+    } for i in range(5)]))
+
+    bulk_create = import_dossiers.Database.bulk_create
+
+    def failing_bulk_create(db, instances):
+        if any(getattr(i, 'title', None) == 'Dossier 1' for i in instances):
+            raise ValueError('Bad record')
+        bulk_create(db, instances)
+
+    # Written when their batch commits, so that only the bad record of the
+    # first batch is lost when its retry fails
+    argv = ['import_dossiers', dump.strpath, '--batch-size', '3']
+    with mock.patch.object(sys, 'argv', argv), \
+            mock.patch.object(import_dossiers.Database, 'bulk_create',
+                              failing_bulk_create):
+        import_dossiers.main()
+
+    assert sorted(Dossier.objects.values_list('title', flat=True)) == [
+        'Dossier 0', 'Dossier 2', 'Dossier 3', 'Dossier 4']
+    assert Dossier.objects.get(title='Dossier 0').documents.count() == 1
+
+
+@pytest.mark.django_db
+def test_francedata_import_scrutins_unique_titles():
+    call_command('loaddata', _get_testdata('dossiers_expected.json'))
+
+    with open(_get_testdata('scrutins_input.json'), 'r') as f:
+        data = json.load(f)[0]
+    dossier = Dossier.objects.get(documents__link=data['dossier_url'])
+
+    titles = [data['objet']] + ['%s (%d)' % (data['objet'], i)
+                                for i in range(1, 50)]
+    Proposal.objects.bulk_create([
+        Proposal(title=title, reference=str(i), dossier=dossier,
+                 datetime=timezone.now(), total_for=0, total_against=0,
+                 total_abstain=0)
+        for i, title in enumerate(titles)
+    ])
+
+    importer = import_scrutins.ScrutinImporter()
+    importer.get_dossier(data['dossier_url'])
+    importer.get_unique_title(Proposal(), 'foo')
+
+    with CaptureQueriesContext(connection) as queries:
+        importer.parse_scrutin_data(data)
+        importer.parse_scrutin_data(dict(data, url='other'))
+
+    # Proposal lookup and insert for each scrutin
+    assert len(queries) == 4
+    assert Proposal.objects.get(reference=data['url']).title == \
+        '%s (50)' % data['objet']
+    assert Proposal.objects.get(reference='other').title == \
+        '%s (51)' % data['objet']
+
+    # Re-importing keeps titles
+    importer.parse_scrutin_data(data)
+    assert Proposal.objects.get(reference=data['url']).title == \
+        '%s (50)' % data['objet']
+
+
+@pytest.mark.django_db
+def test_francedata_import_scrutins_dossier_index():
+    call_command('loaddata', _get_testdata('dossiers_expected.json'))
+
+    with open(_get_testdata('scrutins_input.json'), 'r') as f:
+        data = json.load(f)[0]
+    dossier = Dossier.objects.get(documents__link=data['dossier_url'])
+
+    importer = import_scrutins.ScrutinImporter()
+    with CaptureQueriesContext(connection) as queries:
+        for i in range(3):
+            assert importer.get_dossier(data['dossier_url']) == dossier.pk
+            assert importer.get_dossier('unknown') is None
+
+    assert len(queries) == 1
+    assert import_scrutins.ScrutinImporter().dossiers is None
+
+
+@pytest.mark.django_db
+def test_francedata_import_votes_updates():
+    test_francedata_import_votes()
+
+    votes = list(Vote.objects.order_by('pk'))
+    Vote.objects.filter(pk=votes[0].pk).update(position='abstain')
+    Vote.objects.filter(pk=votes[1].pk).delete()
+    Proposal.objects.update(total_for=0, total_against=0, total_abstain=0)
+
+    importer = import_votes.VotesImporter()
+    with open(_get_testdata('votes_input.json'), 'r') as f:
+        importer.parse_votes(json.load(f))
+
+    assert sorted(importer.touched) == sorted(
+        [votes[0].proposal_id, votes[1].proposal_id])
+
+    importer.touched = set(Proposal.objects.values_list('pk', flat=True))
+    start = timezone.now()
+    with CaptureQueriesContext(connection) as queries:
+        importer.update_totals()
+
+    # Grouped count, proposals and a single UPDATE
+    assert len(queries) == 3
+    # Which incremental jobs like search documents look for
+    assert all(p.updated >= start for p in Proposal.objects.filter(
+        total_for__gt=0))
+    assert set(Vote.objects.values_list(
+        'proposal_id', 'representative_id', 'position')) == set(
+        (v.proposal_id, v.representative_id, v.position) for v in votes)
+    for proposal in Proposal.objects.all():
+        for position in ('for', 'against', 'abstain'):
+            assert getattr(proposal, 'total_%s' % position) == \
+                proposal.votes.filter(position=position).count()
+
+
+@pytest.mark.django_db
+def test_francedata_import_votes_name_matching():
+    for fix in ('dossiers_expected.json', 'scrutins_expected.json',
+                'rep_fixture.json'):
+        call_command('loaddata', _get_testdata(fix))
+
+    with open(_get_testdata('votes_input.json'), 'r') as f:
+        data = json.load(f)
+    for vote in data:
+        if vote.get('prenom') == 'Bernard':
+            vote['prenom'], vote['nom'] = u'Bérnard', u'ROMANN'
+
+    # Misspelled names may be someone else's, unless asked for
+    metrics = ImportMetrics()
+    importer = import_votes.VotesImporter(metrics)
+    importer.parse_votes(data)
+
+    assert Vote.objects.count() == 0
+    assert metrics.counts['names'] == {'unmatched': 5}
+
+    metrics = ImportMetrics()
+    importer = import_votes.VotesImporter(metrics, match_names=True)
+    importer.parse_votes(data)
+
+    assert Vote.objects.count() == 3
+    assert metrics.counts['names'] == {'fuzzy': 4, 'unmatched': 1}
@@ -0,0 +1,174 @@
+# coding: utf-8
+import contextlib
+import json
+import logging
+import sys
+import time
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorWrapper
+
+logger = logging.getLogger(__name__)
+
+
+class TimedCursor(CursorWrapper):
+    """
+    Cursor wrapper reporting the number and duration of queries to metrics
+    """
+
+    def __init__(self, cursor, db, metrics):
+        super(TimedCursor, self).__init__(cursor, db)
+        self.metrics = metrics
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return super(TimedCursor, self).execute(sql, params)
+        finally:
+            self.metrics.query(time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(TimedCursor, self).executemany(sql, param_list)
+        finally:
+            self.metrics.query(time.time() - start)
+
+
+class ImportMetrics(object):
+    """
+    Collect timings, query counts and row counts of an import run.
+
+    Use it as a context manager around the run to count queries made on the
+    default database and emit a JSON report at the end, to stderr or to
+    the output path. Importers record time spent in each stage with
+    stage(), and created, updated, unchanged or skipped rows with incr().
+    During a dry run, these are the rows that would have been written.
+    """
+
+    def __init__(self, name='', progress=None, output=None, dry_run=False):
+        self.name = name
+        self.dry_run = dry_run
+        # Log a progress line every that many records
+        self.progress = progress
+        self.output = output
+        self.records = 0
+        self.queries = 0
+        self.query_seconds = 0
+        self.stages = defaultdict(float)
+        self.counts = defaultdict(lambda: defaultdict(int))
+        self.start_time = None
+        self.end_time = None
+        self.cursor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        if exc_type is None:
+            self.emit()
+
+    def start(self):
+        self.start_time = time.time()
+        db = connections[DEFAULT_DB_ALIAS]
+        # Keep any cursor() already overridden by other metrics
+        self.cursor = db.__dict__.get('cursor')
+        cursor = db.cursor
+
+        def timed_cursor():
+            return TimedCursor(cursor(), db, self)
+
+        db.cursor = timed_cursor
+
+    def stop(self):
+        self.end_time = time.time()
+        db = connections[DEFAULT_DB_ALIAS]
+        if self.cursor is not None:
+            db.cursor = self.cursor
+        elif 'cursor' in db.__dict__:
+            del db.cursor
+
+    def query(self, seconds):
+        self.queries += 1
+        self.query_seconds += seconds
+
+    def incr(self, model, status, count=1):
+        self.counts[model][status] += count
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.time() - start
+
+    def iterate(self, items):
+        """
+        Yield items, timing their parsing and logging progress
+        """
+        items = iter(items)
+        while True:
+            start = time.time()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.stages['parse'] += time.time() - start
+                return
+            self.stages['parse'] += time.time() - start
+
+            self.records += 1
+            if self.progress and self.records % self.progress == 0:
+                logger.info('%s: %s records, %.1f records/s, %s queries',
+                            self.name, self.records, self.rate(),
+                            self.queries)
+
+            yield item
+
+    def elapsed(self):
+        if self.start_time is None:
+            return 0
+        return (self.end_time or time.time()) - self.start_time
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.records / elapsed if elapsed else 0
+
+    def merge(self, report):
+        """
+        Add the figures of a report from another process
+        """
+        self.queries += report['queries']['count']
+        self.query_seconds += report['queries']['seconds']
+        for name, seconds in report['stages'].items():
+            self.stages[name] += seconds
+        for model, counts in report['counts'].items():
+            for status, count in counts.items():
+                self.counts[model][status] += count
+
+    def report(self):
+        return {
+            'importer': self.name,
+            'dry_run': self.dry_run,
+            'records': self.records,
+            'seconds': round(self.elapsed(), 3),
+            'records_per_second': round(self.rate(), 1),
+            'stages': {k: round(v, 3) for k, v in self.stages.items()},
+            'queries': {
+                'count': self.queries,
+                'seconds': round(self.query_seconds, 3),
+            },
+            'counts': {k: dict(v) for k, v in self.counts.items()},
+        }
+
+    def emit(self):
+        report = json.dumps(self.report(), indent=4, sort_keys=True,
+                            separators=(',', ': '))
+        if self.output:
+            with open(self.output, 'w') as f:
+                f.write(report)
+        else:
+            sys.stderr.write(report + '\n')
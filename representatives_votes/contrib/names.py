@@ -0,0 +1,208 @@
+# coding: utf-8
+import logging
+import math
+import re
+import time
+import unicodedata
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Words left out of normalized names, so that "Marc Le Fur" and "Marc Fur"
+# or "Jean de La Fontaine" and "Jean La Fontaine" match exactly
+PARTICLES = frozenset([
+    u'd', u'da', u'de', u'del', u'della', u'der', u'des', u'di', u'du', u'la',
+    u'le', u'les', u'van', u'von', u'y', u'zu',
+])
+
+
+def normalize(name):
+    """
+    Return name without accents, case, punctuation and particles, so that
+    "Jean-Éric DUPONT" and "Jean Eric Dupont" are the same. Words keep
+    their order: "Pierre Martin" and "Martin Pierre" are other people.
+    """
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8')
+
+    name = unicodedata.normalize('NFKD', name)
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    words = re.findall(r'\w+', name.lower(), re.UNICODE)
+
+    # Names made of particles only are kept whole
+    significant = [w for w in words if w not in PARTICLES] or words
+    return u' '.join(significant)
+
+
+def trigrams(key):
+    """
+    Return the trigrams of the words of key, with the position of their
+    word so that names only look alike when their words are in the same
+    order
+    """
+    grams = set()
+    for position, word in enumerate(key.split()):
+        padded = u'  %s ' % word
+        grams.update(u'%s%s' % (position, padded[i:i + 3])
+                     for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class NameIndex(object):
+    """
+    Find values, usually representative pks, by name.
+
+    Names are normalized once when added. Lookups first try the normalized
+    name as is, then fall back to the most similar name by trigrams, if it
+    is similar enough and no other name is as similar. Results are cached
+    by normalized name.
+
+    Fuzzy lookups only look at the names sharing one of the rarest
+    trigrams of the name looked up, which is enough to find every name
+    above threshold and keeps lookups fast on large indexes. Lookups with
+    more than max_candidates such names give up rather than score them
+    all, so that no lookup takes long. A fuzzy match may mistake someone
+    for someone else: fuzzy=False only matches exactly.
+
+    match() tells how a name was matched: 'exact', 'fuzzy', 'ambiguous'
+    or 'unmatched'; stats() sums it up.
+    """
+
+    def __init__(self, names=(), threshold=0.8, margin=0.05, fuzzy=True,
+                 max_candidates=2000):
+        # Dice coefficient of trigrams above which names match
+        self.threshold = threshold
+        # Names as similar as the best one to within margin are ambiguous
+        self.margin = margin
+        self.fuzzy = fuzzy
+        self.max_candidates = max_candidates
+
+        # Values by normalized name, several if names collide
+        self.values = defaultdict(set)
+        self.names = {}
+        self.trigrams = {}
+        self.postings = defaultdict(set)
+        self.cache = {}
+
+        self.counts = defaultdict(int)
+        self.scores = []
+        # Names scored by fuzzy lookups
+        self.scored = 0
+        # Fuzzy lookups with more than max_candidates names to score
+        self.gave_up = 0
+        self.fuzzy_seconds = 0
+        self.fuzzy_max_seconds = 0
+
+        for name, value in names:
+            self.add(name, value)
+
+    def add(self, name, value):
+        key = normalize(name)
+        if not key:
+            return
+
+        self.values[key].add(value)
+        self.names.setdefault(key, name)
+        if key not in self.trigrams:
+            self.trigrams[key] = trigrams(key)
+            for trigram in self.trigrams[key]:
+                self.postings[trigram].add(key)
+        self.cache = {}
+
+    def get(self, name):
+        return self.match(name)[0]
+
+    def match(self, name):
+        """
+        Return the value for name, how it was matched and the similarity of
+        the matching name
+        """
+        key = normalize(name)
+        if key not in self.cache:
+            self.cache[key] = self._match(key)
+
+        value, status, score = self.cache[key]
+        self.counts[status] += 1
+        return value, status, score
+
+    def _match(self, key):
+        values = self.values.get(key, None)
+        if values is not None:
+            if len(values) > 1:
+                return None, 'ambiguous', 1
+            return next(iter(values)), 'exact', 1
+
+        if not self.fuzzy:
+            return None, 'unmatched', 0
+
+        start = time.time()
+        try:
+            return self._fuzzy_match(key)
+        finally:
+            seconds = time.time() - start
+            self.fuzzy_seconds += seconds
+            self.fuzzy_max_seconds = max(self.fuzzy_max_seconds, seconds)
+
+    def _fuzzy_match(self, key):
+        grams = trigrams(key)
+        if not key or not grams:
+            return None, 'unmatched', 0
+
+        # A name with a Dice coefficient of threshold or more shares at
+        # least that many trigrams with key, so it has one of the others
+        needed = int(math.ceil(
+            self.threshold * len(grams) / (2 - self.threshold)))
+        rarest = sorted(grams, key=lambda g: len(self.postings.get(g, ())))
+        candidates = set()
+        for gram in rarest[:len(grams) - needed + 1]:
+            candidates.update(self.postings.get(gram, ()))
+
+        if len(candidates) > self.max_candidates:
+            logger.warning('Not matching name %s, too many names look like '
+                           'it (%s)', key, len(candidates))
+            self.gave_up += 1
+            return None, 'unmatched', 0
+
+        self.scored += len(candidates)
+        scored = []
+        for candidate in candidates:
+            other = self.trigrams[candidate]
+            score = 2. * len(grams & other) / (len(grams) + len(other))
+            if score >= self.threshold:
+                scored.append((score, candidate))
+
+        if not scored:
+            return None, 'unmatched', 0
+
+        scored.sort(reverse=True)
+        score, best = scored[0]
+        values = set(self.values[best])
+        for other_score, other in scored[1:]:
+            if score - other_score > self.margin:
+                break
+            values.update(self.values[other])
+
+        if len(values) > 1:
+            logger.info('Ambiguous name %s, as close to %s', key,
+                        ', '.join(c for s, c in scored
+                                  if score - s <= self.margin))
+            return None, 'ambiguous', score
+
+        self.scores.append(score)
+        # Logged for review, as it may be someone else
+        logger.warning('Matched name %s to %s (%.2f)', key,
+                       self.names[best], score)
+        return next(iter(values)), 'fuzzy', score
+
+    def stats(self):
+        fuzzy = len(self.scores)
+        return {
+            'names': len(self.trigrams),
+            'lookups': dict(self.counts),
+            'fuzzy_min_score': round(min(self.scores), 3) if fuzzy else None,
+            'fuzzy_mean_score':
+                round(sum(self.scores) / fuzzy, 3) if fuzzy else None,
+            'fuzzy_max_ms': round(self.fuzzy_max_seconds * 1000, 3),
+            'fuzzy_scored': self.scored,
+            'fuzzy_gave_up': self.gave_up,
+        }
@@ -1,15 +1,18 @@
 # coding: utf-8
 import logging
-import sys
 import urllib2
 
 import ijson
 import django
 from django.apps import apps
-from django.db import transaction
 
 from representatives.models import Chamber
-from representatives_votes.models import Dossier, Document
+from representatives_votes.contrib.batch import TransactionBatch
+from representatives_votes.contrib.dryrun import DryRun
+from representatives_votes.contrib.metrics import ImportMetrics
+from representatives_votes.contrib.utils import (argument_parser,
+                                                 importer_input, parse_args)
+from representatives_votes.models import Dossier, Document, ImportGeneration
 from .import_votes import Command
 
 logger = logging.getLogger(__name__)
@@ -19,20 +22,29 @@ URL = 'http://parltrack.euwiki.org/dumps/ep_dossiers.json.xz'
 LOCAL_PATH = 'ep_dossiers.json.xz'
 
 
-def parse_dossier_data(data, ep):
+def parse_dossier_data(data, ep, command=None):
     """Parse data from parltarck dossier export (1 dossier) Update dossier
     if it existed before, this function goal is to import and update a
     dossier, not to import all parltrack data
+
+    Votes are imported with command, a votes import Command shared by all
+    dossiers of a run so that its indexes are only built once, by the first
+    dossier with votes.
     """
     changed = False
     doc_changed = False
     ref = data['procedure']['reference']
 
+    if command is None:
+        command = Command()
+    metrics = command.metrics
+    db = command.db
+
     logger.debug('Processing dossier %s', ref)
 
-    with transaction.atomic():
+    with db.atomic():
         try:
-            dossier = Dossier.objects.get(reference=ref)
+            dossier = db.get(Dossier, reference=ref)
         except Dossier.DoesNotExist:
             dossier = Dossier(reference=ref)
             logger.debug('Dossier did not exist')
@@ -44,13 +56,18 @@ def parse_dossier_data(data, ep):
             dossier.title = data['procedure']['title']
             changed = True
 
+        metrics.incr('dossiers', 'created' if dossier.pk is None else
+                     'updated' if changed else 'unchanged')
+
         if changed:
             logger.info('Updated dossier %s', ref)
-            dossier.save()
+            with metrics.stage('write'):
+                db.save(dossier)
 
         source = data['meta']['source'].replace('&l=en', '')
         try:
-            doc = Document.objects.get(dossier=dossier, kind='procedure-file')
+            doc = db.get(Document, dossier_id=dossier.pk,
+                         kind='procedure-file')
         except Document.DoesNotExist:
             doc = Document(dossier=dossier, kind='procedure-file', chamber=ep)
             logger.debug('Document for dossier %s did not exist', ref)
@@ -61,13 +78,23 @@ def parse_dossier_data(data, ep):
             doc.link = source
             doc_changed = True
 
+        metrics.incr('documents', 'created' if doc.pk is None else
+                     'updated' if doc_changed else 'unchanged')
+
         if doc_changed:
             logger.info('Updated document %s for dossier %s', doc.link, ref)
-            doc.save()
+            with metrics.stage('write'):
+                db.save(doc)
 
-    if 'votes' in data.keys() and 'epref' in data['votes']:
-        command = Command()
+    has_votes = 'votes' in data.keys() and 'epref' in data['votes']
+    if command.cache is None and has_votes:
         command.init_cache()
+
+    # Dossiers of a dry run are not in the database init_cache() reads
+    if command.cache is not None:
+        command.cache['dossiers'][ref] = dossier.pk
+
+    if has_votes:
         command.parse_vote_data(data['votes'])
 
 
@@ -84,14 +111,39 @@ def import_single(stream):
         django.setup()
 
     ep = Chamber.objects.get(abbreviation='EP')
+    command = Command()
     for data in ijson.items(stream, ''):
-        parse_dossier_data(data, ep)
+        parse_dossier_data(data, ep, command)
+
+    command.finish()
+    ImportGeneration.bump('dossier', 'document')
 
 
 def main(stream=None):
+    args = parse_args(argument_parser('Import parltrack dossiers'), stream)
+
     if not apps.ready:
         django.setup()
 
-    ep = Chamber.objects.get(abbreviation='EP')
-    for data in ijson.items(stream or sys.stdin, 'item'):
-        parse_dossier_data(data, ep)
+    metrics = ImportMetrics('parltrack_import_dossiers', args.progress,
+                            args.metrics, args.dry_run)
+    command = Command(metrics=metrics)
+
+    def handler(data):
+        parse_dossier_data(data, ep, command)
+
+    with metrics, importer_input(args, stream) as f:
+        ep = Chamber.objects.get(abbreviation='EP')
+        if args.dry_run:
+            with metrics.stage('index'):
+                command.db = DryRun()
+
+        with TransactionBatch(handler, args.batch_size, args.batch_interval,
+                              on_rollback=command.init_cache,
+                              atomic=command.db.atomic) as batch:
+            for data in metrics.iterate(ijson.items(f, 'item')):
+                batch.add(data)
+
+        if not args.dry_run:
+            command.finish()
+            ImportGeneration.bump('dossier', 'document')
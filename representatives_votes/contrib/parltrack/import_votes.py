@@ -1,7 +1,13 @@
 # coding: utf-8
+import hashlib
+import json
 import logging
+import multiprocessing
+import Queue
 import re
-import sys
+import time
+import zlib
+from collections import defaultdict
 from os.path import join
 
 import django.dispatch
@@ -9,12 +15,22 @@ import ijson
 import django
 from django.apps import apps
 from dateutil.parser import parse as date_parse
-from django.db import transaction
+from django.db import connection, connections
 from django.utils.timezone import make_aware as date_make_aware
 from pytz import timezone as date_timezone
 
 from representatives.models import Representative
-from representatives_votes.models import Dossier, Proposal, Vote
+from representatives_votes.contrib.batch import TransactionBatch
+from representatives_votes.contrib.dryrun import BATCH_SIZE, Database, DryRun
+from representatives_votes.contrib.metrics import ImportMetrics
+from representatives_votes.contrib.stats import update_vote_stats
+from representatives_votes.contrib.names import NameIndex
+from representatives_votes.contrib.utils import (argument_parser,
+                                                 importer_input, parse_args,
+                                                 read_ahead)
+from representatives_votes.models import (Dossier, GroupVote,
+                                          ImportGeneration, Proposal, Vote)
+from representatives_votes.search import update_search_documents
 
 
 logger = logging.getLogger(__name__)
@@ -26,23 +42,83 @@ def _parse_date(date_str):
         date_parse(date_str),
         date_timezone('Europe/Brussels'))
 
+
+def _fingerprint(vote_data):
+    # ijson parses non integer numbers as Decimal
+    return hashlib.sha1(
+        json.dumps(vote_data, sort_keys=True, default=str)).hexdigest()
+
 JSON_URL = 'http://parltrack.euwiki.org/dumps/ep_votes.json.xz'
 DESTINATION = join('/tmp', 'ep_votes.json')
 
+# Number of proposals that may wait in each worker queue
+QUEUE_SIZE = 16
+
+# Seconds between two checks that workers are still running while waiting
+# on them
+POLL_INTERVAL = 1
+
+GROUP_VOTE_FIELDS = ['total_for', 'total_against', 'total_abstain',
+                     'cohesion']
+
 
 class Command(object):
+    def __init__(self, force=False, metrics=None, db=None,
+                 match_names=False):
+        # Import proposals even if their record did not change
+        self.force = force
+        # Find MEPs by name when their ep_id is missing or unknown
+        self.match_names = match_names
+        self.metrics = metrics or ImportMetrics()
+        self.db = db or Database()
+        self.skipped = 0
+        self.processed = 0
+        self.cache = None
+        # Pks of proposals whose votes or date changed
+        self.touched = set()
+        # Records read ahead by load_votes() and their fingerprint, by title
+        self.read_ahead = {}
+
+    def finish(self):
+        """
+        Update what is computed from proposals and votes once a run is done,
+        and bump their generations
+        """
+        with self.metrics.stage('stats'):
+            update_vote_stats(self.touched)
+        with self.metrics.stage('search'):
+            update_search_documents()
+        ImportGeneration.bump('proposal', 'vote')
+
     def init_cache(self):
         self.cache = dict()
         self.index_representatives()
         self.index_dossiers()
+        self.index_fingerprints()
 
     def parse_vote_data(self, vote_data):
         """
         Parse data from parltrack votes db dumps (1 proposal)
         """
+        record, fingerprint = self.read_ahead.pop(
+            vote_data.get('title'), (None, None))
+        if record is not vote_data:
+            fingerprint = _fingerprint(vote_data)
+
+        if not self.force and fingerprint == self.get_fingerprint(
+                vote_data.get('title')):
+            logger.debug('Skipping unchanged proposal %s',
+                         vote_data['title'])
+            self.skipped += 1
+            self.metrics.incr('proposals', 'skipped')
+            return
+
+        self.processed += 1
+
         if 'epref' not in vote_data.keys():
             logger.debug('Could not import data without epref %s',
                 vote_data['title'])
+            self.metrics.incr('proposals', 'skipped')
             return
 
         dossier_pk = self.get_dossier(vote_data['epref'])
@@ -50,15 +126,18 @@ class Command(object):
         if not dossier_pk:
             logger.debug('Cannot find dossier with remote id %s',
                          vote_data['epref'])
+            self.metrics.incr('proposals', 'skipped')
             return
 
-        return self.parse_proposal_data(
-            proposal_data=vote_data,
-            dossier_pk=dossier_pk
-        )
+        with self.db.atomic():
+            return self.parse_proposal_data(
+                proposal_data=vote_data,
+                dossier_pk=dossier_pk,
+                fingerprint=fingerprint
+            )
 
-    @transaction.atomic
-    def parse_proposal_data(self, proposal_data, dossier_pk):
+    def parse_proposal_data(self, proposal_data, dossier_pk,
+                            fingerprint=''):
         """Get or Create a proposal model from raw data"""
         proposal_display = '{} ({})'.format(proposal_data['title'].encode(
             'utf-8'), proposal_data.get('report', '').encode('utf-8'))
@@ -66,14 +145,17 @@ class Command(object):
         if 'issue_type' not in proposal_data.keys():
             logger.debug('This proposal data without issue_type: %s',
                          proposal_data['epref'])
+            self.metrics.incr('proposals', 'skipped')
             return
 
         changed = False
-        try:
-            proposal = Proposal.objects.get(title=proposal_data['title'])
-        except Proposal.DoesNotExist:
-            proposal = Proposal(title=proposal_data['title'])
-            changed = True
+        with self.metrics.stage('diff'):
+            try:
+                proposal = self.db.get(Proposal,
+                                       title=proposal_data['title'])
+            except Proposal.DoesNotExist:
+                proposal = Proposal(title=proposal_data['title'])
+                changed = True
 
         data_map = dict(
             title=proposal_data['title'],
@@ -87,32 +169,71 @@ class Command(object):
             position_data = proposal_data.get(position, {})
             position_total = position_data.get('total', 0)
 
-            if isinstance(position_total, str) and position_total.isdigit():
+            if isinstance(position_total, basestring) and \
+                    position_total.isdigit():
                 position_total = int(position_total)
 
             data_map['total_%s' % position.lower()] = position_total
 
+        logger.info(
+            'Looking for votes in proposal {}'.format(proposal_display))
+
+        with self.metrics.stage('match'):
+            votes, unmatched = self.match_votes(proposal_data)
+            groups = self.count_groups(proposal_data)
+
+        # Only remember the record when all its votes are imported, so that
+        # votes of MEPs imported later are looked at again on the next run,
+        # as are votes skipped by vote_pre_import receivers below
+        data_map['fingerprint'] = '' if unmatched else fingerprint
+
         for key, value in data_map.items():
             if value != getattr(proposal, key, None):
                 setattr(proposal, key, value)
                 changed = True
 
+        if proposal.pk is None:
+            self.metrics.incr('proposals', 'created')
+        elif changed:
+            self.metrics.incr('proposals', 'updated')
+        else:
+            self.metrics.incr('proposals', 'unchanged')
+
         if changed:
-            proposal.save()
+            with self.metrics.stage('write'):
+                self.db.save(proposal)
+            self.touched.add(proposal.pk)
 
+        # Receivers see the saved proposal
         responses = vote_pre_import.send(sender=self, vote_data=proposal_data)
+        if any(r is False for receiver, r in responses):
+            logger.debug(
+                'Skipping dossier %s', proposal_data.get(
+                    'epref', proposal_data['title']))
+            self.forget_fingerprint(proposal)
+            return
 
-        for receiver, response in responses:
-            if response is False:
-                logger.debug(
-                    'Skipping dossier %s', proposal_data.get(
-                        'epref', proposal_data['title']))
-                return
+        self.save_votes(proposal, votes)
+        self.save_group_votes(proposal, groups)
+        self.cache['fingerprints'][proposal.title] = proposal.fingerprint
 
-        positions = ['For', 'Abstain', 'Against']
-        logger.info(
-            'Looking for votes in proposal {}'.format(proposal_display))
-        for position in positions:
+        return proposal
+
+    def forget_fingerprint(self, proposal):
+        if proposal.fingerprint:
+            proposal.fingerprint = ''
+            with self.metrics.stage('write'):
+                self.db.save(proposal)
+
+    def match_votes(self, proposal_data):
+        """
+        Return a dict of representative pk to (position, representative_name)
+        for the votes of a proposal, and the number of votes of MEPs that
+        could not be found
+        """
+        votes = {}
+        unmatched = 0
+        for position in ('For', 'Abstain', 'Against'):
             for group_vote_data in proposal_data.get(
                     position,
                     {}).get(
@@ -122,41 +243,158 @@ class Command(object):
                     if not isinstance(vote_data, dict):
                         logger.error('Skipping vote data %s for proposal %s',
                                      vote_data, proposal_data['_id'])
+                        self.metrics.incr('votes', 'skipped')
                         continue
 
                     representative_pk = self.get_representative(vote_data)
 
                     if representative_pk is None:
                         logger.error('Could not find mep for %s', vote_data)
+                        self.metrics.incr('votes', 'skipped')
+                        unmatched += 1
                         continue
 
-                    representative_name = vote_data.get('orig', '')
+                    # Last occurrence wins, as it did when votes were saved
+                    # one by one
+                    votes[representative_pk] = (position.lower(),
+                                                vote_data.get('orig', ''))
+
+        return votes, unmatched
+
+    def count_groups(self, proposal_data):
+        """
+        Return a dict of group to its number of votes by position, for the
+        votes of a proposal
+        """
+        groups = defaultdict(dict)
+        for position in ('For', 'Abstain', 'Against'):
+            for group_vote_data in proposal_data.get(
+                    position, {}).get('groups', {}):
+                if not group_vote_data.get('group'):
+                    continue
+
+                counts = groups[group_vote_data['group']]
+                counts[position.lower()] = counts.get(position.lower(), 0) + \
+                    len([v for v in group_vote_data['votes']
+                         if isinstance(v, dict)])
+
+        return groups
+
+    def diff_votes(self, proposal, votes):
+        """
+        Compare votes, a dict of representative pk to (position,
+        representative_name), with the votes of proposal in the database.
 
-                    changed = False
-                    try:
-                        vote = Vote.objects.get(
-                            representative_id=representative_pk,
-                            proposal_id=proposal.pk)
-                    except Vote.DoesNotExist:
-                        vote = Vote(proposal_id=proposal.pk,
-                            representative_id=representative_pk)
-                        changed = True
+        Return a list of new Vote instances and a dict of existing vote pk to
+        their new (position, representative_name).
+        """
+        existing = self.db.votes(proposal.pk)
+
+        created = []
+        updated = {}
+        for representative_pk, values in votes.items():
+            vote = existing.get(representative_pk)
+            if vote is None:
+                created.append(Vote(proposal_id=proposal.pk,
+                                    representative_id=representative_pk,
+                                    position=values[0],
+                                    representative_name=values[1]))
+            elif (vote.position, vote.representative_name) != values:
+                updated[vote.pk] = values
+
+        return created, updated
+
+    def save_votes(self, proposal, votes):
+        """
+        Write new and changed votes of a proposal in bulk
+        """
+        with self.metrics.stage('diff'):
+            created, updated = self.diff_votes(proposal, votes)
 
-                    if vote.position != position.lower():
-                        changed = True
-                        vote.position = position.lower()
+        self.metrics.incr('votes', 'created', len(created))
+        self.metrics.incr('votes', 'updated', len(updated))
+        self.metrics.incr('votes', 'unchanged',
+                          len(votes) - len(created) - len(updated))
 
-                    if vote.representative_name != representative_name:
-                        changed = True
-                        vote.representative_name = representative_name
+        if not self.db.dry:
+            with self.metrics.stage('write'):
+                self.write_votes(created, updated)
 
-                    if changed:
-                        vote.save()
-                        logger.debug('Save vote %s for MEP %s on %s #%s to %s',
-                            vote.pk, representative_pk, proposal_data['title'],
-                            proposal.pk, position)
+        if created or updated:
+            self.touched.add(proposal.pk)
 
-        return proposal
+        if created:
+            logger.debug('Created %s votes on %s #%s', len(created),
+                         proposal.title, proposal.pk)
+
+        if updated:
+            logger.debug('Updated %s votes on %s #%s', len(updated),
+                         proposal.title, proposal.pk)
+
+    def save_group_votes(self, proposal, groups):
+        """
+        Write new and changed group votes of a proposal in bulk, and delete
+        those of groups which no longer voted on it
+        """
+        with self.metrics.stage('diff'):
+            existing = {
+                g.group: g for g in
+                GroupVote.objects.filter(proposal_id=proposal.pk).order_by()
+            }
+
+            created = []
+            updated = []
+            for group, counts in sorted(groups.items()):
+                group_vote = existing.pop(group, None) or GroupVote(
+                    proposal_id=proposal.pk, group=group)
+                before = [getattr(group_vote, f) for f in GROUP_VOTE_FIELDS]
+
+                for position in ('for', 'against', 'abstain'):
+                    setattr(group_vote, 'total_%s' % position,
+                            counts.get(position, 0))
+                group_vote.update_cohesion()
+
+                if group_vote.pk is None:
+                    created.append(group_vote)
+                elif [getattr(group_vote, f)
+                      for f in GROUP_VOTE_FIELDS] != before:
+                    updated.append(group_vote)
+
+        self.metrics.incr('groups', 'created', len(created))
+        self.metrics.incr('groups', 'updated', len(updated))
+        self.metrics.incr('groups', 'deleted', len(existing))
+
+        if not self.db.dry:
+            with self.metrics.stage('write'):
+                self.db.bulk_create(created)
+                self.db.bulk_update(updated, GROUP_VOTE_FIELDS)
+                if existing:
+                    GroupVote.objects.filter(pk__in=[
+                        g.pk for g in existing.values()]).delete()
+
+    def write_votes(self, created, updated):
+        self.db.bulk_create(created)
+        self.db.bulk_update([
+            Vote(pk=pk, position=values[0], representative_name=values[1])
+            for pk, values in sorted(updated.items())
+        ], ['position', 'representative_name'])
+
+    def load_votes(self, records):
+        """
+        Load the votes of the proposals of records that will be imported
+        with bulk queries, before records are parsed one by one
+        """
+        self.read_ahead = {
+            vote_data['title']: (vote_data, _fingerprint(vote_data))
+            for vote_data in records if 'title' in vote_data}
+        titles = [
+            title for title, (vote_data, fingerprint)
+            in self.read_ahead.items()
+            if self.force or fingerprint != self.get_fingerprint(title)]
+
+        with self.metrics.stage('diff'):
+            self.db.load_votes(
+                self.db.pks(Proposal, 'title', titles).values())
 
     def index_dossiers(self):
         self.cache['dossiers'] = {
@@ -166,6 +404,16 @@ class Command(object):
     def get_dossier(self, reference):
         return self.cache['dossiers'].get(reference, None)
 
+    def index_fingerprints(self):
+        self.cache['fingerprints'] = {
+            p[0]: p[1] for p in
+            Proposal.objects.exclude(fingerprint='').order_by()
+            .values_list('title', 'fingerprint')
+        }
+
+    def get_fingerprint(self, title):
+        return self.cache['fingerprints'].get(title, None)
+
     def index_representatives(self):
         epre = r'/meps/en/(\d+)/_home.html'
         self.cache['meps'] = {
@@ -174,19 +422,228 @@ class Command(object):
             .filter(website__kind='EP')
             .values_list('website__url', 'pk')
         }
+        # MEPs by name, loaded on first vote without a known ep_id
+        self.cache['names'] = None
 
     def get_representative(self, vote_data):
-        if vote_data.get('ep_id', None) is None:
-            return
-        return self.cache['meps'].get(int(vote_data['ep_id']), None)
+        if vote_data.get('ep_id', None) is not None:
+            representative_pk = self.cache['meps'].get(
+                int(vote_data['ep_id']), None)
+            if representative_pk is not None:
+                return representative_pk
+
+        if self.match_names and vote_data.get('name'):
+            return self.get_representative_by_name(vote_data['name'])
+
+    def get_representative_by_name(self, name):
+        if self.cache['names'] is None:
+            self.cache['names'] = NameIndex(
+                Representative.objects.filter(website__kind='EP')
+                .values_list('full_name', 'pk'))
+
+        representative_pk, status, score = self.cache['names'].match(name)
+        self.metrics.incr('names', status)
+        return representative_pk
+
+
+class ShardedImport(object):
+    """
+    Import proposals with a pool of worker processes.
+
+    Proposals are routed to workers by title, so that all records of a given
+    proposal are imported in the same order as a serial run would. Workers
+    are forked after init_cache() and share its read-only indexes, each one
+    opens its own database connection.
+    """
+    process_class = multiprocessing.Process
+    queue_class = staticmethod(multiprocessing.Queue)
+
+    def __init__(self, command, workers, batch_size=1, batch_interval=None):
+        self.command = command
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+    def shard(self, vote_data):
+        title = vote_data.get('title', u'').encode('utf-8')
+        return (zlib.crc32(title) & 0xffffffff) % self.workers
+
+    def work(self, queue, results):
+        start = time.time()
+        waiting = 0
+
+        # Only count what this worker does, on its own connection
+        metrics = ImportMetrics(self.command.metrics.name)
+        self.command.metrics = metrics
+        metrics.start()
+
+        with TransactionBatch(self.command.parse_vote_data, self.batch_size,
+                              self.batch_interval,
+                              on_rollback=self.command.init_cache,
+                              atomic=self.command.db.atomic) as batch:
+            while True:
+                wait_start = time.time()
+                vote_data = queue.get()
+                waiting += time.time() - wait_start
+
+                if vote_data is None:
+                    break
+
+                batch.add(vote_data)
+
+        metrics.stop()
+        connections.close_all()
+        results.put((batch.imported, time.time() - start - waiting,
+                     batch.failed, self.command.skipped,
+                     self.command.processed, metrics.report(),
+                     self.command.touched))
+
+    def run(self, stream):
+        # Children must not share the connection used to build the cache
+        connections.close_all()
+
+        results = self.queue_class()
+        queues = [self.queue_class(QUEUE_SIZE) for i in range(self.workers)]
+        processes = [self.process_class(target=self.work, args=(q, results))
+                     for q in queues]
+        for process in processes:
+            process.start()
+
+        try:
+            start = time.time()
+            metrics = self.command.metrics
+            parsing = metrics.stages['parse']
+            for vote_data in metrics.iterate(ijson.items(stream, 'item')):
+                i = self.shard(vote_data)
+                self.put(queues[i], vote_data, processes[i])
+            parsing = metrics.stages['parse'] - parsing
+
+            for queue, process in zip(queues, processes):
+                self.put(queue, None, process)
+
+            # Results are read before joining: a worker does not exit until
+            # its result went through the pipe
+            stats = self.collect(results, processes)
+        except BaseException:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            raise
+
+        for process in processes:
+            process.join()
+        failed = [p.exitcode for p in processes if p.exitcode]
+        if failed:
+            raise RuntimeError('Import workers exited with codes %s' %
+                               ', '.join(str(c) for c in failed))
+
+        count = sum(s[0] for s in stats)
+        busy = sum(s[1] for s in stats)
+        elapsed = time.time() - start
+        self.command.skipped += sum(s[3] for s in stats)
+        self.command.processed += sum(s[4] for s in stats)
+        for s in stats:
+            metrics.merge(s[5])
+            self.command.touched.update(s[6])
+
+        # Estimated from the parsing time plus the time each worker spent
+        # importing, which is what a serial run would roughly spend:
+        # benchmarks/run.py --workers measures it
+        logger.info('Imported %s proposals with %s workers in %.2fs, '
+                    'estimated %.2fx speedup over serial import', count,
+                    self.workers, elapsed,
+                    (parsing + busy) / elapsed if elapsed else 1)
+
+        return count
+
+    def put(self, queue, item, process):
+        """
+        Queue item for a worker, failing if it died instead of waiting for
+        room in its queue forever
+        """
+        while True:
+            try:
+                queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except Queue.Full:
+                if not process.is_alive():
+                    raise RuntimeError('Import worker exited with code %s' %
+                                       process.exitcode)
+
+    def collect(self, results, processes):
+        """
+        Return the result of each worker, failing if one of them died
+        before sending it
+        """
+        stats = []
+        finished = False
+        while len(stats) < len(processes):
+            try:
+                stats.append(results.get(timeout=POLL_INTERVAL))
+                continue
+            except Queue.Empty:
+                pass
+
+            alive = [p.is_alive() for p in processes]
+            if finished or any(not a and p.exitcode
+                               for a, p in zip(alive, processes)):
+                raise RuntimeError(
+                    'Import workers exited before sending their results, '
+                    'with codes %s' % ', '.join(
+                        str(p.exitcode) for p in processes))
+
+            # Results of workers that just exited may still be in the pipe,
+            # give them one more poll
+            finished = not any(alive)
+
+        return stats
 
 
 def main(stream=None):
+    parser = argument_parser('Import parltrack votes')
+    parser.add_argument('--workers', type=int, default=1,
+        help='Number of processes importing proposals in parallel')
+    parser.add_argument('--force', action='store_true', default=False,
+        help='Import proposals even if their record did not change')
+    parser.add_argument('--match-names', action='store_true', default=False,
+        help='Find MEPs without a known ep_id by name, which may mistake '
+             'one for another')
+    args = parse_args(parser, stream)
+
     if not apps.ready:
         django.setup()
 
-    command = Command()
-    command.init_cache()
-
-    for vote_data in ijson.items(stream or sys.stdin, 'item'):
-        command.parse_vote_data(vote_data)
+    if args.workers > 1 and connection.vendor == 'sqlite':
+        logger.warning('SQLite does not support concurrent writers, '
+                       'importing with a single process')
+        args.workers = 1
+
+    metrics = ImportMetrics('parltrack_import_votes', args.progress,
+                            args.metrics, args.dry_run)
+    command = Command(force=args.force, metrics=metrics,
+                      match_names=args.match_names)
+
+    with metrics, importer_input(args, stream) as f:
+        with metrics.stage('index'):
+            if args.dry_run:
+                command.db = DryRun()
+            command.init_cache()
+
+        if args.workers > 1:
+            ShardedImport(command, args.workers, args.batch_size,
+                          args.batch_interval).run(f)
+        else:
+            with TransactionBatch(command.parse_vote_data, args.batch_size,
+                                  args.batch_interval,
+                                  on_rollback=command.init_cache,
+                                  atomic=command.db.atomic) as batch:
+                for vote_data in read_ahead(
+                        metrics.iterate(ijson.items(f, 'item')),
+                        command.load_votes, BATCH_SIZE):
+                    batch.add(vote_data)
+
+        if not args.dry_run:
+            command.finish()
+
+    logger.info('Processed %s proposals, skipped %s unchanged proposals',
+                command.processed, command.skipped)
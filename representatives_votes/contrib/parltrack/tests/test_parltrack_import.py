@@ -1,14 +1,27 @@
 import copy
+import ijson
+import json
 import mock
 import os
 import pytest
+import Queue
+import sys
+import tempfile
+from StringIO import StringIO
 
 from django.core.serializers.json import Deserializer
 from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from representatives_votes.contrib.parltrack import import_dossiers
+from representatives_votes.contrib.dryrun import DryRun
+from representatives_votes.contrib.metrics import ImportMetrics
 from representatives_votes.contrib.parltrack import import_votes
-from representatives_votes.models import Dossier, Proposal, Vote
+from representatives_votes.contrib.utils import read_ahead
+from representatives_votes.models import (Dossier, GroupVote,
+                                          ImportGeneration, Proposal,
+                                          RepresentativeVoteStats, Vote)
 import representatives
 from representatives.models import Representative
 
@@ -20,7 +33,7 @@ def _test_import(scenario, callback):
             '%s_expected.json' % scenario)
 
     # Disable django auto fields
-    exclude = ('id', '_state', 'created', 'updated')
+    exclude = ('id', '_state', 'created', 'updated', 'fingerprint')
 
     with open(fixture, 'r') as f:
         callback(f)
@@ -54,6 +67,297 @@ def test_parltrack_import_votes():
     _test_import('votes', import_votes.main)
 
 
+@pytest.mark.django_db
+def test_parltrack_import_votes_metrics():
+    test_parltrack_import_votes()
+    Vote.objects.filter(pk=Vote.objects.order_by('pk')[0].pk).delete()
+
+    metrics = ImportMetrics()
+    command = import_votes.Command(force=True, metrics=metrics)
+    command.init_cache()
+
+    fixture = os.path.join(os.path.dirname(__file__), 'votes_fixture.json')
+    with open(fixture, 'r') as f:
+        for vote_data in metrics.iterate(ijson.items(f, 'item')):
+            command.parse_vote_data(vote_data)
+
+    counts = metrics.report()['counts']
+    assert metrics.records == 6
+    assert counts['proposals'] == {'unchanged': 6}
+    assert counts['votes'] == {'created': 1, 'updated': 0, 'skipped': 2,
+                               'unchanged': Vote.objects.count() - 1}
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_updates_changed_votes():
+    test_parltrack_import_votes()
+
+    count = Vote.objects.count()
+    pks = Vote.objects.order_by('pk').values_list('pk', flat=True)
+    Vote.objects.filter(pk=pks[0]).update(position='against')
+    Vote.objects.filter(pk=pks[1]).update(representative_name='Foo')
+    Vote.objects.filter(pk=pks[2]).delete()
+
+    def callback(stream):
+        command = import_votes.Command(force=True)
+        command.init_cache()
+        for vote_data in ijson.items(stream, 'item'):
+            command.parse_vote_data(vote_data)
+
+    _test_import('votes', callback)
+    assert Vote.objects.count() == count
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_skips_unchanged_proposals():
+    test_parltrack_import_votes()
+
+    fixture = os.path.join(os.path.dirname(__file__), 'votes_fixture.json')
+    with open(fixture, 'r') as f:
+        data = list(ijson.items(f, 'item'))
+    data[0]['Abstain']['total'] = '3'
+
+    Vote.objects.filter(proposal__title=data[1]['title']).delete()
+    command = import_votes.Command()
+    command.init_cache()
+
+    with CaptureQueriesContext(connection) as queries:
+        for vote_data in data:
+            command.parse_vote_data(vote_data)
+
+    # Savepoint, proposal, proposal update, votes, group votes and
+    # savepoint release, then the same but the update for the last
+    # proposal, which has votes of unknown MEPs
+    assert len(queries) == 11
+
+    assert command.processed == 2
+    assert command.skipped == 4
+    assert Proposal.objects.get(title=data[0]['title']).total_abstain == 3
+    assert not Vote.objects.filter(proposal__title=data[1]['title']).exists()
+    assert Proposal.objects.get(title=data[5]['title']).fingerprint == ''
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_retries_unknown_meps():
+    test_parltrack_import_votes()
+
+    fixture = os.path.join(os.path.dirname(__file__), 'votes_fixture.json')
+    with open(fixture, 'r') as f:
+        data = list(ijson.items(f, 'item'))
+    title = data[5]['title']
+    assert Vote.objects.filter(proposal__title=title).count() == 1
+
+    # The MEP whose ep_id was unknown is imported afterwards
+    representative = Representative.objects.create(
+        slug='new-mep', first_name='New', last_name='Mep',
+        full_name='New Mep')
+    representative.website_set.create(
+        kind='EP', url='http://www.europarl.europa.eu/meps/en/12323196673'
+        '/_home.html')
+
+    command = import_votes.Command()
+    command.init_cache()
+    for vote_data in data:
+        command.parse_vote_data(vote_data)
+
+    assert command.processed == 1
+    assert Vote.objects.filter(proposal__title=title).count() == 2
+    assert Vote.objects.filter(proposal__title=title,
+                               representative=representative).exists()
+
+
+@pytest.mark.django_db
+def test_parltrack_import_group_votes():
+    test_parltrack_import_votes()
+
+    fixture = os.path.join(os.path.dirname(__file__), 'votes_fixture.json')
+    with open(fixture, 'r') as f:
+        data = list(ijson.items(f, 'item'))
+
+    title = data[5]['title']
+    assert [(g.group, g.total_for, g.total_against, g.total_abstain,
+             g.cohesion) for g in GroupVote.objects.filter(
+                 proposal__title=title)] == [('PPE', 1, 0, 0, 1),
+                                             ('PPED', 2, 0, 0, 1)]
+    assert GroupVote.objects.get(proposal__title=data[3]['title']).cohesion \
+        == 0.25
+
+    # Moved votes are counted again, groups without votes are deleted
+    data[5]['For']['groups'][0]['group'] = 'PPE'
+    data[5]['Against'] = {'groups': [data[5]['For']['groups'].pop()]}
+    command = import_votes.Command(force=True)
+    command.init_cache()
+    command.parse_vote_data(data[5])
+
+    assert [(g.group, g.total_for, g.total_against, g.total_abstain,
+             g.cohesion) for g in GroupVote.objects.filter(
+                 proposal__title=title)] == [('PPE', 2, 1, 0, 0.5)]
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_pre_import_skip():
+    for model in (Representative, Dossier, Proposal, Vote):
+        model.objects.all().delete()
+
+    call_command('loaddata', os.path.join(os.path.abspath(
+        representatives.__path__[0]), 'fixtures', 'representatives_test.json'))
+    call_command('loaddata', os.path.join(os.path.dirname(__file__),
+        'dossiers_expected.json'))
+
+    seen = []
+
+    def skip(sender, vote_data, **kwargs):
+        # The proposal is saved before receivers are called
+        seen.append(Proposal.objects.filter(
+            title=vote_data['title']).exists())
+        return False
+
+    import_votes.vote_pre_import.connect(skip)
+    try:
+        fixture = os.path.join(os.path.dirname(__file__), 'votes_fixture.json')
+        with open(fixture, 'r') as f:
+            import_votes.main(f)
+    finally:
+        import_votes.vote_pre_import.disconnect(skip)
+
+    assert Proposal.objects.count() > 0
+    assert Vote.objects.count() == 0
+    assert seen and all(seen)
+    # Looked at again on the next run
+    assert set(Proposal.objects.values_list('fingerprint', flat=True)) == \
+        {''}
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_dry_run():
+    for model in (Representative, Dossier, Proposal, Vote):
+        model.objects.all().delete()
+
+    call_command('loaddata', os.path.join(os.path.abspath(
+        representatives.__path__[0]), 'fixtures', 'representatives_test.json'))
+    call_command('loaddata', os.path.join(os.path.dirname(__file__),
+        'dossiers_expected.json'))
+
+    def run(**kwargs):
+        command = import_votes.Command(metrics=ImportMetrics(), **kwargs)
+        command.init_cache()
+        fixture = os.path.join(os.path.dirname(__file__), 'votes_fixture.json')
+        with open(fixture, 'r') as f:
+            for vote_data in read_ahead(ijson.items(f, 'item'),
+                                        command.load_votes, 100):
+                command.parse_vote_data(vote_data)
+        return command.metrics.report()['counts']
+
+    planned = run(db=DryRun())
+    assert not Proposal.objects.exists()
+    assert not Vote.objects.exists()
+    assert planned == run()
+
+    vote = Vote.objects.order_by('pk')[0]
+    Vote.objects.filter(pk=vote.pk).update(position='foo')
+
+    with CaptureQueriesContext(connection) as queries:
+        planned = run(db=DryRun(), force=True)
+    # The votes of all proposals at once, no transaction
+    assert len([q for q in queries if
+                'FROM "representatives_votes_vote"' in q['sql']]) == 1
+    assert not [q for q in queries if 'SAVEPOINT' in q['sql']]
+    assert planned['votes']['updated'] == 1
+    assert planned['proposals'] == {'unchanged': 6}
+    assert Vote.objects.get(pk=vote.pk).position == 'foo'
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_match_names():
+    call_command('loaddata', os.path.join(os.path.abspath(
+        representatives.__path__[0]), 'fixtures', 'representatives_test.json'))
+
+    # Only found by ep_id, unless names are matched too
+    for match_names, expected in ((False, None), (True, 1)):
+        command = import_votes.Command(match_names=match_names)
+        command.init_cache()
+        assert command.get_representative({'ep_id': 2307}) == 1
+        assert command.get_representative(
+            {'ep_id': 1, 'name': 'Hubert Pirker'}) == expected
+        assert command.get_representative({'name': 'Pirker Hubert'}) is None
+
+
+class InlineProcess(object):
+    """ Run a ShardedImport worker in the test process when polled """
+    exitcode = None
+
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        if self.exitcode is None:
+            self.run()
+            self.exitcode = 0
+        return False
+
+    def run(self):
+        self.target(*self.args)
+
+    def join(self):
+        pass
+
+
+class CrashingProcess(InlineProcess):
+    """ Exit without sending a result, as a killed worker would """
+
+    def is_alive(self):
+        self.exitcode = -9
+        return False
+
+
+class InlineShardedImport(import_votes.ShardedImport):
+    process_class = InlineProcess
+    queue_class = Queue.Queue
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_sharded():
+    for model in (Representative, Dossier, Proposal, Vote):
+        model.objects.all().delete()
+
+    call_command('loaddata', os.path.join(os.path.abspath(
+        representatives.__path__[0]), 'fixtures', 'representatives_test.json'))
+    call_command('loaddata', os.path.join(os.path.dirname(__file__),
+        'dossiers_expected.json'))
+
+    command = import_votes.Command()
+    command.init_cache()
+
+    def callback(stream):
+        with mock.patch.object(import_votes.connections, 'close_all'):
+            # Queues are not bounded so that every proposal is queued
+            # before the inline workers run
+            with mock.patch.multiple(import_votes, QUEUE_SIZE=0,
+                                     POLL_INTERVAL=0):
+                assert InlineShardedImport(command, 3).run(stream) == 6
+
+    _test_import('votes', callback)
+
+
+@pytest.mark.django_db
+def test_parltrack_import_votes_sharded_crash():
+    command = import_votes.Command()
+    command.init_cache()
+
+    class CrashingShardedImport(InlineShardedImport):
+        process_class = CrashingProcess
+
+    with mock.patch.object(import_votes.connections, 'close_all'):
+        with mock.patch.multiple(import_votes, QUEUE_SIZE=0,
+                                 POLL_INTERVAL=0):
+            with pytest.raises(RuntimeError):
+                CrashingShardedImport(command, 2).run(StringIO('[]'))
+
+
 class DossierTest(TestCase):
     def setUp(self):
         for model in (Representative, Dossier, Proposal, Vote):
@@ -64,9 +368,47 @@ class DossierTest(TestCase):
             representatives.__path__[0]), 'fixtures',
             'representatives_test.json'))
 
-        with self.assertNumQueries(22):
+        # With vote stats, search documents and generations
+        with self.assertNumQueries(49):
             _test_import('single', import_dossiers.import_single)
 
+    def test_parltrack_import_dossiers_indexes_once(self):
+        call_command('loaddata', os.path.join(os.path.abspath(
+            representatives.__path__[0]), 'fixtures',
+            'representatives_test.json'))
+
+        fixture = os.path.join(os.path.dirname(__file__),
+            'single_fixture.json')
+        with open(fixture, 'r') as f:
+            first = json.load(f)
+
+        second = copy.deepcopy(first)
+        second['procedure']['reference'] = second['votes']['epref'] = 'foo'
+        second['votes']['title'] = 'bar'
+
+        def generations():
+            scopes = ['dossier', 'proposal', 'vote']
+            current = ImportGeneration.current(scopes)
+            return [current.get(s, (0, None))[0] for s in scopes]
+
+        before = generations()
+        init_cache = import_votes.Command.init_cache
+        with mock.patch.object(import_votes.Command, 'init_cache',
+                               autospec=True,
+                               side_effect=init_cache) as mocked:
+            import_dossiers.main(StringIO(json.dumps([first, second])))
+
+        assert mocked.call_count == 1
+        assert Proposal.objects.get(title='bar').dossier.reference == 'foo'
+        assert Proposal.objects.get(title='bar').votes.count() == 2
+        # Proposals and votes were imported too
+        assert generations() == [g + 1 for g in before]
+        voters = Vote.objects.filter(proposal__title='bar').values_list(
+            'representative_id', flat=True)
+        assert sorted(RepresentativeVoteStats.objects.filter(
+            representative_id__in=voters).values_list('votes', flat=True)) \
+            == [2, 2]
+
     def test_parltrack_sync_dossier(self):
         call_command('loaddata', os.path.join(os.path.abspath(
             representatives.__path__[0]), 'fixtures',
@@ -83,11 +425,57 @@ class DossierTest(TestCase):
         def callback(stream):
             import_dossiers.sync_dossier(reference)
 
+        url = '/api/dossiers/%s/' % Dossier.objects.get(
+            reference=reference).pk
+        etag = self.client.get(url, HTTP_ACCEPT='application/json')['ETag']
+
         with mock.patch('urllib2.urlopen') as urlopen:
             with open(mock_file, 'r') as mock_stream:
                 urlopen.return_value = mock_stream
 
-                with self.assertNumQueries(8):
+                # With search documents and generations
+                with self.assertNumQueries(21):
                     _test_import('sync', callback)
 
             urlopen.assert_called_with(expected_url)
+
+        # Not a 304 of the dossier before the sync
+        response = self.client.get(url, HTTP_ACCEPT='application/json',
+                                   HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        assert json.loads(response.content)['title'] == \
+            'Agenda for change: the future of EU development policy'
+
+    def test_parltrack_import_dossiers_dry_run(self):
+        call_command('loaddata', os.path.join(os.path.abspath(
+            representatives.__path__[0]), 'fixtures',
+            'representatives_test.json'))
+
+        fixture = os.path.join(os.path.dirname(__file__),
+            'single_fixture.json')
+        with open(fixture, 'r') as f:
+            first = json.load(f)
+
+        second = copy.deepcopy(first)
+        second['procedure']['reference'] = second['votes']['epref'] = 'foo'
+        second['votes']['title'] = 'bar'
+
+        dump = tempfile.NamedTemporaryFile(suffix='.json')
+        dump.write(json.dumps([first, second]))
+        dump.flush()
+
+        def run(*args):
+            report = tempfile.NamedTemporaryFile(suffix='.json')
+            argv = ['parltrack_import_dossiers', dump.name,
+                    '--metrics', report.name] + list(args)
+            with mock.patch.object(sys, 'argv', argv):
+                import_dossiers.main()
+            return json.load(report)['counts']
+
+        planned = run('--dry-run')
+        assert not Dossier.objects.exists()
+        assert not Proposal.objects.exists()
+        assert planned['dossiers'] == {'created': 2}
+        assert planned['proposals'] == {'created': 2}
+        assert planned == run()
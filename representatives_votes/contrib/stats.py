@@ -0,0 +1,157 @@
+# coding: utf-8
+import bisect
+import logging
+from collections import defaultdict
+
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from representatives_votes.contrib.dryrun import Database, _chunks
+from representatives_votes.models import (ImportGeneration, Proposal,
+                                          RepresentativeVoteStats, Vote)
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ['votes', 'total_for', 'total_against', 'total_abstain',
+          'proposals', 'participation', 'first_vote', 'last_vote']
+
+
+class Proposals(object):
+    """
+    Count proposals of some chambers between two dates, from the dates and
+    chambers of all proposals loaded with one query
+    """
+
+    def __init__(self):
+        # Chambers of the documents of the dossier of each proposal, None
+        # for dossiers without any
+        self.chambers = defaultdict(set)
+        self.datetimes = {}
+        for pk, datetime, chamber in Proposal.objects.order_by().values_list(
+                'pk', 'datetime', 'dossier__documents__chamber_id'):
+            self.datetimes[pk] = datetime
+            self.chambers[pk].add(chamber)
+
+        self.sorted = {}
+
+    def count(self, chambers, first, last):
+        chambers = frozenset(chambers)
+        if chambers not in self.sorted:
+            self.sorted[chambers] = sorted(
+                datetime for pk, datetime in self.datetimes.items()
+                if self.chambers[pk] & chambers)
+
+        datetimes = self.sorted[chambers]
+        return (bisect.bisect_right(datetimes, last) -
+                bisect.bisect_left(datetimes, first))
+
+
+def update_vote_stats(proposal_ids):
+    """
+    Update the statistics of representatives who voted on proposals, or who
+    were active when they were voted on
+    """
+    proposal_ids = sorted(proposal_ids)
+    representatives = set()
+    datetimes = []
+    for chunk in _chunks(proposal_ids):
+        representatives.update(
+            Vote.objects.filter(proposal_id__in=chunk,
+                                representative_id__isnull=False)
+            .order_by().values_list('representative_id', flat=True)
+            .distinct())
+        datetimes += Proposal.objects.filter(pk__in=chunk).values_list(
+            'datetime', flat=True)
+
+    if datetimes:
+        representatives.update(RepresentativeVoteStats.objects.filter(
+            first_vote__lte=max(datetimes), last_vote__gte=min(datetimes))
+            .values_list('representative_id', flat=True))
+
+    return compute_vote_stats(sorted(representatives))
+
+
+def rebuild_vote_stats():
+    """
+    Recompute the statistics of all representatives who voted
+    """
+    RepresentativeVoteStats.objects.all().delete()
+    return compute_vote_stats(sorted(
+        Vote.objects.filter(representative_id__isnull=False).order_by()
+        .values_list('representative_id', flat=True).distinct()))
+
+
+def compute_vote_stats(representative_ids):
+    """
+    Compute and save the statistics of representatives, with a few grouped
+    queries per BATCH_SIZE representatives, return how many were saved
+    """
+    if not representative_ids:
+        return 0
+
+    proposals = Proposals()
+    db = Database()
+    saved = 0
+
+    for chunk in _chunks(representative_ids):
+        votes = Vote.objects.filter(representative_id__in=chunk).order_by()
+
+        counts = defaultdict(dict)
+        for row in votes.values('representative_id', 'position') \
+                .annotate(count=Count('pk')):
+            counts[row['representative_id']][row['position']] = row['count']
+
+        periods = {
+            row['representative_id']: (row['first'], row['last'])
+            for row in votes.values('representative_id').annotate(
+                first=Min('proposal__datetime'),
+                last=Max('proposal__datetime'))
+        }
+
+        chambers = defaultdict(set)
+        for pk, chamber in votes.values_list(
+                'representative_id',
+                'proposal__dossier__documents__chamber_id').distinct():
+            chambers[pk].add(chamber)
+
+        existing = {
+            s.representative_id: s for s in
+            RepresentativeVoteStats.objects.filter(
+                representative_id__in=chunk)
+        }
+
+        created = []
+        updated = []
+        for pk in chunk:
+            stats = existing.get(pk) or RepresentativeVoteStats(
+                representative_id=pk)
+            before = [getattr(stats, f) for f in FIELDS]
+
+            positions = counts.get(pk, {})
+            for position in ('for', 'against', 'abstain'):
+                setattr(stats, 'total_%s' % position,
+                        positions.get(position, 0))
+            stats.votes = sum(positions.values())
+            stats.first_vote, stats.last_vote = periods.get(pk, (None, None))
+            stats.proposals = proposals.count(
+                chambers[pk], stats.first_vote, stats.last_vote) \
+                if stats.votes else 0
+            stats.participation = round(
+                float(stats.votes) / stats.proposals, 4) \
+                if stats.proposals else 0
+
+            if stats.pk is None:
+                created.append(stats)
+            elif [getattr(stats, f) for f in FIELDS] != before:
+                stats.updated = timezone.now()
+                updated.append(stats)
+
+        db.bulk_create(created)
+        db.bulk_update(updated, FIELDS + ['updated'])
+        saved += len(created) + len(updated)
+
+    if saved:
+        ImportGeneration.bump('vote_stats')
+
+    logger.info('Updated vote stats of %s representatives', saved)
+    return saved
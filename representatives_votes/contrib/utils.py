@@ -0,0 +1,126 @@
+# coding: utf-8
+import argparse
+import contextlib
+import gzip
+import io
+import logging
+import subprocess
+import sys
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        # Decompress with the xz command instead
+        lzma = None
+
+logger = logging.getLogger(__name__)
+
+# Size of the reads on the dump file, and so of the chunks given to ijson
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+def argument_parser(description):
+    """
+    Return an ArgumentParser with the options shared by all importers
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('dump', nargs='?', default='-',
+        help='Path to a .json, .json.gz or .json.xz dump, defaults to stdin')
+    parser.add_argument('--buffer-size', type=int,
+        default=DEFAULT_BUFFER_SIZE,
+        help='Size in bytes of the reads on the dump')
+    parser.add_argument('--batch-size', type=int, default=1,
+        help='Number of records imported in each transaction')
+    parser.add_argument('--batch-interval', type=float, default=None,
+        help='Commit the current transaction after that many seconds')
+    parser.add_argument('--metrics', metavar='PATH',
+        help='Write the JSON report of the run there instead of stderr')
+    parser.add_argument('--progress', type=int, metavar='N',
+        help='Log a progress line every N records')
+    parser.add_argument('--dry-run', action='store_true', default=False,
+        help='Report what would be created or updated, write nothing')
+    return parser
+
+
+def read_ahead(items, load, size):
+    """
+    Yield items, calling load with each chunk of size items before yielding
+    them, so that what they need is looked up with bulk queries
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            load(chunk)
+            for loaded in chunk:
+                yield loaded
+            chunk = []
+
+    if chunk:
+        load(chunk)
+        for loaded in chunk:
+            yield loaded
+
+
+def parse_args(parser, stream=None):
+    """
+    Parse the command line, unless the importer was called with a stream
+    """
+    return parser.parse_args(sys.argv[1:] if stream is None else [])
+
+
+@contextlib.contextmanager
+def open_dump(path, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Open a dump for reading, decompressing it on the fly if its name ends
+    with .xz or .gz. Memory use is bounded by buffer_size whatever the size
+    of the dump, and nothing is written on disk.
+    """
+    if path == '-':
+        yield io.open(sys.stdin.fileno(), 'rb', buffering=buffer_size,
+                      closefd=False)
+    elif path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            yield io.BufferedReader(f, buffer_size)
+    elif path.endswith('.xz') and lzma is not None:
+        # Raise what the xz command fallback raises for corrupt dumps
+        try:
+            with lzma.LZMAFile(path, 'rb') as f:
+                yield io.BufferedReader(f, buffer_size)
+        except (lzma.LZMAError, EOFError) as e:
+            raise IOError('Could not decompress %s: %s' % (path, e))
+    elif path.endswith('.xz'):
+        process = subprocess.Popen(['xz', '--decompress', '--stdout', path],
+                                   stdout=subprocess.PIPE,
+                                   bufsize=buffer_size)
+        try:
+            yield process.stdout
+        except Exception:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            if process.wait() > 0:
+                raise IOError('Could not decompress %s' % path)
+    else:
+        with io.open(path, 'rb', buffering=buffer_size) as f:
+            yield f
+
+
+@contextlib.contextmanager
+def importer_input(args, stream=None):
+    """
+    Yield the stream an importer was called with, or the dump from its
+    command line
+    """
+    if stream is not None:
+        yield stream
+        return
+
+    logger.debug('Reading %s with %s bytes reads', args.dump,
+                 args.buffer_size)
+    with open_dump(args.dump, args.buffer_size) as f:
+        yield f
@@ -0,0 +1,113 @@
+# coding: utf-8
+import csv
+import datetime
+import json
+
+from django.utils.dateparse import parse_date
+
+from representatives_votes.models import Document, Vote
+
+# Columns of exported votes and the lookups they come from
+FIELDS = (
+    ('proposal', 'proposal_id'),
+    ('proposal_reference', 'proposal__reference'),
+    ('datetime', 'proposal__datetime'),
+    ('dossier', 'proposal__dossier__reference'),
+    ('representative', 'representative_id'),
+    ('representative_slug', 'representative__slug'),
+    ('representative_name', 'representative_name'),
+    ('position', 'position'),
+)
+
+# Number of votes fetched per query
+CHUNK_SIZE = 1000
+
+FORMATS = ('ndjson', 'csv')
+
+
+def filter_votes(votes, dossier=None, since=None, until=None, chamber=None):
+    """
+    Return votes on proposals of a dossier id, of dossiers with documents of
+    a chamber abbreviation, or made between since and until, ISO dates
+    included. Raise ValueError for invalid dates.
+    """
+    if dossier:
+        votes = votes.filter(proposal__dossier_id=dossier)
+
+    if since:
+        votes = votes.filter(proposal__datetime__gte=_date(since))
+
+    if until:
+        votes = votes.filter(proposal__datetime__lt=_date(until) +
+                             datetime.timedelta(days=1))
+
+    if chamber:
+        # A subquery rather than a join, which would repeat votes
+        votes = votes.filter(proposal__dossier_id__in=Document.objects.filter(
+            chamber__abbreviation=chamber).values('dossier_id'))
+
+    return votes
+
+
+def _date(value):
+    date = parse_date(value)
+    if date is None:
+        raise ValueError('%s is not a YYYY-MM-DD date' % value)
+    return date
+
+
+def iter_votes(votes=None):
+    """
+    Yield exported votes as tuples of FIELDS values, CHUNK_SIZE at a time
+    by primary key range, so that memory use does not depend on how many
+    there are
+    """
+    if votes is None:
+        votes = Vote.objects.all()
+
+    lookups = ['pk'] + [lookup for name, lookup in FIELDS]
+    last = None
+    while True:
+        chunk = votes if last is None else votes.filter(pk__gt=last)
+        rows = list(chunk.order_by('pk').values_list(*lookups)[:CHUNK_SIZE])
+        for row in rows:
+            yield row[1:]
+
+        if len(rows) < CHUNK_SIZE:
+            return
+        last = rows[-1][0]
+
+
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def ndjson_lines(rows):
+    names = [name for name, lookup in FIELDS]
+    for row in rows:
+        yield json.dumps(dict(zip(names, map(_value, row)))) + '\n'
+
+
+class _Line(object):
+    # File-like object returning what csv writes instead of keeping it
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow([name for name, lookup in FIELDS])
+
+    for row in rows:
+        yield writer.writerow([
+            '' if v is None else unicode(_value(v)).encode('utf-8')
+            for v in row
+        ])
+
+
+def export_lines(rows, format='ndjson'):
+    if format == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from representatives_votes import export
+from representatives_votes.models import Vote
+
+
+class Command(BaseCommand):
+    help = ('Export votes with the keys of their proposal and representative '
+            'as NDJSON or CSV')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=export.FORMATS,
+            default='ndjson', help='Output format, defaults to ndjson')
+        parser.add_argument('--output',
+            help='Path to write votes to, defaults to stdout')
+        parser.add_argument('--dossier', type=int,
+            help='Only votes on proposals of this dossier id')
+        parser.add_argument('--chamber',
+            help='Only votes on dossiers with documents of this chamber '
+                 'abbreviation')
+        parser.add_argument('--since',
+            help='Only votes on proposals made on this YYYY-MM-DD or after')
+        parser.add_argument('--until',
+            help='Only votes on proposals made on this YYYY-MM-DD or before')
+
+    def handle(self, *args, **options):
+        try:
+            votes = export.filter_votes(
+                Vote.objects.all(), dossier=options['dossier'],
+                since=options['since'], until=options['until'],
+                chamber=options['chamber'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = export.export_lines(export.iter_votes(votes),
+                                    options['format'])
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'w') as f:
+            for line in lines:
+                f.write(line)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from representatives_votes.search import rebuild_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Recompute the search documents of all dossiers and proposals'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_search_documents()
+        self.stdout.write('Computed %s search documents' % count)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from representatives_votes.contrib.stats import rebuild_vote_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the vote statistics of all representatives'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_vote_stats()
+        self.stdout.write('Computed vote stats of %s representatives' % count)
@@ -1,8 +1,14 @@
 from representatives.management.remove_command import RemoveCommand
 
-from representatives_votes.models import Dossier
+from representatives_votes.models import Dossier, ImportGeneration
 
 
 class Command(RemoveCommand):
     manager = Dossier.objects
     conditions = {'proposals': None}
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+
+        if not options.get('dry', False):
+            ImportGeneration.bump('dossier', 'document')
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('representatives_votes', '0012_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='proposal',
+            name='fingerprint',
+            field=models.CharField(default='', max_length=40, blank=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('representatives_votes', '0013_proposal_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='link',
+            field=models.URLField(max_length=1000, db_index=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_generations(apps, schema_editor):
+    ImportGeneration = apps.get_model('representatives_votes',
+                                      'ImportGeneration')
+    for scope in ('dossier', 'document', 'proposal', 'vote'):
+        ImportGeneration.objects.create(scope=scope)
+
+
+def delete_generations(apps, schema_editor):
+    ImportGeneration = apps.get_model('representatives_votes',
+                                      'ImportGeneration')
+    ImportGeneration.objects.filter(
+        scope__in=('dossier', 'document', 'proposal', 'vote')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('representatives_votes', '0014_document_link_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportGeneration',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('scope', models.CharField(unique=True, max_length=20)),
+                ('generation', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_generations, delete_generations),
+    ]
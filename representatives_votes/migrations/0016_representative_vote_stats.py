@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_generation(apps, schema_editor):
+    ImportGeneration = apps.get_model('representatives_votes',
+                                      'ImportGeneration')
+    ImportGeneration.objects.create(scope='vote_stats')
+
+
+def delete_generation(apps, schema_editor):
+    ImportGeneration = apps.get_model('representatives_votes',
+                                      'ImportGeneration')
+    ImportGeneration.objects.filter(scope='vote_stats').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('representatives', '0020_rep_unique_slug_remove_remoteid'),
+        ('representatives_votes', '0015_import_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepresentativeVoteStats',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('votes', models.IntegerField(default=0)),
+                ('total_for', models.IntegerField(default=0)),
+                ('total_against', models.IntegerField(default=0)),
+                ('total_abstain', models.IntegerField(default=0)),
+                ('proposals', models.IntegerField(default=0)),
+                ('participation', models.FloatField(default=0, db_index=True)),
+                ('first_vote', models.DateTimeField(null=True)),
+                ('last_vote', models.DateTimeField(null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('representative', models.OneToOneField(related_name='vote_stats', to='representatives.Representative')),
+            ],
+            options={
+                'verbose_name_plural': 'representative vote stats',
+            },
+        ),
+        migrations.RunPython(create_generation, delete_generation),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('representatives_votes', '0016_representative_vote_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupVote',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('group', models.CharField(max_length=100, db_index=True)),
+                ('total_for', models.IntegerField(default=0)),
+                ('total_against', models.IntegerField(default=0)),
+                ('total_abstain', models.IntegerField(default=0)),
+                ('cohesion', models.FloatField(default=0)),
+                ('proposal', models.ForeignKey(related_name='group_votes', to='representatives_votes.Proposal')),
+            ],
+            options={
+                'ordering': ['proposal', 'group'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupvote',
+            unique_together=set([('proposal', 'group')]),
+        ),
+    ]
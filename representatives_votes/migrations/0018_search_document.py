@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import OperationalError, migrations, models
+
+# Search document tables and their primary key
+TABLES = (
+    ('representatives_votes_dossiersearchdocument', 'dossier_id'),
+    ('representatives_votes_proposalsearchdocument', 'proposal_id'),
+)
+
+# An external content FTS5 table per search document table, kept in sync by
+# triggers, unless SQLite was built without FTS5: search.search() then falls
+# back to icontains
+SQLITE = (
+    "CREATE VIRTUAL TABLE {table}_fts USING fts5(text, content='{table}', "
+    "content_rowid='{pk}', tokenize='unicode61 remove_diacritics 1')",
+    "CREATE TRIGGER {table}_ai AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {table}_fts(rowid, text) VALUES (new.{pk}, new.text); END",
+    "CREATE TRIGGER {table}_ad AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {table}_fts({table}_fts, rowid, text) "
+    "VALUES ('delete', old.{pk}, old.text); END",
+    "CREATE TRIGGER {table}_au AFTER UPDATE ON {table} BEGIN "
+    "INSERT INTO {table}_fts({table}_fts, rowid, text) "
+    "VALUES ('delete', old.{pk}, old.text); "
+    "INSERT INTO {table}_fts(rowid, text) VALUES (new.{pk}, new.text); END",
+)
+
+POSTGRESQL = (
+    "CREATE INDEX {table}_fts ON {table} "
+    "USING GIN (to_tsvector('simple', text))",
+)
+
+
+def has_fts5(connection):
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE temp.fts5_probe '
+                           'USING fts5(text)')
+        except OperationalError:
+            return False
+        cursor.execute('DROP TABLE temp.fts5_probe')
+    return True
+
+
+def create_indexes(apps, schema_editor):
+    statements = {
+        'sqlite': SQLITE,
+        'postgresql': POSTGRESQL,
+    }.get(schema_editor.connection.vendor, ())
+
+    if statements is SQLITE and not has_fts5(schema_editor.connection):
+        return
+
+    for table, pk in TABLES:
+        for statement in statements:
+            schema_editor.execute(statement.format(table=table, pk=pk))
+
+
+def drop_indexes(apps, schema_editor):
+    # Triggers and indexes go with their table
+    if schema_editor.connection.vendor == 'sqlite':
+        for table, pk in TABLES:
+            schema_editor.execute('DROP TABLE IF EXISTS {table}_fts'.format(
+                table=table))
+
+
+def create_generation(apps, schema_editor):
+    ImportGeneration = apps.get_model('representatives_votes',
+                                      'ImportGeneration')
+    ImportGeneration.objects.create(scope='search')
+
+
+def delete_generation(apps, schema_editor):
+    ImportGeneration = apps.get_model('representatives_votes',
+                                      'ImportGeneration')
+    ImportGeneration.objects.filter(scope='search').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('representatives_votes', '0017_group_vote'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DossierSearchDocument',
+            fields=[
+                ('text', models.TextField(default=b'')),
+                ('dossier', models.OneToOneField(related_name='search_document', primary_key=True, serialize=False, to='representatives_votes.Dossier')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProposalSearchDocument',
+            fields=[
+                ('text', models.TextField(default=b'')),
+                ('proposal', models.OneToOneField(related_name='search_document', primary_key=True, serialize=False, to='representatives_votes.Proposal')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(create_indexes, drop_indexes),
+        migrations.RunPython(create_generation, delete_generation),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('representatives_votes', '0018_search_document'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='vote',
+            index_together=set([('proposal', 'id')]),
+        ),
+    ]
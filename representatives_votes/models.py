@@ -1,5 +1,6 @@
 # coding: utf-8
 from django.db import models
+from django.utils import timezone
 
 from representatives.models import Chamber, Representative, TimeStampedModel
 
@@ -31,7 +32,7 @@ class Document(TimeStampedModel):
     chamber = models.ForeignKey(Chamber)
     title = models.CharField(max_length=1000)
     kind = models.CharField(max_length=255, blank=True, default='')
-    link = models.URLField(max_length=1000)
+    link = models.URLField(max_length=1000, db_index=True)
 
 
 class Proposal(TimeStampedModel):
@@ -44,6 +45,8 @@ class Proposal(TimeStampedModel):
     total_abstain = models.IntegerField()
     total_against = models.IntegerField()
     total_for = models.IntegerField()
+    # Hash of the raw record this proposal was last imported from
+    fingerprint = models.CharField(max_length=40, blank=True, default='')
 
     representatives = models.ManyToManyField(
         Representative, through='Vote', related_name='proposals'
@@ -85,3 +88,128 @@ class Vote(models.Model):
     class Meta:
         ordering = ['proposal__datetime']
         unique_together = (('proposal', 'representative'))
+        # The ordering of VoteKeysetPagination
+        index_together = (('proposal', 'id'),)
+
+
+class GroupVote(models.Model):
+    """
+    Number of members of a political group who took each position on a
+    proposal, as listed by the source of the votes, and how united the
+    group was.
+    """
+    proposal = models.ForeignKey(Proposal, related_name='group_votes')
+    # Abbreviation of the group in the source, like EPP or S&D
+    group = models.CharField(max_length=100, db_index=True)
+    total_for = models.IntegerField(default=0)
+    total_against = models.IntegerField(default=0)
+    total_abstain = models.IntegerField(default=0)
+    # Agreement index of Hix, Noury and Roland, from 0 when the group split
+    # evenly between the three positions (0.25 between two of them) to 1
+    # when all its members took the same position
+    cohesion = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['proposal', 'group']
+        unique_together = (('proposal', 'group'))
+
+    def __unicode__(self):
+        return u'%s on %s' % (self.group, self.proposal_id)
+
+    def update_cohesion(self):
+        totals = (self.total_for, self.total_against, self.total_abstain)
+        total = sum(totals)
+        self.cohesion = round(
+            (max(totals) - (total - max(totals)) / 2.) / total, 4) \
+            if total else 0
+
+
+class RepresentativeVoteStats(models.Model):
+    """
+    Votes of a representative by position, and the number of proposals they
+    could have voted on: those of the chambers of the dossiers they voted
+    on, between their first and last vote.
+
+    Importers update the statistics of the representatives concerned by the
+    proposals they changed, rebuild_vote_stats recomputes them all.
+    """
+    representative = models.OneToOneField(Representative,
+                                          related_name='vote_stats')
+    votes = models.IntegerField(default=0)
+    total_for = models.IntegerField(default=0)
+    total_against = models.IntegerField(default=0)
+    total_abstain = models.IntegerField(default=0)
+    proposals = models.IntegerField(default=0)
+    # Share of proposals the representative voted on
+    participation = models.FloatField(default=0, db_index=True)
+    first_vote = models.DateTimeField(null=True)
+    last_vote = models.DateTimeField(null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'representative vote stats'
+
+    def __unicode__(self):
+        return u'%s: %s votes' % (self.representative_id, self.votes)
+
+
+class SearchDocument(models.Model):
+    """
+    Text searched for an object, indexed for full-text search by the
+    migration that created the table: with a GIN index on PostgreSQL and
+    an FTS5 table on SQLite.
+    """
+    text = models.TextField(default='')
+
+    class Meta:
+        abstract = True
+
+
+class DossierSearchDocument(SearchDocument):
+    dossier = models.OneToOneField(Dossier, primary_key=True,
+                                   related_name='search_document')
+
+
+class ProposalSearchDocument(SearchDocument):
+    proposal = models.OneToOneField(Proposal, primary_key=True,
+                                    related_name='search_document')
+
+
+class ImportGeneration(models.Model):
+    """
+    Number of imports which changed the rows of a model, a cheap validator
+    for anything computed from them: importers bump the generations of the
+    models they wrote when they are done.
+    """
+    SCOPES = ('dossier', 'document', 'proposal', 'vote', 'vote_stats',
+              'search')
+
+    scope = models.CharField(max_length=20, unique=True)
+    generation = models.IntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    def __unicode__(self):
+        return u'%s %s' % (self.scope, self.generation)
+
+    @classmethod
+    def bump(cls, *scopes):
+        for scope in scopes:
+            bumped = cls.objects.filter(scope=scope).update(
+                generation=models.F('generation') + 1,
+                updated=timezone.now())
+            if not bumped:
+                # Rows are created by migrations, unless the table was
+                # flushed since
+                cls.objects.get_or_create(scope=scope,
+                                          defaults={'generation': 1})
+
+    @classmethod
+    def current(cls, scopes):
+        """
+        Return the generation and update time of scopes, with one query
+        """
+        return {
+            scope: (generation, updated) for scope, generation, updated in
+            cls.objects.filter(scope__in=scopes).values_list(
+                'scope', 'generation', 'updated')
+        }
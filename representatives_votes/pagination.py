@@ -0,0 +1,153 @@
+# coding: utf-8
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    Paginate by cursor on the values of ordering, whose last field must be
+    unique: a page is the rows after (or before) the last row of another
+    one, found with an index range instead of an offset, so that deep pages
+    are as fast as the first one. Nothing is counted.
+
+    Cursors encode the ordering values of a row and a direction, start with
+    an empty ?cursor=.
+    """
+
+    ordering = ('datetime', 'id')
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        reverse = False
+        if cursor is not None:
+            reverse, values = cursor
+            queryset = queryset.filter(self.after(values, reverse))
+
+        queryset = queryset.order_by(*[
+            '-%s' % f if reverse else f for f in self.ordering])
+        rows = list(queryset[:self.page_size + 1])
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Going back, there is a next page: the one the cursor came from
+        self.next = self.previous = None
+        if rows and (more or reverse):
+            self.next = self.encode_cursor(rows[-1], False)
+        if rows and (more if reverse else cursor is not None):
+            self.previous = self.encode_cursor(rows[0], True)
+
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.next)),
+            ('previous', self.get_link(self.previous)),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def after(self, values, reverse):
+        """
+        Return the condition for rows after values, or before if reverse
+        """
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            q = Q(**{'%s__%s' % (field, lookup): values[i]})
+            for previous, value in zip(self.ordering[:i], values):
+                q &= Q(**{previous: value})
+            condition |= q
+
+        # Lets the database use an index range on the first field
+        first = {'%s__%se' % (self.ordering[0], lookup): values[0]}
+        return Q(**first) & condition
+
+    def encode_cursor(self, row, reverse):
+        values = []
+        for field in self.ordering:
+            if isinstance(row, dict):
+                # Rows from QuerySet.values()
+                value = row[field]
+            else:
+                value = row
+                for name in field.split('__'):
+                    value = getattr(value, name)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            values.append(value)
+
+        data = json.dumps({'r': reverse, 'k': values})
+        return base64.urlsafe_b64encode(data)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(str(encoded)))
+            values = data['k']
+            if len(values) != len(self.ordering):
+                raise ValueError()
+            return bool(data['r']), values
+        except (TypeError, ValueError, KeyError):
+            raise NotFound('Invalid cursor')
+
+
+class VoteKeysetPagination(KeysetPagination):
+    """
+    Paginate votes by proposal, in the order proposals were imported, rather
+    than by proposal datetime: that would join proposals for each page, with
+    no index spanning both tables to take a range of, while
+    Vote.Meta.index_together has (proposal_id, id).
+    """
+
+    ordering = ('proposal_id', 'id')
+
+
+class KeysetPaginationMixin(object):
+    """
+    Use keyset_pagination_class instead of pagination_class for requests
+    with a cursor parameter, even empty
+    """
+
+    keyset_pagination_class = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            param = getattr(self.keyset_pagination_class,
+                            'cursor_query_param', None)
+            if param is not None and param in self.request.query_params:
+                self._paginator = self.keyset_pagination_class()
+        return super(KeysetPaginationMixin, self).paginator
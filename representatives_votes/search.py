@@ -0,0 +1,202 @@
+# coding: utf-8
+import logging
+import unicodedata
+from collections import defaultdict
+
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from representatives_votes.contrib.dryrun import Database, _chunks
+from representatives_votes.models import (Dossier, DossierSearchDocument,
+                                          ImportGeneration, Proposal,
+                                          ProposalSearchDocument)
+
+logger = logging.getLogger(__name__)
+
+# Text search configuration of PostgreSQL, that of the GIN indexes
+POSTGRESQL_CONFIG = 'simple'
+
+# Search document model of each searchable model
+DOCUMENTS = {
+    Dossier: DossierSearchDocument,
+    Proposal: ProposalSearchDocument,
+}
+
+# Whether the FTS5 tables exist by database alias, they do not when SQLite
+# was built without FTS5
+_fts5 = {}
+
+
+def dossier_texts(pks):
+    """
+    Return the search text of dossiers by pk: their title, reference and
+    text, and the titles of their proposals
+    """
+    proposals = defaultdict(list)
+    for dossier_id, title in Proposal.objects.filter(dossier_id__in=pks) \
+            .order_by('pk').values_list('dossier_id', 'title'):
+        proposals[dossier_id].append(title)
+
+    return {
+        pk: _join([title, reference, text] + proposals[pk])
+        for pk, title, reference, text in Dossier.objects.filter(
+            pk__in=pks).values_list('pk', 'title', 'reference', 'text')
+    }
+
+
+def proposal_texts(pks):
+    """
+    Return the search text of proposals by pk: their title and reference,
+    and those of their dossier
+    """
+    return {
+        row[0]: _join(row[1:]) for row in
+        Proposal.objects.filter(pk__in=pks).values_list(
+            'pk', 'title', 'reference', 'dossier__title',
+            'dossier__reference')
+    }
+
+
+def _join(values):
+    return unaccent(u'\n'.join(v for v in values if v))
+
+
+def unaccent(text):
+    """
+    Return text without its accents, which search documents and terms go
+    without so that every database ignores them
+    """
+    return u''.join(c for c in unicodedata.normalize('NFKD', text)
+                    if not unicodedata.combining(c))
+
+
+def update_search_documents():
+    """
+    Update the search documents of the dossiers and proposals changed
+    since the last update, or of all of them the first time
+    """
+    start = timezone.now()
+    generation, updated = ImportGeneration.current(['search']).get(
+        'search', (0, None))
+    since = updated if generation else None
+
+    dossiers = Dossier.objects.order_by()
+    proposals = Proposal.objects.order_by()
+    if since is not None:
+        dossiers = dossiers.filter(
+            Q(updated__gte=since) |
+            Q(pk__in=proposals.filter(updated__gte=since)
+              .values('dossier_id')))
+        proposals = proposals.filter(
+            Q(updated__gte=since) | Q(dossier__updated__gte=since))
+
+    saved = _save(DossierSearchDocument, dossier_texts,
+                  sorted(dossiers.values_list('pk', flat=True)))
+    saved += _save(ProposalSearchDocument, proposal_texts,
+                   sorted(proposals.values_list('pk', flat=True)))
+
+    # Rows changed while this ran are looked at again by the next update
+    ImportGeneration.bump('search')
+    ImportGeneration.objects.filter(scope='search').update(updated=start)
+
+    logger.info('Updated %s search documents', saved)
+    return saved
+
+
+def rebuild_search_documents():
+    """
+    Compute the search documents of all dossiers and proposals again
+    """
+    for document in DOCUMENTS.values():
+        document.objects.all().delete()
+    ImportGeneration.objects.filter(scope='search').update(generation=0)
+    return update_search_documents()
+
+
+def _save(document, texts, pks):
+    """
+    Save the texts of pks in document rows with bulk queries, return how
+    many changed
+    """
+    db = Database()
+    key = document._meta.pk.attname
+    saved = 0
+
+    for chunk in _chunks(pks):
+        existing = document.objects.in_bulk(chunk)
+        created = []
+        updated = []
+        for pk, text in texts(chunk).items():
+            if pk not in existing:
+                created.append(document(text=text, **{key: pk}))
+            elif existing[pk].text != text:
+                existing[pk].text = text
+                updated.append(existing[pk])
+
+        db.bulk_create(created)
+        db.bulk_update(updated, ['text'])
+        saved += len(created) + len(updated)
+
+    return saved
+
+
+def search(queryset, terms):
+    """
+    Return the rows of queryset whose search document has words starting
+    with each of terms, with a search_rank to order them by from most to
+    least relevant, unless the database has no full-text index
+    """
+    model = queryset.model
+    document = DOCUMENTS[model]
+    terms = [unaccent(t) for t in terms]
+    ops = connections[queryset.db].ops
+    vendor = connections[queryset.db].vendor
+    pk = '%s.%s' % (ops.quote_name(model._meta.db_table),
+                    ops.quote_name(model._meta.pk.column))
+
+    if vendor == 'sqlite' and _has_fts5(queryset.db):
+        table = document._meta.db_table + '_fts'
+        fts = ops.quote_name(table)
+        # Prefix phrases, so that FTS5 operators in terms are not parsed
+        query = u' '.join(u'"%s"*' % t.replace(u'"', u'""') for t in terms)
+        return queryset.extra(
+            select={'search_rank': '-bm25(%s)' % fts},
+            tables=[table],
+            where=['%s.rowid = %s' % (fts, pk), '%s MATCH %%s' % fts],
+            params=[query])
+
+    if vendor == 'postgresql':
+        table = document._meta.db_table
+        documents = ops.quote_name(table)
+        vector = "to_tsvector('%s', %s.text)" % (POSTGRESQL_CONFIG,
+                                                 documents)
+        tsquery = "to_tsquery('%s', %%s)" % POSTGRESQL_CONFIG
+        # Quoted prefix lexemes, so that tsquery operators are not parsed
+        query = u' & '.join(
+            u"'%s':*" % t.replace(u'\\', u'\\\\').replace(u"'", u"''")
+            for t in terms)
+        join = '%s.%s = %s' % (
+            documents, ops.quote_name(document._meta.pk.column), pk)
+        return queryset.extra(
+            select={'search_rank': 'ts_rank(%s, %s)' % (vector, tsquery)},
+            select_params=[query],
+            tables=[table],
+            where=[join, '%s @@ %s' % (vector, tsquery)],
+            params=[query])
+
+    for term in terms:
+        queryset = queryset.filter(search_document__text__icontains=term)
+    return queryset
+
+
+def _has_fts5(alias):
+    if alias not in _fts5:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' "
+                "AND name IN (%s, %s)", [
+                    document._meta.db_table + '_fts'
+                    for document in DOCUMENTS.values()])
+            _fts5[alias] = cursor.fetchone()[0] == len(DOCUMENTS)
+    return _fts5[alias]
@@ -1,8 +1,11 @@
 # coding: utf-8
+import datetime
+from collections import OrderedDict
 
 import representatives_votes.models as models
 
 from rest_framework import serializers
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
 
 
 class VoteSerializer(serializers.HyperlinkedModelSerializer):
@@ -100,3 +103,107 @@ class DossierDetailSerializer(DossierSerializer):
 
     class Meta(DossierSerializer.Meta):
         fields = DossierSerializer.Meta.fields + ('proposals', 'documents')
+
+
+class RepresentativeVoteStatsSerializer(serializers.ModelSerializer):
+    """ Vote statistics of a representative, by representative pk """
+
+    class Meta:
+        model = models.RepresentativeVoteStats
+        fields = (
+            'representative',
+            'votes',
+            'total_for',
+            'total_against',
+            'total_abstain',
+            'proposals',
+            'participation',
+            'first_vote',
+            'last_vote',
+        )
+
+
+class GroupVoteSerializer(serializers.ModelSerializer):
+    """ Votes of a group on a proposal, by proposal pk """
+
+    class Meta:
+        model = models.GroupVote
+        fields = (
+            'proposal',
+            'group',
+            'total_for',
+            'total_against',
+            'total_abstain',
+            'cohesion',
+        )
+
+
+class ValuesSerializer(object):
+    """
+    Fast serializer of dicts from QuerySet.values(), with primary keys of
+    related objects instead of hyperlinks.
+
+    fields maps output field names to values() lookups, only datetimes are
+    converted like serializers.DateTimeField does.
+    """
+
+    fields = ()
+
+    _datetime = serializers.DateTimeField()
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def lookups(cls):
+        return [lookup for name, lookup in cls.fields]
+
+    def to_representation(self, row):
+        data = OrderedDict()
+        for name, lookup in self.fields:
+            value = row[lookup]
+            if isinstance(value, datetime.datetime):
+                value = self._datetime.to_representation(value)
+            data[name] = value
+        return data
+
+    @property
+    def data(self):
+        if self.many:
+            return ReturnList([self.to_representation(row)
+                               for row in self.instance], serializer=self)
+        return ReturnDict(self.to_representation(self.instance),
+                          serializer=self)
+
+
+class VoteValuesSerializer(ValuesSerializer):
+    fields = (
+        ('proposal', 'proposal_id'),
+        ('representative', 'representative_id'),
+        ('position', 'position'),
+    )
+
+
+class ProposalValuesSerializer(ValuesSerializer):
+    fields = (
+        ('id', 'id'),
+        ('dossier', 'dossier_id'),
+        ('title', 'title'),
+        ('description', 'description'),
+        ('reference', 'reference'),
+        ('datetime', 'datetime'),
+        ('kind', 'kind'),
+        ('total_abstain', 'total_abstain'),
+        ('total_against', 'total_against'),
+        ('total_for', 'total_for'),
+    )
+
+
+class DossierValuesSerializer(ValuesSerializer):
+    fields = (
+        ('id', 'id'),
+        ('title', 'title'),
+        ('reference', 'reference'),
+        ('text', 'text'),
+    )
@@ -0,0 +1,94 @@
+import json
+from collections import defaultdict
+
+from django import test
+
+from representatives_votes import agreement
+from representatives_votes.models import ImportGeneration, Vote
+
+
+class AgreementTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def setUp(self):
+        agreement._cache.clear()
+
+    def expected(self, votes):
+        positions = defaultdict(dict)
+        for vote in votes.filter(representative__isnull=False):
+            positions[vote.representative_id][vote.proposal_id] = \
+                vote.position
+
+        pairs = {}
+        for a in positions:
+            for b in positions:
+                common = set(positions[a]) & set(positions[b])
+                same = [p for p in common
+                        if positions[a][p] == positions[b][p]]
+                if common:
+                    pairs[a, b] = (len(same), len(common))
+        return pairs
+
+    def test_matrix(self):
+        with self.assertNumQueries(2):
+            matrix = agreement.get_agreement()
+
+        expected = self.expected(Vote.objects.all())
+        self.assertTrue(expected)
+        for (a, b), (same, common) in expected.items():
+            i, j = matrix.index[a], matrix.index[b]
+            self.assertEqual(matrix.same[i, j], same)
+            self.assertEqual(matrix.common[i, j], common)
+            self.assertEqual(matrix.ratios[i, j], float(same) / common)
+
+    def test_filters(self):
+        matrix = agreement.get_agreement(dossier='2', since='2000-01-01')
+        expected = self.expected(Vote.objects.filter(
+            proposal__dossier_id=2))
+        self.assertEqual(set(matrix.representatives),
+                         set(a for a, b in expected))
+
+    def test_cache(self):
+        matrix = agreement.get_agreement()
+        with self.assertNumQueries(1):
+            self.assertIs(agreement.get_agreement(), matrix)
+
+        self.assertIsNot(agreement.get_agreement(dossier='2'), matrix)
+
+        ImportGeneration.bump('vote')
+        self.assertIsNot(agreement.get_agreement(), matrix)
+
+    def test_api(self):
+        a, b = sorted(set(Vote.objects.filter(representative__isnull=False)
+                          .values_list('representative_id', flat=True)))[:2]
+        same, common = self.expected(Vote.objects.all())[a, b]
+
+        response = test.client.Client().get(
+            '/api/agreement/?representative=%s&k=1' % a)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['representative'], a)
+        self.assertEqual(len(data['most']), 1)
+        self.assertEqual(data['most'], data['least'])
+        self.assertEqual(data['most'][0], {
+            'representative': b,
+            'agreement': round(float(same) / common, 4),
+            'same': same,
+            'common': common,
+        })
+
+        response = test.client.Client().get(
+            '/api/agreement/?representative=%s&min_common=%s' % (
+                a, common + 1))
+        self.assertEqual(json.loads(response.content)['most'], [])
+
+    def test_api_errors(self):
+        for query, status in (('', 400), ('representative=a', 400),
+                              ('representative=1&since=x', 400),
+                              ('representative=1&k=0', 400),
+                              ('representative=1&k=-1', 400),
+                              ('representative=1&k=101', 400),
+                              ('representative=0', 404),
+                              ('representative=0&k=100', 404)):
+            response = test.client.Client().get('/api/agreement/?' + query)
+            self.assertEqual(response.status_code, status)
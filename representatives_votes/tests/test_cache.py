@@ -0,0 +1,130 @@
+import json
+
+from django import test
+from django.apps import apps
+from django.db.models.signals import post_save
+
+from representatives_votes.cache import (get_response_cache,
+                                         invalidate_responses)
+from representatives_votes.models import (Dossier, GroupVote,
+                                          ImportGeneration, Vote)
+
+
+@test.override_settings(REPRESENTATIVES_VOTES_RESPONSE_CACHE='local')
+class ResponseCacheTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def setUp(self):
+        get_response_cache().clear()
+
+    def get(self, url, cache, **headers):
+        headers.setdefault('HTTP_ACCEPT', 'application/json')
+        response = test.client.Client().get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Cache'], cache)
+        return response
+
+    def test_hit(self):
+        first = self.get('/api/proposals/?kind=Am%204&ordering=reference',
+                         'MISS')
+
+        # Import generations only
+        with self.assertNumQueries(1):
+            second = self.get(
+                '/api/proposals/?ordering=reference&kind=Am%204', 'HIT')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        self.get('/api/proposals/?kind=Am%204&ordering=reference', 'MISS',
+                 HTTP_ACCEPT='application/json; indent=4')
+        self.get('/api/proposals/?kind=Am%204', 'MISS')
+
+    def test_host(self):
+        first = self.get('/api/dossiers/', 'MISS')
+        self.get('/api/dossiers/', 'HIT')
+
+        for headers in ({'HTTP_HOST': 'public.example.org'},
+                        {'wsgi.url_scheme': 'https'}):
+            response = self.get('/api/dossiers/', 'MISS', **headers)
+            self.assertNotEqual(response.content, first.content)
+            self.get('/api/dossiers/', 'HIT', **headers)
+
+    def test_browsable_api(self):
+        for i in range(2):
+            response = test.client.Client().get('/api/dossiers/',
+                                                HTTP_ACCEPT='text/html')
+            self.assertNotIn('X-Cache', response)
+
+    def test_save_invalidates_scope(self):
+        etags = {url: self.get(url, 'MISS')['ETag']
+                 for url in ('/api/votes/', '/api/dossiers/')}
+
+        vote = Vote.objects.get(pk=1)
+        vote.position = 'for'
+        vote.save()
+
+        response = self.get('/api/votes/', 'MISS',
+                            HTTP_IF_NONE_MATCH=etags['/api/votes/'])
+        self.assertEqual(json.loads(response.content)[0]['position'], 'for')
+        self.assertNotEqual(response['ETag'], etags['/api/votes/'])
+        self.assertEqual(self.get('/api/dossiers/', 'HIT')['ETag'],
+                         etags['/api/dossiers/'])
+
+        Dossier.objects.get(pk=2).delete()
+        self.get('/api/dossiers/', 'MISS')
+
+    def test_receivers(self):
+        # Connected by the app config, not by importing the API
+        post_save.disconnect(invalidate_responses, sender=Vote)
+        apps.get_app_config('representatives_votes').ready()
+        self.assertIn(invalidate_responses, post_save._live_receivers(Vote))
+        self.assertNotIn(invalidate_responses,
+                         post_save._live_receivers(GroupVote))
+
+    def test_import_invalidates_scope(self):
+        for url in ('/api/votes/', '/api/dossiers/'):
+            self.get(url, 'MISS')
+
+        # Changes of importers are not seen before they are done
+        Vote.objects.filter(pk=1).update(position='for')
+        self.get('/api/votes/', 'HIT')
+
+        ImportGeneration.bump('vote')
+        self.get('/api/votes/', 'MISS')
+        self.get('/api/dossiers/', 'HIT')
+
+    @test.override_settings(REPRESENTATIVES_VOTES_RESPONSE_CACHE_SIZE=1)
+    def test_size(self):
+        self.get('/api/votes/', 'MISS')
+        self.get('/api/votes/', 'HIT')
+        self.get('/api/dossiers/', 'MISS')
+        self.get('/api/votes/', 'MISS')
+
+    @test.override_settings(
+        REPRESENTATIVES_VOTES_RESPONSE_CACHE='default',
+        CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_django_cache(self):
+        self.get('/api/votes/1/', 'MISS')
+        self.get('/api/votes/1/', 'HIT')
+
+        Vote.objects.get(pk=1).save()
+        self.get('/api/votes/1/', 'MISS')
+
+    def test_stats(self):
+        for cache in ('MISS', 'HIT', 'HIT'):
+            self.get('/api/dossiers/', cache)
+
+        response = test.client.Client().get('/api/response-cache/')
+        self.assertEqual(json.loads(response.content),
+                         {'enabled': True, 'hits': 2, 'misses': 1})
+        self.assertEqual(get_response_cache().stats(),
+                         {'hits': 2, 'misses': 1})
+
+    @test.override_settings(REPRESENTATIVES_VOTES_RESPONSE_CACHE=None)
+    def test_disabled(self):
+        response = test.client.Client().get('/api/dossiers/')
+        self.assertNotIn('X-Cache', response)
+        response = test.client.Client().get('/api/response-cache/')
+        self.assertEqual(json.loads(response.content), {'enabled': False})
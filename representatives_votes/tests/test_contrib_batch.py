@@ -0,0 +1,84 @@
+import mock
+import pytest
+
+from representatives_votes.contrib import batch as batch_module
+from representatives_votes.contrib.batch import TransactionBatch
+from representatives_votes.models import Dossier
+
+
+def _create_dossier(reference):
+    if reference == 'bad':
+        raise ValueError('Bad record')
+    Dossier.objects.create(reference=reference, title=reference)
+
+
+@pytest.mark.django_db
+def test_transaction_batch_size():
+    handler = mock.Mock(side_effect=_create_dossier)
+
+    with TransactionBatch(handler, size=2) as batch:
+        batch.add('a')
+        assert handler.call_count == 0
+        batch.add('b')
+        assert handler.call_count == 2
+        batch.add('c')
+
+    assert handler.call_count == 3
+    assert batch.imported == 3
+    assert Dossier.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_transaction_batch_interval():
+    handler = mock.Mock(side_effect=_create_dossier)
+    batch = TransactionBatch(handler, size=100, interval=10)
+
+    with mock.patch.object(batch_module.time, 'time', return_value=0):
+        batch.add('a')
+    with mock.patch.object(batch_module.time, 'time', return_value=5):
+        batch.add('b')
+    assert handler.call_count == 0
+
+    with mock.patch.object(batch_module.time, 'time', return_value=10):
+        batch.add('c')
+    assert handler.call_count == 3
+
+
+@pytest.mark.django_db
+def test_transaction_batch_retries_records():
+    on_rollback = mock.Mock()
+
+    with TransactionBatch(_create_dossier, size=3,
+                          on_rollback=on_rollback) as batch:
+        for reference in ('a', 'bad', 'c', 'd'):
+            batch.add(reference)
+
+    assert batch.imported == 3
+    assert batch.failed == 1
+    assert on_rollback.call_count == 2
+    assert sorted(Dossier.objects.values_list('reference', flat=True)) == [
+        'a', 'c', 'd']
+
+
+@pytest.mark.django_db
+def test_transaction_batch_before_commit():
+    created = []
+
+    def write():
+        # Fails the transaction like a bad record would
+        for reference in created:
+            _create_dossier(reference)
+        del created[:]
+
+    def forget():
+        del created[:]
+
+    with TransactionBatch(created.append, size=3, before_commit=write,
+                          on_rollback=forget) as batch:
+        for reference in ('a', 'bad', 'c', 'd'):
+            batch.add(reference)
+
+    assert batch.imported == 3
+    assert batch.failed == 1
+    assert sorted(Dossier.objects.values_list('reference', flat=True)) == [
+        'a', 'c', 'd']
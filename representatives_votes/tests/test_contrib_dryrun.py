@@ -0,0 +1,133 @@
+import pytest
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from representatives.models import Chamber, Representative
+from representatives_votes.contrib.dryrun import (BufferedDatabase, Database,
+                                                  DryRun)
+from representatives_votes.models import Document, Dossier, Proposal, Vote
+
+
+@pytest.mark.django_db
+def test_dry_run_lookups():
+    dossier = Dossier.objects.create(reference='a', title='a')
+    chamber = Chamber.objects.create(name='c', abbreviation='c')
+    Document.objects.create(dossier=dossier, chamber=chamber, link='l',
+                            kind='procedure-file')
+
+    db = DryRun()
+    assert db.get(Dossier, reference='a').pk == dossier.pk
+    assert db.get(Document, dossier_id=dossier.pk,
+                  kind='procedure-file').link == 'l'
+
+    with pytest.raises(Dossier.DoesNotExist):
+        db.get(Dossier, reference='b')
+
+    with pytest.raises(ValueError):
+        db.get(Dossier, title='a')
+
+
+@pytest.mark.django_db
+def test_dry_run_save():
+    Dossier.objects.create(reference='a', title='a')
+    db = DryRun()
+
+    with CaptureQueriesContext(connection) as queries:
+        new = Dossier(reference='b', title='b')
+        db.save(new)
+        assert new.pk < 0
+        assert db.get(Dossier, reference='b') is new
+
+        dossier = db.get(Dossier, reference='a')
+        dossier.reference = 'c'
+        db.save(dossier)
+        assert db.get(Dossier, reference='c') is dossier
+        with pytest.raises(Dossier.DoesNotExist):
+            db.get(Dossier, reference='a')
+
+    assert len(queries) == 0
+    assert list(Dossier.objects.values_list('reference', flat=True)) == ['a']
+
+
+@pytest.mark.django_db
+def test_dry_run_votes():
+    dossier = Dossier.objects.create(reference='a', title='a')
+    proposal = Proposal.objects.create(dossier=dossier, title='p',
+                                       datetime=timezone.now(), total_for=1,
+                                       total_against=0, total_abstain=0)
+    first = Representative.objects.create(slug='first', full_name='first')
+    second = Representative.objects.create(slug='second', full_name='second')
+    Vote.objects.create(proposal=proposal, representative=first,
+                        position='for')
+
+    db = DryRun()
+    vote = db.get(Vote, proposal_id=proposal.pk, representative_id=first.pk)
+    assert vote.position == 'for'
+
+    db.save(Vote(proposal_id=proposal.pk, representative_id=second.pk,
+                 position='for'))
+    assert db.count_votes([proposal.pk]) == {proposal.pk: {'for': 2}}
+    assert Vote.objects.count() == 1
+
+    with pytest.raises(Vote.DoesNotExist):
+        db.get(Vote, proposal_id=-1, representative_id=first.pk)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('database', [Database, DryRun])
+def test_load_votes(database):
+    dossier = Dossier.objects.create(reference='a', title='a')
+    first = Representative.objects.create(slug='first', full_name='first')
+    proposals = []
+    for title in 'pqr':
+        proposal = Proposal.objects.create(
+            dossier=dossier, title=title, datetime=timezone.now(),
+            total_for=1, total_against=0, total_abstain=0)
+        Vote.objects.create(proposal=proposal, representative=first,
+                            position='for')
+        proposals.append(proposal)
+
+    db = database()
+    with CaptureQueriesContext(connection) as queries:
+        pks = db.pks(Proposal, 'title', ['p', 'q', 'r', 's'])
+        db.load_votes(pks.values())
+        for proposal in proposals:
+            assert db.votes(proposal.pk)[first.pk].position == 'for'
+
+    # Proposals looked up in memory by dry runs, votes with one query
+    assert pks == {p.title: p.pk for p in proposals}
+    assert len(queries) == (1 if db.dry else 2)
+
+    # Then looked up again by the database, the importer may change them
+    with CaptureQueriesContext(connection) as queries:
+        assert list(db.votes(proposals[0].pk)) == [first.pk]
+    assert len(queries) == (0 if db.dry else 1)
+
+
+@pytest.mark.django_db
+def test_buffered_database_flush():
+    chamber = Chamber.objects.create(name='c', abbreviation='c')
+    sen = Dossier.objects.create(reference='sen', title='a')
+    db = BufferedDatabase()
+
+    with CaptureQueriesContext(connection) as queries:
+        # The reference of an existing dossier moves to a new one
+        dossier = db.get(Dossier, reference='sen')
+        dossier.reference = 'an'
+        db.save(dossier)
+        new = Dossier(reference='sen', title='b')
+        db.save(new)
+        db.save(Document(dossier=new, chamber=chamber, link='l',
+                         kind='procedure-file'))
+        assert db.get(Document, chamber_id=chamber.pk, dossier_id=new.pk,
+                      kind='procedure-file').link == 'l'
+    assert len(queries) == 0
+
+    db.flush()
+    assert Dossier.objects.get(pk=sen.pk).reference == 'an'
+    new = Dossier.objects.get(reference='sen')
+    assert db.get(Dossier, reference='sen').pk == new.pk
+    assert Document.objects.get().dossier_id == new.pk
+    assert Dossier.objects.get(pk=sen.pk).updated > sen.updated
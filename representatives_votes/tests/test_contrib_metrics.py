@@ -0,0 +1,53 @@
+import json
+
+import mock
+import pytest
+
+from representatives_votes.contrib import metrics as metrics_module
+from representatives_votes.contrib.metrics import ImportMetrics
+from representatives_votes.models import Dossier
+
+
+@pytest.mark.django_db
+def test_import_metrics_report(tmpdir):
+    output = tmpdir.join('report.json')
+
+    with ImportMetrics('test', output=output.strpath) as metrics:
+        for reference in metrics.iterate(['a', 'b']):
+            with metrics.stage('write'):
+                Dossier.objects.create(reference=reference, title=reference)
+            metrics.incr('dossiers', 'created')
+        metrics.incr('dossiers', 'skipped')
+
+    Dossier.objects.count()
+
+    report = json.loads(output.read())
+    assert report['importer'] == 'test'
+    assert report['records'] == 2
+    assert report['queries']['count'] == 2
+    assert set(report['stages'].keys()) == set(['parse', 'write'])
+    assert report['counts'] == {'dossiers': {'created': 2, 'skipped': 1}}
+
+
+def test_import_metrics_progress():
+    metrics = ImportMetrics('test', progress=2)
+
+    with mock.patch.object(metrics_module.logger, 'info') as info:
+        list(metrics.iterate(range(5)))
+
+    assert info.call_count == 2
+
+
+def test_import_metrics_merge():
+    metrics = ImportMetrics()
+    metrics.incr('votes', 'created', 3)
+
+    other = ImportMetrics()
+    other.incr('votes', 'created', 2)
+    other.incr('votes', 'updated')
+    other.query(1.5)
+    metrics.merge(other.report())
+
+    assert metrics.queries == 1
+    assert metrics.report()['counts'] == {
+        'votes': {'created': 5, 'updated': 1}}
@@ -0,0 +1,78 @@
+# coding: utf-8
+import random
+
+from representatives_votes.contrib.names import NameIndex, normalize
+
+
+def test_normalize():
+    assert normalize(u'Jean-Éric DUPONT') == normalize('Jean Eric Dupont')
+    assert normalize(u'Jean de La Fontaine') == normalize(u'Jean Fontaine')
+    assert normalize(u'Le') == u'le'
+    assert normalize(u'Pierre Martin') != normalize(u'Martin Pierre')
+
+
+def test_name_index_match():
+    index = NameIndex([
+        (u'Jean-Christophe Lagarde', 1),
+        (u'Marie-Noëlle Battistel', 2),
+        (u'Jean Dupont', 3),
+        (u'Jean DUPONT', 4),
+        (u'Patrice Martin-Lalande', 5),
+        (u'Patrice Martin-Lalonde', 6),
+        (u'Pierre Martin', 7),
+    ])
+
+    assert index.match(u'JEAN-CHRISTOPHE Lagarde') == (1, 'exact', 1)
+    assert index.get(u'Marie-Noelle Batistel') == 2
+    assert index.match(u'Jean Dupont')[:2] == (None, 'ambiguous')
+    assert index.match(u'Patrice Martin-Lalinde')[:2] == (None, 'ambiguous')
+    assert index.match(u'Someone Else')[:2] == (None, 'unmatched')
+    # Given and family names in another order are someone else
+    assert index.match(u'Martin Pierre')[:2] == (None, 'unmatched')
+    assert index.match(u'LAGARDE Jean-Christophe')[:2] == (None, 'unmatched')
+
+    stats = index.stats()
+    assert stats['names'] == 6
+    assert stats['lookups'] == {'exact': 1, 'fuzzy': 1, 'ambiguous': 2,
+                                'unmatched': 3}
+    assert 0.8 <= stats['fuzzy_min_score'] < 1
+
+
+def test_name_index_exact():
+    index = NameIndex([(u'Marie-Noëlle Battistel', 2)], fuzzy=False)
+    assert index.get(u'MARIE-NOELLE Battistel') == 2
+    assert index.match(u'Marie-Noelle Batistel') == (None, 'unmatched', 0)
+
+
+def test_name_index_scale():
+    rand = random.Random(0)
+    letters = u'abcdefghijklmnopqrstuvwxyzéè'
+
+    def word():
+        return u''.join(rand.choice(letters) for i in range(rand.randint(
+            4, 10))).capitalize()
+
+    names = [u'%s %s' % (word(), word()) for i in range(12000)]
+    index = NameIndex((name, pk) for pk, name in enumerate(names))
+
+    for pk in range(0, len(names), 40):
+        # Drop a letter
+        typo = names[pk][:3] + names[pk][4:]
+        index.get(typo)
+
+    # Fuzzy lookups score a small fraction of the names, benchmarks/names.py
+    # times them
+    stats = index.stats()
+    assert sum(stats['lookups'].values()) == 300
+    assert stats['lookups']['fuzzy'] > 250
+    assert stats['fuzzy_scored'] / 300 < len(names) / 100
+    assert stats['fuzzy_gave_up'] == 0
+
+    # Nor more than max_candidates of them, whatever the name
+    index.max_candidates = 10
+    index.cache = {}
+    for pk in range(0, len(names), 40):
+        index.get(names[pk][:3] + names[pk][4:])
+    stats = index.stats()
+    assert stats['fuzzy_scored'] / 300 < 20
+    assert stats['fuzzy_gave_up'] > 0
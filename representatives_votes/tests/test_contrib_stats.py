@@ -0,0 +1,83 @@
+import json
+
+from django import test
+from django.core.management import call_command
+from django.db.models import Max, Min
+
+from representatives_votes.contrib import stats
+from representatives_votes.models import (ImportGeneration, Proposal,
+                                          RepresentativeVoteStats, Vote)
+
+
+class VoteStatsTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def assertStats(self, representative_id):
+        votes = Vote.objects.filter(representative_id=representative_id)
+        stats = RepresentativeVoteStats.objects.get(
+            representative_id=representative_id)
+        period = votes.aggregate(first=Min('proposal__datetime'),
+                                 last=Max('proposal__datetime'))
+        proposals = Proposal.objects.filter(
+            datetime__gte=period['first'], datetime__lte=period['last'],
+            dossier__documents__chamber__in=votes.values(
+                'proposal__dossier__documents__chamber')).distinct().count()
+
+        self.assertEqual(stats.votes, votes.count())
+        for position in ('for', 'against', 'abstain'):
+            self.assertEqual(getattr(stats, 'total_%s' % position),
+                             votes.filter(position=position).count())
+        self.assertEqual(stats.first_vote, period['first'])
+        self.assertEqual(stats.last_vote, period['last'])
+        self.assertEqual(stats.proposals, proposals)
+        self.assertEqual(stats.participation,
+                         round(float(stats.votes) / proposals, 4))
+
+    def representatives(self):
+        return Vote.objects.filter(representative__isnull=False).order_by() \
+            .values_list('representative_id', flat=True).distinct()
+
+    def test_rebuild(self):
+        generation = ImportGeneration.current(['vote_stats'])['vote_stats']
+        call_command('rebuild_vote_stats')
+
+        self.assertEqual(RepresentativeVoteStats.objects.count(),
+                         len(set(self.representatives())))
+        for representative_id in self.representatives():
+            self.assertStats(representative_id)
+        self.assertNotEqual(
+            ImportGeneration.current(['vote_stats'])['vote_stats'],
+            generation)
+
+    def test_update(self):
+        stats.rebuild_vote_stats()
+        vote = Vote.objects.filter(representative__isnull=False).first()
+        vote.position = 'against' if vote.position == 'for' else 'for'
+        vote.save()
+
+        # Only the representatives active when the proposal was voted on
+        # are computed again
+        self.assertEqual(stats.update_vote_stats([vote.proposal_id]), 1)
+        self.assertStats(vote.representative_id)
+
+        # Nothing changed
+        self.assertEqual(stats.update_vote_stats([vote.proposal_id]), 0)
+
+    def test_api(self):
+        stats.rebuild_vote_stats()
+        representative_id = self.representatives()[0]
+
+        response = test.client.Client().get(
+            '/api/vote-stats/%s/' % representative_id)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['representative'], representative_id)
+        self.assertEqual(data['votes'], RepresentativeVoteStats.objects.get(
+            representative_id=representative_id).votes)
+
+        response = test.client.Client().get(
+            '/api/vote-stats/?ordering=-participation')
+        results = json.loads(response.content)
+        self.assertEqual(
+            [r['participation'] for r in results],
+            sorted([r['participation'] for r in results], reverse=True))
@@ -0,0 +1,57 @@
+import gzip
+import subprocess
+
+import ijson
+import mock
+import pytest
+
+from representatives_votes.contrib import utils
+
+DUMP = '[{"title": "foo", "total": 1.5}, {"title": "bar"}]'
+
+
+@pytest.mark.parametrize('extension', ['json', 'json.gz', 'json.xz'])
+def test_open_dump(tmpdir, extension):
+    path = tmpdir.join('dump.%s' % extension).strpath
+
+    if extension.endswith('.gz'):
+        with gzip.open(path, 'wb') as f:
+            f.write(DUMP)
+    else:
+        with open(path.replace('.xz', ''), 'wb') as f:
+            f.write(DUMP)
+
+    if extension.endswith('.xz'):
+        subprocess.check_call(['xz', path.replace('.xz', '')])
+
+    with utils.open_dump(path, 16) as f:
+        items = list(ijson.items(f, 'item'))
+
+    assert [i['title'] for i in items] == ['foo', 'bar']
+
+
+@pytest.mark.parametrize('backend', ['lzma', 'xz'])
+def test_open_dump_xz_error(tmpdir, backend):
+    if backend == 'lzma' and utils.lzma is None:
+        pytest.skip('lzma is not installed')
+
+    path = tmpdir.join('dump.json.xz')
+    path.write('not xz')
+
+    with mock.patch.object(utils, 'lzma',
+                           utils.lzma if backend == 'lzma' else None):
+        with pytest.raises(IOError):
+            with utils.open_dump(path.strpath) as f:
+                f.read()
+
+
+def test_read_ahead():
+    events = []
+
+    def load(chunk):
+        events.append(list(chunk))
+
+    for item in utils.read_ahead(iter(range(5)), load, 2):
+        events.append(item)
+
+    assert events == [[0, 1], 0, 1, [2, 3], 2, 3, [4], 4]
@@ -0,0 +1,72 @@
+import csv
+import json
+import mock
+from StringIO import StringIO
+
+from django import test
+from django.core.management import CommandError, call_command
+
+from representatives_votes import export
+from representatives_votes.models import Vote
+
+
+class ExportTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def get(self, url):
+        response = test.client.Client().get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return ''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        with self.assertNumQueries(2):
+            rows = [json.loads(l) for l in
+                    self.get('/api/vote-export/').splitlines()]
+
+        self.assertEqual(len(rows), Vote.objects.count())
+        vote = Vote.objects.select_related('proposal__dossier').get(pk=1)
+        self.assertEqual(rows[0], {
+            'proposal': vote.proposal_id,
+            'proposal_reference': vote.proposal.reference,
+            'datetime': vote.proposal.datetime.isoformat(),
+            'dossier': vote.proposal.dossier.reference,
+            'representative': vote.representative_id,
+            'representative_slug': vote.representative.slug,
+            'representative_name': vote.representative_name,
+            'position': vote.position,
+        })
+
+    def test_csv_filters(self):
+        rows = list(csv.reader(StringIO(self.get(
+            '/api/vote-export/?output=csv&dossier=2&since=2000-01-01'))))
+
+        self.assertEqual(rows[0], [name for name, lookup in export.FIELDS])
+        self.assertEqual(len(rows) - 1, Vote.objects.filter(
+            proposal__dossier_id=2).count())
+
+    def test_invalid_filters(self):
+        for query in ('output=xml', 'since=yesterday', 'dossier=a'):
+            response = test.client.Client().get('/api/vote-export/?' + query)
+            self.assertEqual(response.status_code, 400)
+
+    @mock.patch.object(export, 'CHUNK_SIZE', 4)
+    def test_chunks(self):
+        votes = Vote.objects.order_by('pk')
+        # 11 votes in 3 queries
+        with self.assertNumQueries(3):
+            rows = list(export.iter_votes())
+
+        self.assertEqual([r[0] for r in rows],
+                         [v.proposal_id for v in votes])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_votes', format='csv', chamber='EP', stdout=out)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        count = export.filter_votes(Vote.objects.all(), chamber='EP').count()
+        self.assertTrue(count)
+        self.assertEqual(len(rows) - 1, count)
+
+        with self.assertRaises(CommandError):
+            call_command('export_votes', until='2015-13-01')
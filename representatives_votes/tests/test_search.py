@@ -0,0 +1,116 @@
+# coding: utf-8
+import json
+
+import mock
+from django import test
+from django.core.management import call_command
+
+from representatives_votes import search
+from representatives_votes.models import (Dossier, DossierSearchDocument,
+                                          ImportGeneration, Proposal,
+                                          ProposalSearchDocument)
+
+
+class SearchTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def setUp(self):
+        call_command('rebuild_search_index')
+
+    def get(self, url):
+        response = test.client.Client().get(url,
+                                            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_documents(self):
+        self.assertEqual(DossierSearchDocument.objects.count(),
+                         Dossier.objects.count())
+        self.assertEqual(ProposalSearchDocument.objects.count(),
+                         Proposal.objects.count())
+
+        text = Dossier.objects.get(pk=1).search_document.text
+        self.assertIn('2012/2002(INI)', text)
+        # Without accents, which PostgreSQL indexes would keep
+        self.assertIn(u'Charles Goerens - Resolution', text)
+        self.assertIn('2016 general budget',
+                      Proposal.objects.get(pk=3).search_document.text)
+
+    def test_dossiers(self):
+        # Once per proposal, without the join of search_fields
+        data = self.get('/api/dossiers/?search=goerens')
+        self.assertEqual([d['id'] for d in data], [1])
+
+        data = self.get('/api/dossiers/?search=budget,fernandes')
+        self.assertEqual([d['id'] for d in data], [2])
+        self.assertEqual(self.get('/api/dossiers/?search=budget goerens'),
+                         [])
+
+    def test_proposals(self):
+        # Words and prefixes of the proposal and of its dossier, accents
+        # ignored
+        data = self.get('/api/proposals/?search=Gerard%20bud')
+        self.assertEqual(set(p['id'] for p in data), {3, 4, 5, 6})
+
+        data = self.get('/api/proposals/?search=resolution')
+        self.assertEqual([p['id'] for p in data], [2])
+
+        # Not parsed as a query
+        self.assertEqual(self.get('/api/proposals/?search=%22a%20OR'), [])
+
+    def test_without_fts5(self):
+        # SQLite built without FTS5 has no index to rank rows with
+        with mock.patch.dict(search._fts5, default=False):
+            data = self.get('/api/proposals/?search=Gerard%20bud')
+        self.assertEqual(set(p['id'] for p in data), {3, 4, 5, 6})
+
+        with mock.patch.dict(search._fts5, default=False):
+            data = self.get(u'/api/proposals/?search=r\xe9solution')
+        self.assertEqual([p['id'] for p in data], [2])
+
+    def test_not_computed(self):
+        # As left by the migration, before any import or rebuild
+        for document in search.DOCUMENTS.values():
+            document.objects.all().delete()
+        ImportGeneration.objects.filter(scope='search').update(generation=0)
+
+        # Import generations and proposals, searched with search_fields
+        with self.assertNumQueries(2):
+            data = self.get('/api/proposals/?search=budget')
+        self.assertEqual(set(p['id'] for p in data), {3, 4, 5, 6})
+
+    def test_ordering(self):
+        # Proposals with "development" in their title rank first
+        proposal = Proposal.objects.get(pk=5)
+        proposal.title = 'Development policy of development'
+        proposal.save()
+        search.update_search_documents()
+
+        data = self.get('/api/proposals/?search=development')
+        self.assertEqual([p['id'] for p in data], [5, 1, 2])
+
+        data = self.get(
+            '/api/proposals/?search=development&ordering=reference')
+        self.assertEqual([p['id'] for p in data][-1], 5)
+
+        data = self.get('/api/proposals/?search=development&flat=1')
+        self.assertEqual([p['id'] for p in data], [5, 1, 2])
+
+    def test_update(self):
+        dossier = Dossier.objects.get(pk=2)
+        dossier.title = 'Budget of 2017'
+        dossier.save()
+        # Not changed since the last update
+        ProposalSearchDocument.objects.filter(proposal_id=1).update(text='')
+
+        # The dossier and its 4 proposals
+        self.assertEqual(search.update_search_documents(), 5)
+        self.assertEqual(
+            [p['id'] for p in self.get('/api/proposals/?search=2017')],
+            [3, 4, 5, 6])
+        self.assertEqual(
+            ProposalSearchDocument.objects.get(proposal_id=1).text, '')
+
+    def test_delete(self):
+        Dossier.objects.get(pk=2).delete()
+        self.assertEqual(self.get('/api/proposals/?search=budget'), [])
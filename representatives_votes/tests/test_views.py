@@ -1,13 +1,22 @@
+import json
+
 from django import test
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from responsediff.response import Response
 
+from representatives_votes.models import (GroupVote, ImportGeneration,
+                                          Proposal, Vote)
+
 
 class RepresentativeManagerTest(test.TestCase):
     fixtures = ['representatives_votes_test.json']
 
     def functional_test(self, queries, url):
-        with self.assertNumQueries(queries):
+        # One more for import generations
+        with self.assertNumQueries(queries + 1):
             result = test.client.Client().get(
                 url,
                 HTTP_ACCEPT='application/json; indent=4',
@@ -35,3 +44,242 @@ class RepresentativeManagerTest(test.TestCase):
 
     def test_votes(self):
         self.functional_test(1, '/api/votes/')
+
+    def test_dossiers_flat(self):
+        self.functional_test(1, '/api/dossiers/?flat=1')
+
+    def test_proposals_flat(self):
+        self.functional_test(1, '/api/proposals/?flat=1')
+
+    def test_votes_flat(self):
+        self.functional_test(1, '/api/votes/?flat=1')
+
+    def test_vote_matrix_proposals(self):
+        self.functional_test(1, '/api/vote-matrix/?proposal=3,1')
+
+    def test_vote_matrix_dossier(self):
+        self.functional_test(1, '/api/vote-matrix/?dossier=2')
+
+    def test_vote_matrix_bad_request(self):
+        for url in ('/api/vote-matrix/', '/api/vote-matrix/?dossier=a'):
+            with self.assertNumQueries(1):
+                result = test.client.Client().get(url)
+            self.assertEqual(result.status_code, 400)
+
+
+class ConditionalGetTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+    api_urls = ['/api/dossiers/', '/api/dossiers/1/', '/api/proposals/',
+                '/api/proposals/1/', '/api/votes/', '/api/votes/1/']
+
+    def get(self, url, **headers):
+        return test.client.Client().get(url, HTTP_ACCEPT='application/json',
+                                        **headers)
+
+    def test_not_modified(self):
+        for url in self.api_urls:
+            response = self.get(url)
+            self.assertEqual(response.status_code, 200)
+
+            with self.assertNumQueries(1):
+                result = self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(result.status_code, 304)
+            self.assertEqual(result.content, '')
+            self.assertEqual(result['ETag'], response['ETag'])
+
+            with self.assertNumQueries(1):
+                result = self.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(result.status_code, 304)
+
+    def test_modified(self):
+        for url in self.api_urls:
+            response = self.get(url)
+            self.assertEqual(
+                self.get(url, HTTP_IF_NONE_MATCH='"json-0.0"').status_code,
+                200)
+
+            # Imports change validators of the models they wrote
+            ImportGeneration.bump('proposal')
+            result = self.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(result.status_code, 200)
+            self.assertNotEqual(result['ETag'], response['ETag'])
+
+    def test_remove_dossiers_bumps_generation(self):
+        before = ImportGeneration.current(['dossier'])['dossier'][0]
+        call_command('remove_dossiers_without_proposal')
+        self.assertEqual(ImportGeneration.current(['dossier'])['dossier'][0],
+                         before + 1)
+
+
+class KeysetPaginationTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def get(self, url):
+        response = test.client.Client().get(url,
+                                            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def walk(self, url, key):
+        pages = []
+        data = self.get(url)
+        self.assertIsNone(data['previous'])
+        while True:
+            pages.append([key(r) for r in data['results']])
+            if not data['next']:
+                break
+            # Import generations + the page, however deep
+            with self.assertNumQueries(2):
+                data = self.get(data['next'])
+
+        self.assertTrue(all(len(p) == 4 for p in pages[:-1]))
+
+        # Back to the first page
+        back = [pages[-1]]
+        while data['previous']:
+            data = self.get(data['previous'])
+            back.insert(0, [key(r) for r in data['results']])
+        self.assertEqual(back, pages)
+
+        return [row for page in pages for row in page]
+
+    def test_votes(self):
+        def key(row):
+            return tuple(int(row[f].rstrip('/').split('/')[-1])
+                         for f in ('proposal', 'representative'))
+
+        self.assertEqual(
+            self.walk('/api/votes/?cursor=&page_size=4', key),
+            list(Vote.objects.order_by('proposal_id', 'id')
+                 .values_list('proposal_id', 'representative_id')))
+
+    def test_votes_flat(self):
+        self.assertEqual(
+            self.walk('/api/votes/?cursor=&page_size=4&flat=1',
+                      lambda row: (row['proposal'], row['representative'])),
+            list(Vote.objects.order_by('proposal_id', 'id')
+                 .values_list('proposal_id', 'representative_id')))
+
+    def test_proposals(self):
+        self.assertEqual(
+            self.walk('/api/proposals/?cursor=&page_size=4',
+                      lambda row: row['id']),
+            list(Proposal.objects.order_by('datetime', 'id')
+                 .values_list('pk', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = test.client.Client().get('/api/votes/?cursor=nope')
+        self.assertEqual(response.status_code, 404)
+
+
+class SparseFieldsTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def get(self, url, status=200):
+        response = test.client.Client().get(url,
+                                            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, status)
+        return json.loads(response.content)
+
+    def get_sql(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.get(url)
+        return data, ' '.join(q['sql'] for q in queries)
+
+    def test_fields(self):
+        data, sql = self.get_sql('/api/proposals/?fields=id,title,datetime')
+        self.assertEqual([set(row) for row in data],
+                         [{'id', 'title', 'datetime'}] * len(data))
+        self.assertNotIn('"description"', sql)
+
+    def test_omit(self):
+        data, sql = self.get_sql('/api/dossiers/?omit=text')
+        self.assertEqual(set(data[0]), {'id', 'url', 'title', 'reference'})
+        self.assertNotIn('"text"', sql)
+
+    def test_flat(self):
+        data, sql = self.get_sql('/api/proposals/?flat=1&omit=description')
+        self.assertNotIn('description', data[0])
+        self.assertNotIn('"description"', sql)
+
+        data = self.get('/api/votes/?flat=1&fields=position')
+        self.assertEqual(data[0], {'position': 'abstain'})
+
+    def test_detail(self):
+        # Import generations, the dossier and its documents only
+        with self.assertNumQueries(3):
+            data = self.get('/api/dossiers/1/?fields=id,documents')
+        self.assertEqual(set(data), {'id', 'documents'})
+
+    def test_cursor(self):
+        data = self.get('/api/proposals/?cursor=&page_size=2&fields=id')
+        self.assertEqual(data['results'], [{'id': 1}, {'id': 2}])
+        with self.assertNumQueries(2):
+            self.get(data['next'])
+
+    def test_votes(self):
+        # Neither proposals nor representatives are read, hyperlinks only
+        # need the foreign keys of votes
+        for url in ('/api/votes/?fields=position',
+                    '/api/votes/?fields=proposal,representative'):
+            # Import generations and votes, not a query per row
+            with self.assertNumQueries(2):
+                data, sql = self.get_sql(url)
+            self.assertEqual(len(data), Vote.objects.count())
+            self.assertNotIn('"representatives_votes_proposal"."description"',
+                             sql)
+            self.assertNotIn('"representatives_representative"."', sql)
+        self.assertIn('/api/proposals/', data[0]['proposal'])
+
+    def test_unknown_field(self):
+        self.get('/api/votes/?fields=position,nope', status=400)
+
+
+class GroupVoteTest(test.TestCase):
+    fixtures = ['representatives_votes_test.json']
+
+    def setUp(self):
+        for proposal in Proposal.objects.all():
+            for group, totals in (('EPP', (3, 1, 0)), ('S&D', (1, 1, 2))):
+                group_vote = GroupVote(proposal=proposal, group=group)
+                (group_vote.total_for, group_vote.total_against,
+                 group_vote.total_abstain) = totals
+                group_vote.update_cohesion()
+                group_vote.save()
+
+    def get(self, url):
+        response = test.client.Client().get(url,
+                                            HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_proposals(self):
+        # Import generations and group votes
+        with self.assertNumQueries(2):
+            data = self.get('/api/group-votes/?proposal__id__in=2,1')
+
+        self.assertEqual([(r['proposal'], r['group']) for r in data], [
+            (1, 'EPP'), (1, 'S&D'), (2, 'EPP'), (2, 'S&D')])
+        self.assertEqual(data[0], {
+            'proposal': 1,
+            'group': 'EPP',
+            'total_for': 3,
+            'total_against': 1,
+            'total_abstain': 0,
+            'cohesion': 0.625,
+        })
+
+    def test_cohesion(self):
+        data = self.get('/api/group-votes/?group=S%26D&cohesion__lte=0.5')
+        self.assertEqual(len(data), Proposal.objects.count())
+        self.assertEqual(set(r['cohesion'] for r in data), {0.25})
+
+    def test_even_split(self):
+        for totals, cohesion in (((2, 2, 2), 0), ((3, 3, 0), 0.25),
+                                 ((0, 0, 5), 1), ((0, 0, 0), 0)):
+            group_vote = GroupVote(group='EPP')
+            (group_vote.total_for, group_vote.total_against,
+             group_vote.total_abstain) = totals
+            group_vote.update_cohesion()
+            self.assertEqual(group_vote.cohesion, cohesion)
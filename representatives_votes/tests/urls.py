@@ -3,8 +3,14 @@ from django.conf.urls import include, url
 from rest_framework import routers
 
 from representatives_votes.api import (
+    AgreementViewSet,
     DossierViewSet,
+    GroupVoteViewSet,
     ProposalViewSet,
+    RepresentativeVoteStatsViewSet,
+    ResponseCacheViewSet,
+    VoteExportViewSet,
+    VoteMatrixViewSet,
     VoteViewSet,
 )
 
@@ -27,6 +33,13 @@ router.register('representatives', RepresentativeViewSet, 'api-representative')
 router.register('dossiers', DossierViewSet, 'api-dossier')
 router.register('proposals', ProposalViewSet, 'api-proposal')
 router.register('votes', VoteViewSet, 'api-vote')
+router.register('vote-matrix', VoteMatrixViewSet, 'api-vote-matrix')
+router.register('vote-export', VoteExportViewSet, 'api-vote-export')
+router.register('group-votes', GroupVoteViewSet, 'api-group-vote')
+router.register('agreement', AgreementViewSet, 'api-agreement')
+router.register('vote-stats', RepresentativeVoteStatsViewSet,
+                'api-vote-stats')
+router.register('response-cache', ResponseCacheViewSet, 'api-response-cache')
 
 urlpatterns = [
     url('api/', include(router.urls)),
@@ -23,10 +23,19 @@ setup(
             'django-filter>=0.13,<0.14',
             'djangorestframework>=3.3,<3.4',
         ],
+        # For /api/agreement/
+        'agreement': [
+            'numpy',
+        ],
+        # Without it .xz dumps are decompressed by the xz command
+        'xz': [
+            'backports.lzma',
+        ],
         'testing': [
             'codecov>=2,<3',
             'flake8>=2,<3',
             'mock>=2,<3',
+            'numpy',
             'pep8>=1,<2',
             'pytest>=2,<3',
             'pytest-django>=2,<3',